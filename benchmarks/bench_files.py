@@ -0,0 +1,43 @@
+"""
+Measures the throughput (in files per second) of egginst when installing
+and removing an egg with many small files, which is dominated by the file
+system operations per file, rather than by decompressing the data.
+
+usage: python bench_files.py [N_FILES]    (defaults to 30000)
+"""
+import sys
+import time
+import shutil
+import tempfile
+from os.path import join
+
+from egginst.main import EggInst
+
+import synth
+
+
+def noop(*args):
+    pass
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        egg_path = join(tmp_dir, 'many-1.0-1.egg')
+        synth.write_egg(egg_path, n_files=n, file_size=100)
+        prefix = join(tmp_dir, 'prefix')
+        for action in 'install', 'remove', 'install', 'remove':
+            ei = EggInst(egg_path, prefix)
+            ei.progress_callback = noop
+            t0 = time.time()
+            getattr(ei, action)()
+            t = time.time() - t0
+            print "%-8s %6d files %8.3f sec  %8.0f files/sec" % (
+                action, n, t, n / t)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
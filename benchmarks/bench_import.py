@@ -0,0 +1,87 @@
+"""
+Compares the time it takes to import modules from many packages installed
+(a) into site-packages, (b) in hook mode with each package directory on
+sys.path, and (c) in hook mode using the compiled registry finder.  Each
+case is timed in a fresh interpreter.
+
+usage: python bench_import.py [N_PACKAGES]    (defaults to 300)
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from os.path import abspath, dirname, join
+
+from egginst import registry
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+TIMER = """
+import sys, time
+sys.path.insert(0, %(root)r)
+t0 = time.time()
+%(setup)s
+for i in xrange(%(n)d):
+    __import__('bpkg%%04d.sub' %% i)
+    __import__('bmod%%04d' %% i)
+print '%%.4f' %% (time.time() - t0)
+"""
+
+
+def write_package(dir_path, i):
+    pkg = join(dir_path, 'bpkg%04d' % i)
+    os.makedirs(pkg)
+    open(join(pkg, '__init__.py'), 'w').write('x = %d\n' % i)
+    open(join(pkg, 'sub.py'), 'w').write('y = %d\n' % i)
+    open(join(dir_path, 'bmod%04d.py' % i), 'w').write('z = %d\n' % i)
+
+
+def run(setup, n):
+    code = TIMER % dict(root=ROOT, setup=setup, n=n)
+    times = []
+    for dummy in xrange(3):
+        out = subprocess.Popen([sys.executable, '-c', code],
+                               stdout=subprocess.PIPE).communicate()[0]
+        times.append(float(out))
+    return min(times)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        site_packages = join(tmp_dir, 'site-packages')
+        pkgs_dir = join(tmp_dir, 'pkgs')
+        for i in xrange(n):
+            write_package(site_packages, i)
+            write_package(join(pkgs_dir, 'bpkg%04d-1.0-1' % i), i)
+
+        # in hook mode, each package has its own registry
+        src = join(tmp_dir, 'registry.txt')
+        fo = open(src, 'w')
+        for fn in sorted(os.listdir(pkgs_dir)):
+            reg, pth = registry.create_hooks_dir(join(pkgs_dir, fn))
+            for kv in reg.iteritems():
+                fo.write('%s  %s\n' % kv)
+        fo.close()
+        dst = join(tmp_dir, 'registry.bin')
+        registry.compile_file(src, dst)
+
+        dirs = [join(pkgs_dir, fn) for fn in sorted(os.listdir(pkgs_dir))]
+        cases = [
+            ('site-packages', 'sys.path.append(%r)' % site_packages),
+            ('hook, sys.path', 'sys.path.extend(%r)' % dirs),
+            ('hook, registry', 'from egginst import registry\n'
+                               'registry.install_finder(%r)' % dst),
+        ]
+        print "importing %d packages and %d modules" % (n, n)
+        for name, setup in cases:
+            print "%-16s: %8.4f sec" % (name, run(setup, n))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
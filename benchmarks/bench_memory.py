@@ -0,0 +1,68 @@
+"""
+Measures the resident memory used by a Chain holding a large index.
+
+usage: python bench_memory.py [N_SPECS]    (defaults to 50000)
+"""
+import sys
+import time
+import shutil
+import resource
+import tempfile
+from os.path import join
+
+from enstaller.indexed_repo import Chain
+
+import synth
+
+
+def maxrss_mb():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OSX
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024.0
+
+
+def rss_mb():
+    """
+    return the current resident memory, which is only available on Linux,
+    elsewhere the maximal resident memory is returned
+    """
+    try:
+        fi = open('/proc/self/statm')
+    except IOError:
+        return maxrss_mb()
+    pages = int(fi.read().split()[1])
+    fi.close()
+    return pages * resource.getpagesize() / 2.0**20
+
+
+def main():
+    n_specs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fo = open(join(tmp_dir, 'index-depend.txt'), 'w')
+        fo.write(synth.index_data(n_specs))
+        fo.close()
+
+        before = rss_mb()
+        t0 = time.time()
+        c = Chain()
+        c.add_repo('file://%s/' % tmp_dir, 'index-depend.txt')
+        dt = time.time() - t0
+        after = rss_mb()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    n = len(c.index)
+    print "specs loaded   : %i" % n
+    print "load time      : %.2f sec" % dt
+    print "RSS before     : %.1f MB" % before
+    print "RSS after      : %.1f MB" % after
+    print "max RSS        : %.1f MB" % maxrss_mb()
+    print "per spec       : %.0f bytes" % ((after - before) * 2**20 / n)
+
+
+if __name__ == '__main__':
+    main()
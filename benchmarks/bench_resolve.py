@@ -0,0 +1,71 @@
+"""
+Times the creation of requirement objects and the resolution of install
+sequences on a synthetic index.
+
+usage: python bench_resolve.py [N_SPECS]    (defaults to 20000)
+"""
+import sys
+import time
+import shutil
+import tempfile
+from os.path import join
+
+from enstaller.indexed_repo import Chain, Req
+from enstaller.indexed_repo.cache import ResolveCache
+
+import synth
+
+
+def best_of(func, repeat=3):
+    times = []
+    for dummy in xrange(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def main():
+    n_specs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fo = open(join(tmp_dir, 'index-depend.txt'), 'w')
+        fo.write(synth.index_data(n_specs))
+        fo.close()
+        c = Chain()
+        c.add_repo('file://%s/' % tmp_dir, 'index-depend.txt')
+        run(c)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def run(c):
+
+    names = sorted(c.groups)
+    req_strings = ['%s 1.%i.0-%i' % (name, v, b)
+                   for name in names for v in range(5) for b in (1, 2)]
+
+    def create_reqs():
+        for s in req_strings:
+            Req(s)
+
+    def get_dists():
+        for name in names:
+            c.get_dist(Req(name))
+
+    def resolve(mode):
+        for name in names[-20:]:
+            c.install_sequence(Req(name), mode)
+
+    print "specs: %i, projects: %i" % (len(c.index), len(names))
+    print "Req()            : %8.3f sec" % best_of(create_reqs)
+    print "get_dist         : %8.3f sec" % best_of(get_dists)
+    print "flat sequences   : %8.3f sec" % best_of(lambda: resolve('flat'))
+    print "recur sequences  : %8.3f sec" % best_of(lambda: resolve('recur'))
+    c.resolve_cache = ResolveCache(c.repos[0][7:] + 'cache')
+    print "cached sequences : %8.3f sec" % best_of(lambda: resolve('recur'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Times the backtracking resolver on a suite of hard resolution cases.
+
+usage: python bench_solver.py
+"""
+import time
+import shutil
+import tempfile
+from os.path import join
+
+from enstaller.indexed_repo import Chain, Req, add_Reqs_to_spec
+from enstaller.indexed_repo.resolver import Resolver, ResolutionError
+
+import synth
+
+
+REPO = 'file:///repo/'
+
+
+def make_chain(dists):
+    """
+    return a Chain, given a list of tuples(name, version, packages)
+    """
+    c = Chain()
+    for name, version, packages in dists:
+        spec = dict(metadata_version='1.1', name=name, version=version,
+                    build=1, python=None, packages=packages)
+        add_Reqs_to_spec(spec)
+        c.add_dist('%s%s-%s-1.egg' % (REPO, name, version), spec)
+    return c
+
+
+def case_propagation(n=200, n_versions=20):
+    """
+    p0 requires p1, ..., p(n-1) by name, and the version k of each project
+    requires version k of the next one, but only version 0 of the last
+    project exists, such that the latest versions all have to be rejected
+    """
+    dists = [('root', '1.0', ['p%i' % i for i in xrange(n)])]
+    for i in xrange(n - 1):
+        for k in xrange(n_versions):
+            dists.append(('p%i' % i, '1.%i' % k, ['p%i 1.%i' % (i + 1, k)]))
+    dists.append(('p%i' % (n - 1), '1.0', []))
+    return make_chain(dists), [Req('root')]
+
+
+def case_backjump(n=30, n_versions=10):
+    """
+    many independent projects are chosen early, but the conflict is caused
+    by a single project which is chosen first and has to be revised,
+    chronological backtracking would try all combinations of the
+    independent projects
+    """
+    packages = ['x'] + ['q%i' % i for i in xrange(n)] + ['y']
+    dists = [('root', '1.0', packages)]
+    for k in xrange(n_versions):
+        dists.append(('x', '1.%i' % k, []))
+        for i in xrange(n):
+            dists.append(('q%i' % i, '1.%i' % k, []))
+    # only the oldest version of y works with x, and y has many versions
+    for k in xrange(n_versions):
+        dists.append(('y', '2.%i' % k, ['x <1.1', 'z 1.%i' % k]))
+    dists.append(('z', '1.0', []))
+    return make_chain(dists), [Req('root')]
+
+
+def case_unsatisfiable(n=30, n_versions=10):
+    """
+    like the previous case, but without a solution, such that the whole
+    (pruned) search space has to be explored
+    """
+    packages = ['x'] + ['q%i' % i for i in xrange(n)] + ['y']
+    dists = [('root', '1.0', packages)]
+    for k in xrange(n_versions):
+        dists.append(('x', '1.%i' % k, []))
+        dists.append(('y', '1.%i' % k, ['x >1.%i' % (n_versions - 1)]))
+        for i in xrange(n):
+            dists.append(('q%i' % i, '1.%i' % k, []))
+    return make_chain(dists), [Req('root')]
+
+
+def case_large_ranges(n_specs=20000):
+    """
+    a large synthetic index with random version ranges
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fo = open(join(tmp_dir, 'index-depend.txt'), 'w')
+        fo.write(synth.index_data(n_specs, ranges=True))
+        fo.close()
+        c = Chain()
+        c.add_repo('file://%s/' % tmp_dir, 'index-depend.txt')
+    finally:
+        shutil.rmtree(tmp_dir)
+    names = sorted(c.groups)[-10:]
+    return c, [Req(name) for name in names]
+
+
+def main():
+    fmt = '%-20s %10s %10s  %s'
+    print fmt % ('case', 'time [s]', 'steps', 'result')
+    print 60 * '-'
+    for name, case in [
+        ('propagation', case_propagation),
+        ('backjump', case_backjump),
+        ('unsatisfiable', case_unsatisfiable),
+        ('large-ranges', case_large_ranges),
+        ]:
+        c, reqs = case()
+        resolver = Resolver(c)
+        t0 = time.time()
+        try:
+            n = len(resolver.solve(reqs))
+            result = '%i dists' % n
+        except ResolutionError as e:
+            result = 'failed: %s' % str(e)[:40]
+        print fmt % (name, '%.3f' % (time.time() - t0),
+                     resolver.steps, result)
+
+
+if __name__ == '__main__':
+    main()
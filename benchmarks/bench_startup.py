@@ -0,0 +1,78 @@
+"""
+Measures the cold-start cost of enpkg and egginst commands which do not
+need any index, i.e. the time it takes to start the interpreter, import
+the modules and run the command.  Each command is run in a fresh
+interpreter, and the number of modules imported is shown as well.
+
+usage: python bench_startup.py [N_RUNS]    (defaults to 10)
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from os.path import abspath, dirname, join
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+CODE = """
+import sys
+sys.path.insert(0, %(root)r)
+sys.argv = %(argv)r
+if %(module)r:
+    main = __import__(%(module)r, fromlist=['main']).main
+    try:
+        main()
+    except SystemExit:
+        pass
+sys.stderr.write('%%d\\n' %% len([m for m in sys.modules.values() if m]))
+"""
+
+
+def run(module, argv, n, env):
+    code = CODE % dict(root=ROOT, module=module, argv=argv)
+    times = []
+    for dummy in xrange(n):
+        t0 = time.time()
+        p = subprocess.Popen([sys.executable, '-c', code], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        times.append(time.time() - t0)
+    return min(times), int(err.splitlines()[-1])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        prefix = join(tmp_dir, 'prefix')
+        os.mkdir(prefix)
+        # use a config file with an empty local repository, such that no
+        # index is ever downloaded
+        os.mkdir(join(tmp_dir, 'repo'))
+        env = dict(os.environ, HOME=tmp_dir)
+        open(join(tmp_dir, '.enstaller4rc'), 'w').write(
+            'IndexedRepos = [%r]\n' % ('file://%s/repo/' % tmp_dir))
+
+        base = run(None, ['python'], n, env)
+        print "%-28s %8.4f sec  %4d modules" % ('python (no command)',
+                                                 base[0], base[1])
+        for module, argv in [
+            ('enstaller.main', ['enpkg', '--version']),
+            ('enstaller.main', ['enpkg', '--path', '--prefix', prefix]),
+            ('enstaller.main', ['enpkg', '--list', '--prefix', prefix]),
+            ('egginst.main',   ['egginst', '--list', '--prefix', prefix]),
+            ]:
+            t, n_modules = run(module, argv, n, env)
+            name = ' '.join([argv[0]] + [a for a in argv[1:]
+                                         if a.startswith('--') and
+                                         a != '--prefix'])
+            print "%-28s %8.4f sec  %4d modules" % (name, t, n_modules)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
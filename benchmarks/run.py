@@ -0,0 +1,245 @@
+"""
+Runs the benchmark suite on synthetic data, and compares the timings with
+a stored baseline (baseline.json in this directory), such that performance
+regressions show up.  Each timing is the best of several runs.
+
+usage: python run.py [options] [CASE ...]
+
+The exit status is 1 if any timing is slower than the baseline by more
+than the tolerance.  Use --save to store the timings as the new baseline
+(after a deliberate change, or on a new machine).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from os.path import abspath, dirname, isdir, isfile, join
+
+from egginst.main import EggInst
+from enstaller.history import History
+from enstaller.indexed_repo import Chain, Req, metadata
+
+import synth
+from bench_solver import make_chain
+
+
+BASELINE = join(dirname(abspath(__file__)), 'baseline.json')
+
+# slowdowns smaller than this (in seconds) are considered noise
+NOISE = 0.005
+
+
+def best_of(func, repeat=3, setup=None):
+    times = []
+    for dummy in xrange(repeat):
+        if setup:
+            setup()
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def noop(*args):
+    pass
+
+
+def bench_parse_index(tmp_dir, scale):
+    res = {}
+    for n in 10000, 100000:
+        n = int(n * scale)
+        data = synth.index_data(n)
+        res['parse_depend_index %ik' % (n // 1000)] = best_of(
+            lambda: metadata.parse_depend_index(data), 1 if n > 50000 else 3)
+    return res
+
+
+def bench_install_sequence(tmp_dir, scale):
+    res = {}
+    fo = open(join(tmp_dir, 'index-depend.txt'), 'w')
+    fo.write(synth.index_data(int(20000 * scale), ranges=True))
+    fo.close()
+    c = Chain()
+    c.add_repo('file://%s/' % tmp_dir, 'index-depend.txt')
+    names = sorted(c.groups)[-20:]
+    res['install_sequence index'] = best_of(
+        lambda: [c.install_sequence(Req(name)) for name in names])
+
+    for name, dists, req in [
+        ('deep', synth.deep_graph(int(300 * scale)), Req('deep0000')),
+        ('wide', synth.wide_graph(int(2000 * scale)), Req('wide')),
+        ]:
+        c = make_chain(dists)
+        for mode in 'flat', 'recur':
+            res['install_sequence %s %s' % (name, mode)] = best_of(
+                lambda: c.install_sequence(req, mode))
+    return res
+
+
+def bench_update_index(tmp_dir, scale):
+    repo_dir = join(tmp_dir, 'repo')
+    os.mkdir(repo_dir)
+    for i in xrange(int(300 * scale)):
+        synth.write_egg(join(repo_dir, 'proj%04i-1.0-1.egg' % i), 10)
+
+    def clean():
+        for fn in 'index-depend.txt', 'index-depend.bz2':
+            if isfile(join(repo_dir, fn)):
+                os.unlink(join(repo_dir, fn))
+
+    return {
+        'update_index full': best_of(
+            lambda: metadata.update_index(repo_dir), setup=clean),
+        'update_index incremental': best_of(
+            lambda: metadata.update_index(repo_dir)),
+    }
+
+
+def bench_egginst(tmp_dir, scale):
+    res = {}
+    for name, kwds in [
+        ('small', dict(n_files=int(10000 * scale), file_size=500)),
+        ('large', dict(n_so=3, so_size=int(16 * 1024 ** 2 * scale))),
+        ]:
+        egg_path = join(tmp_dir, '%s-1.0-1.egg' % name)
+        synth.write_egg(egg_path, **kwds)
+        prefix = join(tmp_dir, 'prefix')
+
+        def install():
+            ei = EggInst(egg_path, prefix)
+            ei.progress_callback = noop
+            ei.install()
+
+        def remove():
+            ei = EggInst(egg_path, prefix)
+            ei.progress_callback = noop
+            if isdir(ei.meta_dir):
+                ei.remove()
+
+        res['egginst install %s' % name] = best_of(install, setup=remove)
+        res['egginst remove %s' % name] = best_of(remove, setup=install)
+        shutil.rmtree(prefix)
+    return res
+
+
+def bench_history(tmp_dir, scale):
+    prefix = join(tmp_dir, 'prefix')
+    os.mkdir(prefix)
+    h = History(prefix)
+    fo = open(h.path, 'w')
+    fo.write(synth.history_data(int(5000 * scale)))
+    fo.close()
+    return {
+        'History.get_state last': best_of(h.get_state),
+        'History.get_state first': best_of(lambda: h.get_state(0)),
+    }
+
+
+CASES = [
+    ('parse', bench_parse_index),
+    ('resolve', bench_install_sequence),
+    ('update_index', bench_update_index),
+    ('egginst', bench_egginst),
+    ('history', bench_history),
+]
+
+
+def run(names, scale):
+    res = {}
+    for name, func in CASES:
+        if names and name not in names:
+            continue
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            res.update(func(tmp_dir, scale))
+        finally:
+            shutil.rmtree(tmp_dir)
+    return res
+
+
+def compare(res, baseline, tolerance):
+    """
+    print the timings next to the baseline, and return the list of names
+    of the regressions
+    """
+    fmt = '%-32s %10s %10s %8s'
+    print fmt % ('Benchmark', 'seconds', 'baseline', 'ratio')
+    print 63 * '='
+    regressions = []
+    for name in sorted(res):
+        t = res[name]
+        base = baseline.get(name)
+        if base:
+            ratio = t / base
+            flag = ''
+            if ratio > 1 + tolerance and t - base > NOISE:
+                regressions.append(name)
+                flag = '  SLOWER'
+            print fmt % (name, '%.4f' % t, '%.4f' % base,
+                         '%.2f' % ratio) + flag
+        else:
+            print fmt % (name, '%.4f' % t, '-', '-')
+    return regressions
+
+
+def main():
+    from optparse import OptionParser
+
+    p = OptionParser(usage="usage: %prog [options] [CASE ...]",
+                     description=__doc__)
+
+    p.add_option("--baseline",
+                 action="store",
+                 default=BASELINE,
+                 help="baseline file, defaults to %default",
+                 metavar='PATH')
+
+    p.add_option("--save",
+                 action="store_true",
+                 help="store the timings as the new baseline")
+
+    p.add_option("--scale",
+                 action="store",
+                 type="float",
+                 default=1.0,
+                 help="scale the size of the synthetic data, e.g. 0.1 for "
+                      "a quick run (timings are then not comparable with "
+                      "the baseline), defaults to %default")
+
+    p.add_option("--tolerance",
+                 action="store",
+                 type="float",
+                 default=0.25,
+                 help="relative slowdown which is reported as a regression, "
+                      "defaults to %default")
+
+    opts, args = p.parse_args()
+
+    for name in args:
+        if name not in dict(CASES):
+            p.error("no such case: %r (choose from %s)" %
+                    (name, ', '.join(n for n, f in CASES)))
+
+    res = run(args, opts.scale)
+
+    baseline = {}
+    if opts.scale == 1.0 and isfile(opts.baseline):
+        baseline = json.load(open(opts.baseline))
+    regressions = compare(res, baseline, opts.tolerance)
+
+    if opts.save:
+        baseline.update(res)
+        fo = open(opts.baseline, 'w')
+        json.dump(baseline, fo, indent=2, sort_keys=True)
+        fo.write('\n')
+        fo.close()
+        print "saved:", opts.baseline
+    elif regressions:
+        print "%d regressions" % len(regressions)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
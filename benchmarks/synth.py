@@ -0,0 +1,162 @@
+"""
+Generators for synthetic benchmark data, e.g. large index files.
+"""
+import time
+import random
+
+
+SPEC_TMPL = """\
+==> %(fn)s <==
+size = %(size)i
+md5 = %(md5)r
+mtime = %(mtime)r
+
+metadata_version = '1.1'
+name = %(name)r
+version = %(version)r
+build = %(build)i
+
+arch = 'amd64'
+platform = 'linux2'
+osdist = 'RedHat_5'
+python = '2.7'
+packages = %(packages)r
+"""
+
+
+def project_name(i):
+    return 'proj%05i' % i
+
+
+def dep_string(rnd, name, n_versions, ranges):
+    """
+    return a requirement string for the project, which (when ranges is
+    True) mostly has a lower bound, and sometimes an upper bound as well
+    """
+    if not ranges:
+        return name
+    lo = rnd.randrange(n_versions // 2 + 1)
+    if rnd.random() < 0.8:
+        return '%s >=1.%i.0' % (name, lo)
+    return '%s >=1.%i.0,<1.%i.0' % (name, lo, lo + 2)
+
+
+def index_data(n_specs, n_versions=5, n_builds=2, n_deps=3, ranges=False,
+               seed=0):
+    """
+    return the data of an (uncompressed) index file containing n_specs
+    specs, where each project has n_versions * n_builds distributions,
+    and each distribution depends on (up to) n_deps projects with a
+    smaller number, optionally with random version ranges
+    """
+    rnd = random.Random(seed)
+    per_project = n_versions * n_builds
+    n_projects = max(1, n_specs // per_project)
+    sections = []
+    for i in xrange(n_projects):
+        name = project_name(i)
+        for v in xrange(n_versions):
+            version = '1.%i.0' % v
+            for build in xrange(1, n_builds + 1):
+                deps = {}
+                if i:
+                    for dummy in xrange(n_deps):
+                        dep = project_name(rnd.randrange(i))
+                        deps[dep] = dep_string(rnd, dep, n_versions, ranges)
+                sections.append(SPEC_TMPL % dict(
+                        fn='%s-%s-%i.egg' % (name, version, build),
+                        size=rnd.randrange(10000, 10000000),
+                        md5='%032x' % rnd.getrandbits(128),
+                        mtime=1300000000.0 + rnd.randrange(10000000),
+                        name=name, version=version, build=build,
+                        packages=sorted(deps.itervalues())))
+    return '\n'.join(sections)
+
+
+def deep_graph(depth):
+    """
+    return a list of tuples(name, version, packages), where each project
+    depends on the next one, i.e. the dependency graph is a long chain
+    """
+    return [('deep%04i' % i, '1.0',
+             ['deep%04i' % (i + 1)] if i + 1 < depth else [])
+            for i in xrange(depth)]
+
+
+def wide_graph(width, n_versions=3):
+    """
+    return a list of tuples(name, version, packages), where a root project
+    depends on width projects, each of which has n_versions versions
+    """
+    res = [('wide', '1.0', ['leaf%04i' % i for i in xrange(width)])]
+    for i in xrange(width):
+        for v in xrange(n_versions):
+            res.append(('leaf%04i' % i, '1.%i' % v, []))
+    return res
+
+
+DEPEND_TMPL = """\
+metadata_version = '1.1'
+name = %(name)r
+version = %(version)r
+build = %(build)i
+
+arch = None
+platform = None
+osdist = None
+python = None
+packages = %(packages)r
+"""
+
+
+def write_egg(path, n_files=0, file_size=100, n_so=0, so_size=0,
+              packages=[], seed=0):
+    """
+    write a synthetic egg, containing n_files small Python files (in a
+    few packages), and n_so large object files, which contain an ELF
+    header and a placeholder (such that object_code.py has to patch them)
+    """
+    import zipfile
+    from os.path import basename
+
+    rnd = random.Random(seed)
+    name, version, build = basename(path)[:-4].split('-')
+    z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    for i in xrange(n_files):
+        pkg = 'pkg%02i' % (i % 20)
+        data = '# %i\n' % i + 'x' * (file_size - 6) + '\n'
+        z.writestr('%s/%s/mod%05i.py' % (name, pkg, i), data)
+        if i < 20:
+            z.writestr('%s/%s/__init__.py' % (name, pkg), '')
+    z.writestr('%s/__init__.py' % name, '')
+    for i in xrange(n_so):
+        block = ''.join(chr(rnd.randrange(256)) for dummy in xrange(4096))
+        data = ('\x7fELF' + 30 * '/PLACEHOLD' + '\0' +
+                block * (so_size // len(block)))
+        z.writestr('%s/_ext%i.so' % (name, i), data)
+    z.writestr('EGG-INFO/spec/depend', DEPEND_TMPL % dict(
+            name=name, version=version, build=int(build),
+            packages=packages))
+    z.close()
+
+
+def history_data(n_revisions, n_pkgs=200, seed=0):
+    """
+    return the data of an enpkg.hist file, with n_pkgs packages installed
+    initially, and n_revisions revisions, each of which updates a few
+    packages
+    """
+    rnd = random.Random(seed)
+    versions = [0] * n_pkgs
+    fn = lambda i: 'pkg%04i-1.%i-1.egg' % (i, versions[i])
+    lines = [time.strftime('==> %Y-%m-%d %H:%M:%S UTC <==',
+                           time.gmtime(1293840000))]
+    lines.extend(fn(i) for i in xrange(n_pkgs))
+    for r in xrange(n_revisions):
+        lines.append(time.strftime('==> %Y-%m-%d %H:%M:%S UTC <==',
+                                   time.gmtime(1293840000 + 3600 * (r + 1))))
+        for i in rnd.sample(xrange(n_pkgs), 3):
+            lines.append('-' + fn(i))
+            versions[i] += 1
+            lines.append('+' + fn(i))
+    return '\n'.join(lines) + '\n'
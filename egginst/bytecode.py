@@ -0,0 +1,123 @@
+"""
+Optional stage of EggInst.install (see the precompile option), which
+byte-compiles the installed .py files, such that the modules are not
+compiled at runtime on their first import (which may happen concurrently
+in many processes, each of which compiles the module, and may fail to
+write the .pyc file).
+
+The modules are compiled by a pool of processes, unless there are only a
+few of them.  The processes run "python -m py_compile" on chunks of the
+modules (EggInst may run in a worker thread of the scheduler, where forking
+a multiprocessing pool is not safe).  The compiled files (.pyc, or .pyo
+when running with -O) are added to the files of the egg (and therefore
+listed in __egginst__.txt, such that they are removed together with the
+package).  Modules which are shadowed by an extension module are not
+compiled (just like those are not written by EggInst.write_arcname).
+"""
+import os
+import sys
+from os.path import isfile
+
+import timing
+
+
+verbose = False
+
+# the suffix appended to the path of a module by py_compile
+SUFFIX = 'c' if __debug__ else 'o'
+
+# below this number of modules, starting processes does not pay off
+MIN_POOL = 50
+
+# the number of modules passed to each process (which also keeps the
+# command lines short)
+CHUNK = 100
+
+
+def compile_file(path):
+    """
+    compile the module, and return True on success (modules which can't be
+    compiled, e.g. because of syntax errors, are skipped)
+    """
+    import py_compile
+
+    try:
+        py_compile.compile(path, doraise=True)
+    except (py_compile.PyCompileError, IOError, OSError):
+        return False
+    return True
+
+
+def modules(egg):
+    """
+    return the list of paths of the .py files of the egg which are compiled
+    """
+    files = set(egg.files)
+    res = []
+    for path in egg.files:
+        if not path.endswith('.py') or path + SUFFIX in files:
+            continue
+        if (not path.startswith(egg.pyloc + os.sep) or
+                path.startswith(egg.meta_dir + os.sep)):
+            # scripts, meta data, ...
+            continue
+        if path[:-3] + egg.py_obj in files:
+            continue
+        res.append(path)
+    return res
+
+
+def compile_pool(paths, jobs):
+    """
+    compile the modules, using up to jobs processes at the same time
+    (the compiled files written by the processes are not checked here)
+    """
+    import subprocess
+
+    cmd = [sys.executable, '-E', '-m', 'py_compile']
+    if not __debug__:
+        cmd.insert(1, '-O')
+    devnull = open(os.devnull, 'w')
+    running = []
+    try:
+        for i in xrange(0, len(paths), CHUNK):
+            if len(running) == jobs:
+                running.pop(0).wait()
+            # syntax errors are reported on stderr, and skipped
+            running.append(subprocess.Popen(cmd + paths[i:i + CHUNK],
+                                            stderr=devnull))
+    finally:
+        for p in running:
+            p.wait()
+        devnull.close()
+
+
+def compile_modules(egg, jobs=None):
+    """
+    compile the modules of the (installed) egg, using jobs processes
+    (defaults to the number of CPUs), and add the compiled files to
+    egg.files
+    """
+    paths = modules(egg)
+    if not paths:
+        return
+    # the compiled files are recorded before they are written, such that
+    # they are removed when the install is rolled back
+    egg.tx.log_many([('new', egg.tx.rel_path(p + SUFFIX)) for p in paths])
+    if verbose:
+        print "Compiling %d modules" % len(paths)
+
+    if jobs is None:
+        import multiprocessing
+
+        jobs = multiprocessing.cpu_count()
+    if len(paths) < MIN_POOL or jobs == 1:
+        for path in paths:
+            compile_file(path)
+    else:
+        compile_pool(paths, jobs)
+
+    for path in paths:
+        if isfile(path + SUFFIX):
+            egg.files.append(path + SUFFIX)
+    timing.count('precompile.modules', len(paths))
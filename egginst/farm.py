@@ -0,0 +1,127 @@
+"""
+Hardlink-farm install mode: each egg is extracted only once into a shared
+store directory, and prefixes are then populated by hardlinking the files
+from the store (falling back to copying, e.g. across file systems).
+
+Files which are modified in place after being written, i.e. object files
+containing placeholders (see object_code.py) and scripts (see scripts.py),
+are always copied, such that the store never gets modified.  Bookkeeping
+(__egginst__.txt) is the same as for a regular install, so remove() works
+as usual: it simply removes the links.
+
+Layout of the store:
+
+    <store_dir>/<egg name>-<md5 of egg>/files.txt    # manifest
+    <store_dir>/<egg name>-<md5 of egg>/data/...     # extracted files
+
+Each line of the manifest contains a flag ('l' = link, 'c' = copy) and
+the arcname of the file.
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+from os.path import basename, dirname, isdir, isfile, join
+
+from utils import makedirs, rm_rf
+import object_code
+
+
+def md5_file(path):
+    h = hashlib.md5()
+    fi = open(path, 'rb')
+    while True:
+        chunk = fi.read(262144)
+        if not chunk:
+            break
+        h.update(chunk)
+    fi.close()
+    return h.hexdigest()
+
+
+def needs_copy(data):
+    """
+    return True if the data is object code which contains placeholders
+    """
+    return (data[:4] in object_code.MAGIC and
+            object_code.placehold_pat.search(data) is not None)
+
+
+def populate(egg, entry_dir):
+    """
+    extract the egg (which must be opened) into entry_dir, unless this
+    was already done
+    """
+    if isdir(entry_dir):
+        return
+    store_dir = dirname(entry_dir)
+    makedirs(store_dir)
+    tmp_dir = tempfile.mkdtemp(dir=store_dir, suffix='.part')
+    manifest = []
+    for arcname in egg.arcnames:
+        data = egg.read_arcname(arcname)
+        if data is None:
+            continue
+        path = join(tmp_dir, 'data', *arcname.split('/'))
+        if not isdir(dirname(path)):
+            os.makedirs(dirname(path))
+        fo = open(path, 'wb')
+        fo.write(data)
+        fo.close()
+        if egg.is_executable(arcname):
+            os.chmod(path, 0755)
+        manifest.append('%s %s\n' % ('c' if needs_copy(data) else 'l',
+                                     arcname))
+    fo = open(join(tmp_dir, 'files.txt'), 'w')
+    fo.writelines(manifest)
+    fo.close()
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another process populated the store in the mean time
+        rm_rf(tmp_dir)
+        if not isdir(entry_dir):
+            raise
+
+
+def link_or_copy(src, dst, copy=False):
+    if not copy and hasattr(os, 'link'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+
+
+def extract(egg, store_dir):
+    """
+    populate the prefix of the EggInst object with the files of the egg,
+    using the store (instead of EggInst.extract)
+    """
+    entry_dir = join(store_dir, '%s-%s' % (basename(egg.fpath)[:-4],
+                                           md5_file(egg.fpath)))
+    if not isfile(join(entry_dir, 'files.txt')):
+        populate(egg, entry_dir)
+
+    n = 0
+    size = sum(egg.z.getinfo(name).file_size for name in egg.arcnames)
+    egg.progress_callback(0, size)
+    for line in open(join(entry_dir, 'files.txt')):
+        flag, arcname = line.rstrip('\n').split(' ', 1)
+        n += egg.z.getinfo(arcname).file_size
+        if n:
+            egg.progress_callback(n, size)
+        path = egg.get_dst(arcname)
+        egg.files.append(path)
+        egg.crcs[path] = (egg.z.getinfo(arcname).CRC,
+                          egg.z.getinfo(arcname).file_size)
+        if path in egg.tx.keep:
+            continue
+        link_or_copy(join(entry_dir, 'data', *arcname.split('/')),
+                     egg.tx.stage_path(path),
+                     flag == 'c' or path.startswith(egg.bin_dir + os.sep))
+    if n < size:
+        egg.progress_callback(size, size)
+    egg.installed_size = size
@@ -0,0 +1,53 @@
+"""
+Batched file system operations, for installing and removing eggs with many
+(small) files, where the time spent is dominated by the system calls made
+for each file, rather than by the amount of data written.
+
+The directories which are known to exist, and those which were found to be
+missing, are remembered, such that each directory is checked (and created)
+only once, instead of once for every file in it.  Moreover, a file whose
+directory was missing (and was created by the DirCache) can't exist, so
+there is no need to check whether it has to be removed (or backed up)
+before it is written.
+"""
+from os.path import dirname, isdir
+
+from utils import makedirs
+
+
+class DirCache(object):
+
+    def __init__(self):
+        self.existing = set()
+        # directories which did not exist when they were first looked at,
+        # whether they have been created since or not
+        self.created = set()
+
+    def isdir(self, path):
+        if path in self.existing:
+            return True
+        if path in self.created:
+            return False
+        if isdir(path):
+            self.existing.add(path)
+            return True
+        self.created.add(path)
+        return False
+
+    def makedirs(self, path):
+        """
+        create the directory (and its parents), unless it is known to exist
+        """
+        if path in self.existing:
+            return
+        if not self.isdir(path):
+            makedirs(path)
+        self.existing.add(path)
+
+    def is_new(self, path):
+        """
+        return True if the path can't exist (unless it was written since),
+        because its directory did not exist when it was first looked at
+        """
+        dir_path = dirname(path)
+        return not self.isdir(dir_path) or dir_path in self.created
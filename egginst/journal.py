@@ -0,0 +1,255 @@
+"""
+Transactions, which make removing and installing an egg atomic:
+
+    tx = Transaction(prefix, 'foo')
+    with tx:
+        EggInst(old_egg, prefix, tx=tx).remove()
+        EggInst(new_egg, prefix, tx=tx).install()
+
+Removed files are not deleted, but moved into the backup directory of the
+transaction, and the files of an egg are extracted into a staging
+directory, and then renamed into place (which is why everything has to be
+on the same file system as the prefix).  Each step is recorded in a journal
+before it is done, such that the transaction can be rolled back, i.e. the
+new files are removed and the backups are moved back, which only takes a
+few seconds, instead of reinstalling the old packages.
+
+The transaction (and its journal) live in <prefix>/.egginst-tx-<name>/.
+When a transaction is interrupted (e.g. the process is killed), recover()
+finds it on the next run, and rolls it back (or finishes the cleanup, if
+it was already committed).
+
+Transactions of several eggs may run concurrently (in different threads)
+in the same prefix, as long as they are given the same lock, which
+serializes moving the staged files into place.
+
+Note that side effects of post_egginst.py and pre_egguninst.py (and
+application menu items) can't be rolled back.
+"""
+import os
+import errno
+from os.path import dirname, isdir, isfile, islink, join
+
+from utils import makedirs, rm_empty_dir, rm_rf
+from fsbatch import DirCache
+
+
+TX_PREFIX = '.egginst-tx-'
+
+# the number of fields of each kind of journal entry
+N_FIELDS = {'begin': 1, 'new': 2, 'backup': 3, 'commit': 1}
+
+
+def lexists(path):
+    return islink(path) or os.path.exists(path)
+
+
+class Transaction(object):
+
+    def __init__(self, prefix, name, verbose=False, lock=None):
+        self.prefix = prefix
+        self.name = name
+        self.verbose = verbose
+        # shared by the transactions which run concurrently (if any)
+        self.lock = lock
+        self.dir_path = join(prefix, TX_PREFIX + name)
+        self.journal_path = join(self.dir_path, 'journal.txt')
+        self.stage_dir = join(self.dir_path, 'stage')
+        self.backup_dir = join(self.dir_path, 'backup')
+        # the journal is only created when it is used, such that dry runs
+        # (and transactions in which nothing happens) leave no traces
+        self._journal = None
+        self._n_backups = 0
+        # paths of files of the installed version which are identical in
+        # the new egg, and are therefore neither removed nor rewritten
+        self.keep = set()
+        self.dirs = DirCache()
+
+    def rel_path(self, path):
+        assert path.startswith(self.prefix + os.sep), path
+        return path[len(self.prefix) + 1:]
+
+    def log(self, *fields):
+        self.log_many([fields])
+
+    def log_many(self, entries):
+        """
+        write the entries (tuples of fields) to the journal at once
+        """
+        if self._journal is None:
+            if isdir(self.dir_path):
+                # left over from an interrupted run
+                self.recover()
+            makedirs(self.dir_path)
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write(''.join('\t'.join(fields) + '\n'
+                                    for fields in entries))
+        self._journal.flush()
+
+    def backup(self, path):
+        """
+        move the file, link or directory into the backup directory (instead
+        of removing it)
+        """
+        if not lexists(path):
+            return
+        self.backup_many([path])
+
+    def backup_many(self, paths):
+        """
+        like backup, but for many paths, which are recorded in the journal
+        at once (which is why paths which don't exist are not skipped, and
+        they are only ignored when moving)
+        """
+        entries = []
+        for path in paths:
+            self._n_backups += 1
+            entries.append(('backup', str(self._n_backups),
+                            self.rel_path(path)))
+        if not entries:
+            return
+        self.log_many(entries)
+        self.dirs.makedirs(self.backup_dir)
+        for unused, bak, rel in entries:
+            try:
+                os.rename(join(self.prefix, rel), join(self.backup_dir, bak))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def new(self, path):
+        """
+        record that the file (or link) is going to be created
+        """
+        self.log('new', self.rel_path(path))
+
+    def stage_path(self, path):
+        """
+        return the path in the staging directory, to which the file, which
+        is going to be installed to path, is written (see commit_staged)
+        """
+        res = join(self.stage_dir, self.rel_path(path))
+        if self._journal is None:
+            self.log('begin')
+        self.dirs.makedirs(dirname(res))
+        return res
+
+    def commit_staged(self, paths):
+        """
+        move the staged files (all paths must have been staged) into place
+        """
+        # a path may be given more than once (e.g. when an egg contains the
+        # same member twice), but it is only staged once
+        seen = set()
+        paths = [path for path in paths
+                 if not (path in seen or seen.add(path))]
+        if self.lock is None:
+            self._commit_staged(paths)
+        else:
+            with self.lock:
+                self._commit_staged(paths)
+
+    def _commit_staged(self, paths):
+        # existing files are replaced, but there is no need to look for
+        # files in directories which don't exist yet, unless another
+        # transaction may have written to them since
+        self.backup_many([path for path in paths
+                          if (self.lock is not None or
+                              not self.dirs.is_new(path)) and lexists(path)])
+        self.log_many([('new', self.rel_path(path)) for path in paths])
+        for path in paths:
+            self.dirs.makedirs(dirname(path))
+            os.rename(join(self.stage_dir, self.rel_path(path)), path)
+
+    def entries(self):
+        """
+        return the list of entries (lists of fields) of the journal, where
+        incomplete entries are skipped: the last line may have been cut off
+        when the process was killed (as each entry is written before the
+        step is done, the step of an incomplete entry was not done)
+        """
+        if not isfile(self.journal_path):
+            return []
+        res = []
+        for line in open(self.journal_path):
+            if not line.endswith('\n'):
+                continue
+            fields = line[:-1].split('\t')
+            if len(fields) == N_FIELDS.get(fields[0]):
+                res.append(fields)
+        return res
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def commit(self):
+        if self._journal is None:
+            return
+        self.log('commit')
+        self.close()
+        rm_rf(self.dir_path)
+
+    def rollback(self):
+        """
+        remove the new files, and move back the backups, in reverse order
+        """
+        self.close()
+        entries = self.entries()
+        if self.verbose and entries:
+            print "Rolling back: %s" % self.name
+        new_dirs = set()
+        for fields in reversed(entries):
+            if fields[0] == 'new':
+                path = join(self.prefix, fields[1])
+                rm_rf(path)
+                new_dirs.add(dirname(path))
+            elif fields[0] == 'backup':
+                src = join(self.backup_dir, fields[1])
+                path = join(self.prefix, fields[2])
+                if lexists(src):
+                    rm_rf(path)
+                    makedirs(dirname(path))
+                    os.rename(src, path)
+        # remove the directories which are now empty
+        for path in sorted(new_dirs, key=len, reverse=True):
+            while len(path) > len(self.prefix):
+                rm_empty_dir(path)
+                path = dirname(path)
+        rm_rf(self.dir_path)
+
+    def recover(self):
+        """
+        finish an interrupted transaction: roll it back, unless it was
+        already committed (in which case only the cleanup is left)
+        """
+        self.close()
+        entries = self.entries()
+        if entries and entries[-1] == ['commit']:
+            rm_rf(self.dir_path)
+        else:
+            self.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+def recover(prefix, verbose=False):
+    """
+    finish all interrupted transactions in the prefix, and return their
+    names
+    """
+    if not isdir(prefix):
+        return []
+    names = sorted(fn[len(TX_PREFIX):] for fn in os.listdir(prefix)
+                   if fn.startswith(TX_PREFIX))
+    for name in names:
+        Transaction(prefix, name, verbose).recover()
+    return names
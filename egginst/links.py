@@ -1,7 +1,7 @@
 import os
-from os.path import dirname, isdir, join
+from os.path import dirname, join
 
-from egginst.utils import rm_rf
+from egginst.utils import makedirs, rm_rf
 
 
 verbose = False
@@ -14,8 +14,7 @@ def create_link(arcname, link, prefix):
 
     # Create the destination directory if it does not exist.  In most cases
     # it will exist, but you never know.
-    if not isdir(dirname(dst)):
-        os.makedirs(dirname(dst))
+    makedirs(dirname(dst))
 
     rm_rf(dst, verbose)
     if verbose:
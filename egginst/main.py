@@ -10,14 +10,12 @@ eggs and it installs/uninstalls them.
 import os
 import sys
 import re
-import zipfile
-import ConfigParser
 from os.path import abspath, basename, dirname, join, isdir, isfile
 
 from utils import (on_win, bin_dir_name, rel_site_packages,
-                   pprint_fn_action, rm_empty_dir, rm_rf, human_bytes,
+                   pprint_fn_action, makedirs, rm_empty_dir, human_bytes,
                    console_file_progress)
-import scripts
+import timing
 
 
 
@@ -41,7 +39,8 @@ def name_version_fn(fn):
 class EggInst(object):
 
     def __init__(self, fpath, prefix=sys.prefix,
-                 hook=False, verbose=False, noapp=False):
+                 hook=False, verbose=False, noapp=False, store_dir=None,
+                 tx=None, precompile=False):
         self.fpath = fpath
         self.cname = name_version_fn(basename(fpath))[0].lower()
         self.prefix = abspath(prefix)
@@ -65,22 +64,73 @@ class EggInst(object):
 
         self.meta_txt = join(self.meta_dir, '__egginst__.txt')
         self.files = []
+        # maps the paths of the extracted files to the tuple(CRC, size) of
+        # their archive members, see unchanged_files
+        self.crcs = {}
         self.verbose = verbose
+        # when set, files are hardlinked from a shared store of extracted
+        # eggs (see farm.py)
+        self.store_dir = store_dir
+        # when set, the installed modules are byte-compiled (see bytecode.py)
+        self.precompile = precompile
+        # the transaction (see journal.py) the install or remove is part of,
+        # when None, a transaction of its own is used
+        self.tx = tx
 
     def rel_prefix(self, path):
         assert abspath(path).startswith(self.prefix)
         return path[len(self.prefix) + 1:]
 
 
+    def transaction(self, func):
+        """
+        call func within self.tx, or within a transaction of its own
+        """
+        if self.tx is not None:
+            return func()
+        import journal
+
+        self.tx = journal.Transaction(self.prefix, self.cname, self.verbose)
+        try:
+            with self.tx:
+                return func()
+        finally:
+            self.tx = None
+
     def install(self):
-        if not isdir(self.meta_dir):
-            os.makedirs(self.meta_dir)
+        return self.transaction(self._install)
+
+    def _install(self):
+        import zipfile
+        import scripts
+
+        # an existing meta data directory (of an install without a remove)
+        # is replaced, and as a whole removed when rolling back
+        self.tx.backup(self.meta_dir)
+        self.tx.new(self.meta_dir)
+        makedirs(self.meta_dir)
 
-        self.z = zipfile.ZipFile(self.fpath)
-        self.arcnames = self.z.namelist()
+        # when given a file object (instead of a filename), ZipFile does
+        # not open the file again for every member it reads
+        zip_file = open(self.fpath, 'rb')
+        self.z = zipfile.ZipFile(zip_file)
+        self.read_arcnames(self.z)
 
-        self.extract()
+        with timing.timed('extract'):
+            if self.store_dir:
+                import farm
 
+                farm.extract(self, self.store_dir)
+            else:
+                self.extract()
+            self.tx.commit_staged(p for p in self.files
+                                  if p not in self.tx.keep)
+        timing.count('extract.bytes', self.installed_size)
+        timing.count('extract.files', len(self.files))
+
+        # the files created by the following steps are added to the journal
+        # after each step
+        n = len(self.files)
         if on_win:
             scripts.create_proxies(self)
 
@@ -95,9 +145,21 @@ class EggInst(object):
             object_code.fix_files(self)
 
         self.entry_points()
+        for path in self.files[n:]:
+            self.tx.new(path)
+        if self.precompile:
+            import bytecode
+
+            if self.verbose:
+                bytecode.verbose = True
+            with timing.timed('precompile'):
+                bytecode.compile_modules(self)
         self.z.close()
+        zip_file.close()
         scripts.fix_scripts(self)
-        self.run('post_egginst.py')
+        with timing.timed('post_egginst'):
+            # a failing install script rolls back the transaction
+            self.run('post_egginst.py', check=True)
         self.install_app()
         self.write_meta()
 
@@ -105,9 +167,13 @@ class EggInst(object):
             import registry
 
             registry.create_file(self)
+            registry.update(self.prefix)
 
 
     def entry_points(self):
+        import ConfigParser
+        import scripts
+
         lines = list(self.lines_from_arcname('EGG-INFO/entry_points.txt',
                                              ignore_empty=False))
         if lines == []:
@@ -129,33 +195,75 @@ class EggInst(object):
 
 
     def write_meta(self):
-        fo = open(self.meta_txt, 'w')
-        fo.write('# egginst metadata\n')
-        fo.write('egg_name = %r\n' % basename(self.fpath))
-        fo.write('prefix = %r\n' % self.prefix)
-        fo.write('installed_size = %i\n' % self.installed_size)
-        fo.write('rel_files = [\n')
-        fo.write('  %r,\n' % self.rel_prefix(self.meta_txt))
+        # the paths are all absolute (see get_dst), and the file is written
+        # at once, as it has (at least) two lines for each file
+        n = len(self.prefix) + 1
+        lines = ['# egginst metadata',
+                 'egg_name = %r' % basename(self.fpath),
+                 'prefix = %r' % self.prefix,
+                 'installed_size = %i' % self.installed_size,
+                 'rel_files = [',
+                 '  %r,' % self.rel_prefix(self.meta_txt)]
         for p in self.files:
-            if abspath(p).startswith(self.prefix):
-                fo.write('  %r,\n' % self.rel_prefix(p))
-            else:
-                fo.write('  %r,\n' % p)
-        fo.write(']\n')
+            if p.startswith(self.prefix + os.sep):
+                p = p[n:]
+            lines.append('  %r,' % p)
+        lines.append(']')
+        lines.append('crcs = {')
+        for p in sorted(self.crcs):
+            lines.append('  %r: (%d, %d),' % ((p[n:],) + self.crcs[p]))
+        lines.append('}')
+        fo = open(self.meta_txt, 'w')
+        fo.write('\n'.join(lines) + '\n')
         fo.close()
 
     def read_meta(self):
-        d = {'installed_size': -1}
+        d = {'installed_size': -1, 'crcs': {}}
         execfile(self.meta_txt, d)
         for name in ['egg_name', 'prefix', 'installed_size', 'rel_files']:
             setattr(self, name, d[name])
         self.files = [join(self.prefix, f) for f in d['rel_files']]
+        self.crcs = dict((join(self.prefix, f), v)
+                         for f, v in d['crcs'].iteritems())
+
+    def unchanged_files(self, old):
+        """
+        given the EggInst object of the installed version of the package,
+        return the set of paths of the installed files which are identical
+        in this egg, i.e. which don't have to be removed and rewritten when
+        upgrading (the CRCs and sizes of the archive members are compared,
+        so nothing is decompressed)
+        """
+        import zipfile
+
+        old.read_meta()
+        if not old.crcs:
+            return set()
+        z = zipfile.ZipFile(self.fpath)
+        self.read_arcnames(z)
+        res = set()
+        for info in z.infolist():
+            if self.skip_arcname(info.filename) or self.is_volatile(
+                    info.filename):
+                continue
+            path = self.get_dst(info.filename)
+            if (old.crcs.get(path) == (info.CRC, info.file_size) and
+                    isfile(path)):
+                res.add(path)
+        z.close()
+        return res
+
+
+    def read_arcnames(self, z):
+        self.arcnames = z.namelist()
+        # for membership tests, as eggs may have many thousand members
+        self.arcname_set = set(self.arcnames)
 
 
     def lines_from_arcname(self, arcname,
                            ignore_empty=True,
                            ignore_comments=True):
-        if not arcname in self.arcnames:
+        if not arcname in self.arcname_set:
             return
         for line in self.z.read(arcname).splitlines():
             line = line.strip()
@@ -199,34 +307,68 @@ class EggInst(object):
     py_pat = re.compile(r'^(.+)\.py(c|o)?$')
     so_pat = re.compile(r'^lib.+\.so')
     py_obj = '.pyd' if on_win else '.so'
-    def write_arcname(self, arcname):
+    def skip_arcname(self, arcname):
         if arcname.endswith('/') or arcname.startswith('.unused'):
-            return
+            return True
         m = self.py_pat.match(arcname)
-        if m and (m.group(1) + self.py_obj) in self.arcnames:
-            # .py, .pyc, .pyo next to .so are not written
-            return
-        path = self.get_dst(arcname)
-        dn, fn = os.path.split(path)
+        # .py, .pyc, .pyo next to .so are not written
+        return bool(m and (m.group(1) + self.py_obj) in self.arcname_set)
+
+    def read_arcname(self, arcname):
+        """
+        return the data to be written for the arcname, or None if the
+        arcname is not written
+        """
+        if self.skip_arcname(arcname):
+            return None
+        fn = arcname.split('/')[-1]
         data = self.z.read(arcname)
         if fn in ['__init__.py', '__init__.pyc']:
             tmp = arcname.rstrip('c')
-            if tmp in self.arcnames and NS_PKG_PAT.match(self.z.read(tmp)):
+            if tmp in self.arcname_set and NS_PKG_PAT.match(self.z.read(tmp)):
                 if fn == '__init__.py':
                     data = ''
                 if fn == '__init__.pyc':
-                    return
+                    return None
+        return data
+
+    def is_executable(self, arcname):
+        fn = arcname.split('/')[-1]
+        return bool(arcname.startswith(('EGG-INFO/usr/bin/',
+                                        'EGG-INFO/scripts/')) or
+                    fn.endswith(('.dylib', '.pyd', '.so')) or
+                    (arcname.startswith('EGG-INFO/usr/lib/') and
+                     self.so_pat.match(fn)))
+
+    def is_volatile(self, arcname):
+        """
+        return True if the file is always rewritten when upgrading, because
+        it is changed after being extracted (object code, scripts), or
+        depends on other members (namespace packages), or is meta data
+        """
+        return bool(self.is_executable(arcname) or
+                    arcname.split('/')[-1] in ('__init__.py', '__init__.pyc')
+                    or (arcname.startswith('EGG-INFO/') and
+                        not arcname.startswith('EGG-INFO/prefix/')))
+
+    def write_arcname(self, arcname):
+        path = self.get_dst(arcname)
+        info = self.z.getinfo(arcname)
+        if path in self.tx.keep:
+            # identical in the installed version, which is left in place
+            self.files.append(path)
+            self.crcs[path] = info.CRC, info.file_size
+            return
+        data = self.read_arcname(arcname)
+        if data is None:
+            return
         self.files.append(path)
-        if not isdir(dn):
-            os.makedirs(dn)
-        rm_rf(path)
+        self.crcs[path] = info.CRC, info.file_size
+        path = self.tx.stage_path(path)
         fo = open(path, 'wb')
         fo.write(data)
         fo.close()
-        if (arcname.startswith(('EGG-INFO/usr/bin/', 'EGG-INFO/scripts/')) or
-                fn.endswith(('.dylib', '.pyd', '.so')) or
-                (arcname.startswith('EGG-INFO/usr/lib/') and
-                 self.so_pat.match(fn))):
+        if self.is_executable(arcname):
             os.chmod(path, 0755)
 
 
@@ -253,13 +395,18 @@ class EggInst(object):
                   ('un' if remove else '', e))
 
 
-    def run(self, fn):
+    def run(self, fn, check=False):
+        """
+        run the script of the egg, when check is True, a non-zero exit
+        status raises subprocess.CalledProcessError
+        """
         path = join(self.meta_dir, fn)
         if not isfile(path):
             return
-        from subprocess import call
-        call([sys.executable, '-E', path, '--prefix', self.prefix],
-             cwd=dirname(path))
+        import subprocess
+        (subprocess.check_call if check else subprocess.call)(
+            [sys.executable, '-E', path, '--prefix', self.prefix],
+            cwd=dirname(path))
 
 
     def rm_dirs(self):
@@ -273,7 +420,11 @@ class EggInst(object):
         for path in sorted(dir_paths, key=len, reverse=True):
             rm_empty_dir(path)
 
+    @timing.timed('remove')
     def remove(self):
+        return self.transaction(self._remove)
+
+    def _remove(self):
         if not isdir(self.meta_dir):
             print "Error: Can't find meta data for:", self.cname
             return
@@ -286,17 +437,25 @@ class EggInst(object):
         self.install_app(remove=True)
         self.run('pre_egguninst.py')
 
+        # the files are moved into the backup of the transaction
+        paths = []
         for p in self.files:
             n += 1
             self.progress_callback(n, nof)
-
-            rm_rf(p)
+            if p in self.tx.keep:
+                # left in place for the new version of the package
+                continue
+            paths.append(p)
             if p.endswith('.py'):
-                rm_rf(p + 'c')
+                paths.append(p + 'c')
+        self.tx.backup_many(paths)
         self.rm_dirs()
-        rm_rf(self.meta_dir)
+        self.tx.backup(self.meta_dir)
         if self.hook:
+            import registry
+
             rm_empty_dir(self.pkg_dir)
+            registry.update(self.prefix)
         else:
             rm_empty_dir(self.egginfo_dir)
 
@@ -360,6 +519,20 @@ def main():
                  action="store_true",
                  help="don't install into site-packages (experimental)")
 
+    p.add_option("--store",
+                 action="store",
+                 help="extract eggs only once into the store directory, and "
+                      "install by hardlinking files from there",
+                 metavar='PATH')
+
+    p.add_option("--precompile",
+                 action="store_true",
+                 help="byte-compile the installed modules")
+
+    p.add_option("--profile",
+                 action="store_true",
+                 help="print how much time was spent in each phase")
+
     p.add_option('-r', "--remove",
                  action="store_true",
                  help="remove package(s), requires the egg or project name(s)")
@@ -383,8 +556,17 @@ def main():
         print_installed(prefix)
         return
 
+    if not opts.dry_run:
+        import journal
+
+        # roll back what was left over by an interrupted run
+        for name in journal.recover(prefix, opts.verbose):
+            pprint_fn_action(name, 'recovered')
+
     for path in args:
-        ei = EggInst(path, prefix, opts.hook, opts.verbose, opts.noapp)
+        ei = EggInst(path, prefix, opts.hook, opts.verbose, opts.noapp,
+                     opts.store and abspath(opts.store),
+                     precompile=opts.precompile)
         fn = basename(path)
         if opts.remove:
             pprint_fn_action(fn, 'removing')
@@ -398,6 +580,10 @@ def main():
                 continue
             ei.install()
 
+    if opts.profile:
+        print
+        timing.print_report()
+
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,8 @@ import sys
 import re
 from os.path import abspath, join, islink, isfile, exists
 
+import timing
+
 
 verbose = False
 
@@ -26,10 +28,6 @@ MAGIC = {
     '\x7fELF': 'ELF',
 }
 
-# list of target direcories where shared object files are found
-_targets = []
-
-
 def get_object_type(path):
     """
     Return the object file type of the specified file (not link).
@@ -43,8 +41,8 @@ def get_object_type(path):
     return MAGIC.get(head)
 
 
-def find_lib(fn):
-    for tgt in _targets:
+def find_lib(fn, targets):
+    for tgt in targets:
         dst = abspath(join(tgt, fn))
         if exists(dst):
             return dst
@@ -53,7 +51,11 @@ def find_lib(fn):
 
 
 placehold_pat = re.compile(5 * '/PLACEHOLD' + '([^\0\\s]*)\0')
-def fix_object_code(path):
+def fix_object_code(path, targets):
+    """
+    replace the placeholders in the object file, using the list of target
+    directories where shared object files are found
+    """
     tp = get_object_type(path)
     if tp is None:
         return
@@ -74,10 +76,10 @@ def fix_object_code(path):
 
         if tp.startswith('MachO-') and rest.startswith('/'):
             # deprecated: because we now use rpath on OSX as well
-            r = find_lib(rest[1:])
+            r = find_lib(rest[1:], targets)
         else:
             assert rest == '' or rest.startswith(':')
-            rpaths = list(_targets)
+            rpaths = list(targets)
             # extend the list with rpath which were already in the binary,
             # if any
             rpaths.extend(p for p in rest.split(':') if p)
@@ -96,26 +98,26 @@ def fix_object_code(path):
     f.close()
 
 
+@timing.timed('object_code')
 def fix_files(egg):
     """
     Tries to fix the library path for all object files installed by the egg.
     """
-    global _targets
-
+    # (no module level state is used, as eggs may be installed concurrently)
     prefixes = [sys.prefix]
     if egg.prefix != sys.prefix:
         prefixes.insert(0, egg.prefix)
 
-    _targets = []
+    targets = []
     for prefix in prefixes:
         for line in egg.lines_from_arcname('EGG-INFO/inst/targets.dat'):
-            _targets.append(join(prefix, line))
-        _targets.append(join(prefix, 'lib'))
+            targets.append(join(prefix, line))
+        targets.append(join(prefix, 'lib'))
 
     if verbose:
         print 'Target directories:'
-        for tgt in _targets:
+        for tgt in targets:
             print '    %r' % tgt
 
     for p in egg.files:
-        fix_object_code(p)
+        fix_object_code(p, targets)
@@ -1,7 +1,9 @@
 import os
 import sys
 from collections import defaultdict
-from os.path import basename, join, isdir, isfile, normpath
+from os.path import basename, dirname, exists, join, isdir, isfile, normpath
+
+from utils import makedirs, rel_site_packages
 
 
 
@@ -64,8 +66,82 @@ def create_hooks_dir(dir_path, namespace=''):
     return reg, pth
 
 
+def create_hooks_files(dir_path, paths):
+    """
+    same as create_hooks_dir(), but the directory tree is given by the list
+    of paths of all files in it (e.g. the files written by EggInst), such
+    that the file system does not have to be walked
+    """
+    dirs = defaultdict(set)             # maps directories to subdir names
+    files = defaultdict(set)            # maps directories to file names
+    start = dir_path + os.sep
+    for path in paths:
+        if not path.startswith(start):
+            continue
+        dn, fn = os.path.split(path)
+        files[dn].add(fn)
+        while dn != dir_path:
+            dn, fn = os.path.split(dn)
+            if fn in dirs[dn]:
+                break
+            dirs[dn].add(fn)
+    return _create_hooks_tree(dir_path, '', dirs, files)
+
+
+def module_names(fns):
+    res = set()
+    for fn in fns:
+        name, ext = os.path.splitext(fn)
+        if ext in MODULE_EXTENSIONS_SET:
+            res.add(name)
+    return res
+
+
+def _create_hooks_tree(dir_path, namespace, dirs, files):
+    reg = {}
+    modules = defaultdict(set)
+    pth = []
+    for fn in dirs[dir_path]:
+        if '-' in fn:
+            continue
+        path = join(dir_path, fn)
+        reg[namespace + fn] = path
+        if module_names(files[path]) == set(['__init__']):
+            add_reg, dummy = _create_hooks_tree(path, namespace + fn + '.',
+                                                dirs, files)
+            reg.update(add_reg)
+
+    for fn in files[dir_path]:
+        if '-' in fn:
+            continue
+        name, ext = os.path.splitext(fn)
+        if ext in MODULE_EXTENSIONS_SET:
+            modules[name].add(ext)
+
+        if ext == '.pth':
+            for line in stripped_lines(join(dir_path, fn)):
+                pth.append(normpath(join(dir_path, line)))
+
+    for name, exts in modules.iteritems():
+        if name == '__init__':
+            continue
+        for mext in MODULE_EXTENSIONS:
+            if mext in exts:
+                reg[namespace + name] = join(dir_path, name + mext)
+                break
+
+    return reg, pth
+
+
 def create_file(egg):
-    reg, pth = create_hooks_dir(egg.pkg_dir)
+    if isfile(join(egg.meta_dir, 'post_egginst.py')):
+        # the install script may have created files (or directories) which
+        # are not listed in egg.files
+        reg, pth = create_hooks_dir(egg.pkg_dir)
+    else:
+        # the meta data file is written, but not listed in egg.files
+        reg, pth = create_hooks_files(egg.pkg_dir,
+                                      egg.files + [egg.meta_txt])
 
     fo = open(egg.registry_txt, 'w')
     fo.write('# pkg: %s\n' % basename(egg.pkg_dir))
@@ -76,13 +152,191 @@ def create_file(egg):
     fo.close()
 
 
-def collect(packages, path):
+def collect(packages, path, prefix=sys.prefix):
     """
     collects the EGG-INFO/registry.txt files for `packages` and writes them
-    to a single registry file at `path`
+    to a single registry file at `path`, which is then compiled into
+    compiled_path(path)
     """
     fo = open(path, 'w')
     for pkg in packages:
-        path = join(sys.prefix, 'pkgs', pkg, 'EGG-INFO', 'registry.txt')
-        fo.write(open(path).read())
+        fo.write(open(join(prefix, 'pkgs', pkg, 'EGG-INFO',
+                           'registry.txt')).read())
+    fo.close()
+    compile_file(path, compiled_path(path))
+
+
+# the .pth file (in site-packages) which installs the finder at startup
+PTH_NAME = 'egginst-registry.pth'
+STARTUP = "import egginst.registry; egginst.registry.install_finder(%r)\n"
+
+
+def update(prefix=sys.prefix):
+    """
+    collect the registries of all packages installed (in hook mode) into
+    prefix, and write the .pth file which installs the finder for the
+    compiled registry at startup (or remove these files, when no packages
+    are installed in hook mode)
+    """
+    pkgs_dir = join(prefix, 'pkgs')
+    packages = []
+    if isdir(pkgs_dir):
+        packages = sorted(fn for fn in os.listdir(pkgs_dir)
+                          if isfile(join(pkgs_dir, fn, 'EGG-INFO',
+                                         'registry.txt')))
+    path = join(pkgs_dir, 'registry.txt')
+    pth_path = join(prefix, rel_site_packages, PTH_NAME)
+    if not packages:
+        for p in pth_path, path, compiled_path(path):
+            if isfile(p):
+                os.unlink(p)
+        return
+    collect(packages, path, prefix)
+    makedirs(dirname(pth_path))
+    fo = open(pth_path, 'w')
+    fo.write(STARTUP % compiled_path(path))
     fo.close()
+
+
+# -------------------- compiled registry and import hook --------------------
+#
+# The compiled registry is a text file whose lines are sorted by module name,
+# each line being of the form "<module name>\t<path>\n".  Lines for .pth
+# entries ("-pth-\t<path>\n") sort before any module name.  The file can
+# therefore be mmap'ed and searched using bisection, without being parsed
+# at startup.
+
+COMPILED_MAGIC = '#egginst-registry-1\n'
+PTH_KEY = '-pth-'
+
+
+def compiled_path(path):
+    return os.path.splitext(path)[0] + '.bin'
+
+
+def compile_file(src_path, dst_path):
+    """
+    compile the (collected) registry file src_path into dst_path
+    """
+    reg = {}
+    pth = []
+    for line in stripped_lines(src_path):
+        key, path = line.split(None, 1)
+        if key == PTH_KEY:
+            if path not in pth:
+                pth.append(path)
+        else:
+            # the first package which provides a module wins
+            reg.setdefault(key, path)
+    fo = open(dst_path + '.part', 'wb')
+    fo.write(COMPILED_MAGIC)
+    for path in pth:
+        fo.write('%s\t%s\n' % (PTH_KEY, path))
+    for key in sorted(reg):
+        fo.write('%s\t%s\n' % (key, reg[key]))
+    fo.close()
+    if sys.platform == 'win32' and isfile(dst_path):
+        os.unlink(dst_path)
+    os.rename(dst_path + '.part', dst_path)
+
+
+class RegistryFinder(object):
+    """
+    finder (PEP 302) which looks up modules in a compiled registry file
+    """
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        fi = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # e.g. empty files cannot be mmap'ed
+            self.data = fi.read()
+        fi.close()
+        if self.data[:len(COMPILED_MAGIC)] != COMPILED_MAGIC:
+            raise ValueError("not a compiled registry: %r" % path)
+        # find the .pth entries, the module entries follow them
+        self.pth = []
+        pos = len(COMPILED_MAGIC)
+        prefix = PTH_KEY + '\t'
+        while self.data[pos:pos + len(prefix)] == prefix:
+            end = self.data.find('\n', pos)
+            self.pth.append(self.data[pos + len(prefix):end])
+            pos = end + 1
+        self.start = pos
+
+    def _line(self, pos):
+        """
+        return the tuple(start, end) of the line containing pos
+        """
+        start = self.data.rfind('\n', 0, pos) + 1
+        end = self.data.find('\n', pos)
+        return start, end
+
+    def lookup(self, name):
+        """
+        return the path for the module name, or None
+        """
+        lo = self.start
+        hi = len(self.data)
+        key = name + '\t'
+        while lo < hi:
+            start, end = self._line((lo + hi) // 2)
+            line_key = self.data[start:self.data.find('\t', start, end) + 1]
+            if line_key == key:
+                return self.data[start + len(key):end]
+            if line_key < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def pth_paths(self):
+        return list(self.pth)
+
+    def find_module(self, fullname, path=None):
+        p = self.lookup(fullname)
+        # the registry may be out of date, e.g. after a rollback
+        if p is None or not exists(p):
+            return None
+        return RegistryLoader(p)
+
+
+class RegistryLoader(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def load_module(self, fullname):
+        import imp
+
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        if isdir(self.path):
+            return imp.load_module(fullname, None, self.path,
+                                   ('', '', imp.PKG_DIRECTORY))
+        ext = os.path.splitext(self.path)[1]
+        for suffix, mode, tp in imp.get_suffixes():
+            if suffix == ext:
+                fi = open(self.path, mode)
+                try:
+                    return imp.load_module(fullname, fi, self.path,
+                                           (suffix, mode, tp))
+                finally:
+                    fi.close()
+        raise ImportError("cannot load %r from %r" % (fullname, self.path))
+
+
+def install_finder(path):
+    """
+    install the import hook for the compiled registry file, and add the
+    paths from .pth files to sys.path
+    """
+    finder = RegistryFinder(path)
+    for p in finder.pth_paths():
+        if p not in sys.path:
+            sys.path.append(p)
+    sys.meta_path.insert(0, finder)
+    return finder
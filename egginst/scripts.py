@@ -1,9 +1,10 @@
 import os
 import sys
 import re
-from os.path import abspath, basename, join, isdir, isfile, islink
+from os.path import abspath, basename, join, isfile, islink
 
-from egginst.utils import on_win, rm_rf
+from egginst.utils import on_win, makedirs, rm_rf
+from egginst import timing
 
 
 verbose = False
@@ -77,8 +78,7 @@ sys.exit(subprocess.call([src] + sys.argv[1:]))
 
 def create_proxies(egg):
     # This function is called on Windows only
-    if not isdir(egg.bin_dir):
-        os.makedirs(egg.bin_dir)
+    makedirs(egg.bin_dir)
 
     for line in egg.lines_from_arcname('EGG-INFO/inst/files_to_install.txt'):
         arcname, action = line.split()
@@ -141,8 +141,7 @@ if __name__ == '__main__':
 
 
 def create(egg, conf):
-    if not isdir(egg.bin_dir):
-        os.makedirs(egg.bin_dir)
+    makedirs(egg.bin_dir)
 
     for script_type in ['gui_scripts', 'console_scripts']:
         if script_type not in conf.sections():
@@ -196,6 +195,7 @@ def fix_script(path):
     os.chmod(path, 0755)
 
 
+@timing.timed('scripts')
 def fix_scripts(egg):
     for path in egg.files:
         if path.startswith(egg.bin_dir):
@@ -0,0 +1,118 @@
+"""
+Lightweight timers and counters for the phases of an install, e.g.:
+
+    with timing.timed('extract'):
+        ...
+    timing.count('extract.files', n)
+
+or, as a decorator:
+
+    @timing.timed('resolve')
+    def install_sequence(...):
+
+The timers are always on (they are only used around whole phases, not in
+inner loops), and are reported by the --profile option of enpkg and
+egginst.  Nested phases are named using dots, e.g. the time spent in
+'add_repo.parse' is included in 'add_repo'.
+"""
+import sys
+import time
+import threading
+from functools import wraps
+
+
+_lock = threading.Lock()
+# maps phase names to [calls, seconds]
+_timers = {}
+# maps counter names to their values
+_counters = {}
+_start = time.time()
+
+
+def add_time(name, seconds):
+    with _lock:
+        t = _timers.setdefault(name, [0, 0.0])
+        t[0] += 1
+        t[1] += seconds
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class timed(object):
+    """
+    context manager (and decorator) which adds the time spent to the
+    timer of the phase
+    """
+    def __init__(self, name):
+        self.name = name
+        self._t0 = threading.local()
+
+    def __enter__(self):
+        self._t0.value = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_time(self.name, time.time() - self._t0.value)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwds):
+            t0 = time.time()
+            try:
+                return func(*args, **kwds)
+            finally:
+                add_time(self.name, time.time() - t0)
+        return wrapper
+
+
+def reset():
+    global _start
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _start = time.time()
+
+
+def report():
+    """
+    return the timers and counters as a dictionary (which is also the
+    structure of the JSON file written by write_json)
+    """
+    with _lock:
+        return {
+            'total': time.time() - _start,
+            'phases': dict((name, {'calls': calls, 'seconds': seconds})
+                           for name, (calls, seconds) in _timers.iteritems()),
+            'counters': dict(_counters),
+        }
+
+
+def print_report(fo=sys.stdout):
+    rep = report()
+    fmt = '%-36s %6s %10s %6s'
+    fo.write(fmt % ('Phase', 'calls', 'seconds', '%') + '\n')
+    fo.write(61 * '=' + '\n')
+    for name in sorted(rep['phases']):
+        d = rep['phases'][name]
+        indent = '  ' * name.count('.')
+        fo.write(fmt % (indent + name.split('.')[-1], d['calls'],
+                        '%.3f' % d['seconds'],
+                        '%.1f' % (100.0 * d['seconds'] / rep['total'])
+                        if rep['total'] else '-') + '\n')
+    fo.write(fmt % ('total', '', '%.3f' % rep['total'], '') + '\n')
+    if rep['counters']:
+        fo.write('\n')
+        for name in sorted(rep['counters']):
+            fo.write('%-36s %17d\n' % (name, rep['counters'][name]))
+
+
+def write_json(path):
+    import json
+
+    fo = open(path, 'w')
+    json.dump(report(), fo, indent=2, sort_keys=True)
+    fo.write('\n')
+    fo.close()
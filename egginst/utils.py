@@ -1,6 +1,5 @@
 import sys
 import os
-import shutil
 from os.path import isdir, isfile, islink
 
 
@@ -45,6 +44,21 @@ def pprint_fn_action(fn, action):
     print "%-56s %20s" % (fn, '[%s]' % action)
 
 
+def makedirs(path):
+    """
+    Create the directory `path` (and its parents), unless it exists already.
+    Unlike os.makedirs, this does not fail when the directory is created
+    (e.g. by another thread) in the mean time.
+    """
+    if isdir(path):
+        return
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not isdir(path):
+            raise
+
+
 def rm_empty_dir(path):
     """
     Remove the directory `path` if it is a directory and empty.
@@ -79,6 +93,7 @@ def rm_rf(path, verbose=False):
     elif isdir(path):
         if verbose:
             print "Removing: %r (directory)" % path
+        import shutil
         shutil.rmtree(path)
 
 
@@ -4,7 +4,6 @@
 import re
 import os
 import sys
-import platform
 from os.path import isfile, join
 
 from enstaller import __version__
@@ -26,6 +25,12 @@ default = dict(
     proxy=None,
     noapp=False,
     local=join(sys.prefix, 'LOCAL-REPO'),
+    local_max_size=None,
+    local_keep_revisions=3,
+    egg_store=None,
+    egg_store_max_size=None,
+    extract_store=None,
+    precompile=False,
     EPD_auth=None,
     EPD_userpass=None,
     IndexedRepos=[pypi_url + plat.subdir + '/'],
@@ -104,6 +109,32 @@ IndexedRepos = [
 # Note that the enpkg --proxy option will overwrite this setting.
 %(proxy_line)s
 
+# Eggs are fetched into the local repository before they are installed.
+# When a size (in MB) is set here, the least recently used eggs are removed
+# from the local repository after each install, until it fits the size.
+# Eggs referenced by the current state and the last local_keep_revisions
+# revisions (see enpkg --log) are always kept.  Also see enpkg --gc.
+#local_max_size = 1000
+#local_keep_revisions = 3
+
+# Eggs can be shared between all environments on a machine, by setting
+# the path of a (writable) egg store, from which eggs are hardlinked into
+# the local repository of each environment.  Optionally, the size (in MB)
+# of the store can be limited, in which case the least recently used eggs
+# are removed after each install.
+#egg_store = '/var/cache/enstaller/eggs'
+#egg_store_max_size = 2000
+
+# Similarly, eggs can be extracted only once into a store, from which the
+# files are hardlinked into each environment (when on the same file system)
+# which makes installing packages much faster.  Note that files installed
+# this way must not be modified in place.
+#extract_store = '/var/cache/enstaller/extracted'
+
+# Uncommenting the next line will byte-compile the modules of each package
+# when it is installed, instead of on their first import.
+#precompile = True
+
 # Uncommenting the next line will disable application menu item install.
 # This only effects the few packages which install menu items,
 # which as IPython.
@@ -191,6 +222,7 @@ def change_auth(username, password):
     fo = open(path, 'w')
     fo.write(data)
     fo.close()
+    clear_cache()
 
 
 def prepend_url(url):
@@ -203,6 +235,7 @@ def prepend_url(url):
     f.seek(0)
     f.write(data)
     f.close()
+    clear_cache()
 
 
 def arch_filled_url(url):
@@ -211,9 +244,113 @@ def arch_filled_url(url):
     return cleanup_reponame(url.replace('{ARCH}', plat.arch))
 
 
+class ConfigError(Exception):
+    pass
+
+
+def parse(data, path='<string>'):
+    """
+    parse the content of a config file, which may only contain assignments
+    of literals (strings, numbers, lists, dicts, True, False and None) to
+    names, and return the dictionary of these names (the file is not
+    executed)
+    """
+    import ast
+
+    try:
+        tree = ast.parse(data, path)
+    except SyntaxError as e:
+        raise ConfigError("%s, line %s: invalid syntax" % (path, e.lineno))
+    res = {}
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name)):
+            raise ConfigError("%s, line %d: only assignments of the form "
+                              "'name = value' are allowed" %
+                              (path, node.lineno))
+        try:
+            res[node.targets[0].id] = ast.literal_eval(node.value)
+        except ValueError:
+            raise ConfigError("%s, line %d: value of %r is not a literal" %
+                              (path, node.lineno, node.targets[0].id))
+    return res
+
+
+def fix_values(conf):
+    """
+    fill in the architecture into the repository URLs, and make the paths
+    absolute
+    """
+    for k in conf:
+        v = conf[k]
+        if k == 'IndexedRepos':
+            conf[k] = [arch_filled_url(url) for url in v]
+        elif k in ('prefix', 'local', 'egg_store', 'extract_store'):
+            conf[k] = abs_expanduser(v)
+
+
+# The parsed (and fixed) configuration is cached in this file next to the
+# config file, such that neither parsing nor arch_filled_url (which may stat
+# directories) is necessary when the config file did not change.
+CACHE_VERSION = 1
+
+def cache_path(path):
+    return path + '.cache'
+
+
+def cache_key(path):
+    # fix_values depends on the home directory, and on the current working
+    # directory (relative paths are made absolute)
+    st = os.stat(path)
+    return (CACHE_VERSION, path, st.st_mtime, st.st_size, plat.arch,
+            abs_expanduser('~'), os.getcwd())
+
+
+def load_cache(path, key):
+    import marshal
+
+    try:
+        fi = open(cache_path(path), 'rb')
+        try:
+            cached_key, conf = marshal.load(fi)
+        finally:
+            fi.close()
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if cached_key != key:
+        return None
+    return conf
+
+
+def save_cache(path, key, conf):
+    import marshal
+
+    tmp_path = cache_path(path) + '.%d' % os.getpid()
+    try:
+        fo = open(tmp_path, 'wb')
+        try:
+            marshal.dump((key, conf), fo)
+        finally:
+            fo.close()
+        if sys.platform == 'win32' and isfile(cache_path(path)):
+            os.unlink(cache_path(path))
+        os.rename(tmp_path, cache_path(path))
+    except (IOError, OSError):
+        # the cache is an optimization, e.g. the config file in sys.prefix
+        # might not be writable
+        if isfile(tmp_path):
+            os.unlink(tmp_path)
+
+
 def clear_cache():
     if hasattr(read, 'cache'):
         del read.cache
+    path = get_path()
+    if path and isfile(cache_path(path)):
+        try:
+            os.unlink(cache_path(path))
+        except OSError:
+            pass
 
 
 def read():
@@ -225,17 +362,22 @@ def read():
         return read.cache
 
     path = get_path()
-    read.cache = {}
     if path is None:
+        read.cache = {}
         return read.cache
 
-    execfile(path, read.cache)
-    for k in read.cache:
-        v = read.cache[k]
-        if k == 'IndexedRepos':
-            read.cache[k] = [arch_filled_url(url) for url in v]
-        elif k in ('prefix', 'local'):
-            read.cache[k] = abs_expanduser(v)
+    # read.cache is only set once the file was parsed, such that an invalid
+    # config file is reported every time, instead of silently falling back
+    # to the defaults
+    key = cache_key(path)
+    conf = load_cache(path, key)
+    if conf is None:
+        fi = open(path)
+        conf = parse(fi.read(), path)
+        fi.close()
+        fix_values(conf)
+        save_cache(path, key, conf)
+    read.cache = conf
     return read.cache
 
 
@@ -244,6 +386,8 @@ def get(key, default_val=None):
 
 
 def print_config():
+    import platform
+
     print "Python version:", PY_VER
     print "enstaller version:", __version__
     print "sys.prefix:", sys.prefix
@@ -252,7 +396,9 @@ def print_config():
     print "config file:", get_path()
     print
     print "settings:"
-    for k in 'info_url', 'prefix', 'local', 'noapp', 'proxy':
+    for k in ('info_url', 'prefix', 'local', 'local_max_size',
+              'local_keep_revisions', 'egg_store', 'egg_store_max_size',
+              'extract_store', 'precompile', 'noapp', 'proxy'):
         print "    %s = %r" % (k, get(k))
     print "    IndexedRepos:"
     for repo in get('IndexedRepos'):
@@ -0,0 +1,145 @@
+"""
+A machine-wide store of eggs, which is shared between prefixes.  Eggs are
+stored under their MD5 (which is known from the index before an egg is
+fetched), and are hardlinked into the LOCAL-REPO of each prefix (or copied,
+when hardlinks are not possible, e.g. across file systems), such that an
+egg is only downloaded once per machine.
+
+Access is synchronized by a lock file: adding and linking eggs takes a
+shared lock, while eviction takes an exclusive lock.  The modification
+time of a stored egg is updated whenever the egg is used, which makes it
+possible to evict the least recently used eggs first.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from os.path import isdir, isfile, join
+
+try:
+    import fcntl
+except ImportError:
+    # on Windows, we simply don't lock
+    fcntl = None
+
+
+class EggStore(object):
+
+    def __init__(self, dir_path, max_size=None):
+        self.dir_path = dir_path
+        # maximal total size (in bytes) of all eggs in the store, which is
+        # enforced by evict()
+        self.max_size = max_size
+
+    def path(self, md5):
+        return join(self.dir_path, md5[:2], md5 + '.egg')
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        if not isdir(self.dir_path):
+            os.makedirs(self.dir_path)
+        fo = open(join(self.dir_path, '.lock'), 'a')
+        try:
+            if fcntl:
+                fcntl.flock(fo, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # closing the file releases the lock
+            fo.close()
+
+    def get(self, md5, dst):
+        """
+        link (or copy) the egg with the MD5 from the store to dst, return
+        True on success, and False if the egg is not in the store
+        """
+        path = self.path(md5)
+        if not isfile(path):
+            return False
+        with self.lock():
+            try:
+                os.utime(path, None)
+                link_or_copy(path, dst)
+            except (IOError, OSError):
+                # evicted in the mean time
+                return False
+        return True
+
+    def add(self, src, md5):
+        """
+        add the egg src (whose MD5 is known to the caller) to the store
+        """
+        path = self.path(md5)
+        if isfile(path):
+            return
+        with self.lock():
+            dir_path = join(self.dir_path, md5[:2])
+            if not isdir(dir_path):
+                os.makedirs(dir_path)
+            fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.part')
+            os.close(fd)
+            os.unlink(tmp_path)
+            link_or_copy(src, tmp_path)
+            os.rename(tmp_path, path)
+
+    def eggs(self):
+        """
+        return the list of tuples(mtime, size, path) of the eggs in the
+        store, least recently used first
+        """
+        res = []
+        if not isdir(self.dir_path):
+            return res
+        for dn in os.listdir(self.dir_path):
+            dir_path = join(self.dir_path, dn)
+            if not isdir(dir_path):
+                continue
+            for fn in os.listdir(dir_path):
+                if not fn.endswith('.egg'):
+                    continue
+                path = join(dir_path, fn)
+                st = os.stat(path)
+                res.append((st.st_mtime, st.st_size, path))
+        res.sort()
+        return res
+
+    def size(self):
+        return sum(size for mtime, size, path in self.eggs())
+
+    def evict(self, max_size=None):
+        """
+        remove the least recently used eggs from the store, until the total
+        size is at most max_size (defaults to self.max_size) bytes, and
+        return the tuple(number of eggs removed, bytes removed)
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return 0, 0
+        n = removed = 0
+        with self.lock(exclusive=True):
+            eggs = self.eggs()
+            total = sum(size for mtime, size, path in eggs)
+            for mtime, size, path in eggs:
+                if total <= max_size:
+                    break
+                os.unlink(path)
+                total -= size
+                removed += size
+                n += 1
+        return n, removed
+
+
+def link_or_copy(src, dst):
+    """
+    hardlink src to dst, or copy the file if linking is not possible,
+    an existing file dst is replaced
+    """
+    if isfile(dst):
+        os.unlink(dst)
+    if hasattr(os, 'link'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
@@ -0,0 +1,188 @@
+"""
+Stream of progress events, which decouples the work (downloading and
+installing eggs) from the consumers of the progress information (console
+output, GUIs, web interfaces).
+
+Producers emit events into a bounded queue, and the consumers are called
+with the events from a separate (daemon) thread.  Progress events are
+emitted for every chunk of data, so they are coalesced: while a progress
+event of the same egg and phase is still waiting in the queue, the waiting
+event is updated instead of queuing a new one.  The first (so_far == 0) and
+final (so_far == total) progress events are never coalesced, such that
+consumers (like console_file_progress) can rely on them.
+
+The consumer thread of a stream only holds a weak reference to it, and
+exits when the stream is closed or garbage collected, so discarded streams
+do not leave threads behind.
+"""
+import sys
+import time
+import atexit
+import logging
+import weakref
+import threading
+from Queue import Queue, Full
+
+
+logger = logging.getLogger(__name__)
+
+
+ACTION = 'action'
+PROGRESS = 'progress'
+
+# the streams which have a consumer thread, which are closed at exit, as a
+# daemon thread which is still waiting for events while the interpreter
+# shuts down may die with an error (the module globals are gone by then)
+_open = weakref.WeakSet()
+
+
+def close_all():
+    for stream in list(_open):
+        stream.close()
+
+atexit.register(close_all)
+
+
+def _consume(ref, queue):
+    while True:
+        event = queue.get()
+        try:
+            if event is None:
+                return
+            stream = ref()
+            if stream is None:
+                return
+            stream._deliver(event)
+            del stream
+        finally:
+            queue.task_done()
+
+
+class Event(object):
+    """
+    type:     ACTION or PROGRESS
+    egg:      name of the egg (filename)
+    phase:    for ACTION events the action, e.g. 'downloading', 'installing',
+              for PROGRESS events 'download', 'install' or 'remove'
+    so_far:   bytes (or files) so far (PROGRESS events only)
+    total:    bytes (or files) total, None if unknown (PROGRESS events only)
+    time:     time at which the event was (last) emitted
+    elapsed:  seconds since the first progress event of the egg and phase
+    """
+    __slots__ = ('type', 'egg', 'phase', 'so_far', 'total', 'time',
+                 'elapsed')
+
+    def __init__(self, type, egg, phase, so_far=None, total=None):
+        self.type = type
+        self.egg = egg
+        self.phase = phase
+        self.so_far = so_far
+        self.total = total
+        self.time = time.time()
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return 'Event(%s)' % ', '.join('%s=%r' % (k, getattr(self, k))
+                                       for k in self.__slots__)
+
+
+class EventStream(object):
+
+    def __init__(self, maxsize=1000):
+        self.queue = Queue(maxsize)
+        self.consumers = []
+        self.lock = threading.Lock()
+        # maps (egg, phase) to the progress event waiting in the queue
+        self._pending = {}
+        # maps (egg, phase) to the start time of the progress
+        self._start = {}
+        self._thread = None
+
+    def subscribe(self, consumer):
+        """
+        add a consumer, which is called with each event
+        """
+        self.consumers.append(consumer)
+
+    def emit(self, event):
+        if event.type == PROGRESS:
+            key = event.egg, event.phase
+            if event.so_far == 0 or key not in self._start:
+                self._start[key] = event.time
+            event.elapsed = event.time - self._start[key]
+            if event.so_far == event.total:
+                del self._start[key]
+            elif event.so_far != 0:
+                with self.lock:
+                    pending = self._pending.get(key)
+                    if pending is not None:
+                        # update the waiting event instead of queuing
+                        pending.so_far = event.so_far
+                        pending.total = event.total
+                        pending.time = event.time
+                        pending.elapsed = event.elapsed
+                        return
+                    self._pending[key] = event
+                try:
+                    self._put(event, block=False)
+                except Full:
+                    # dropping intermediate progress is fine
+                    with self.lock:
+                        del self._pending[key]
+                return
+        self._put(event)
+
+    def _put(self, event, block=True):
+        if self._thread is None:
+            with self.lock:
+                if self._thread is None:
+                    # when the stream is collected, the thread is stopped
+                    queue = self.queue
+                    ref = weakref.ref(self, lambda r: queue.put(None))
+                    self._thread = threading.Thread(target=_consume,
+                                                    args=(ref, queue))
+                    self._thread.daemon = True
+                    self._thread.start()
+                    _open.add(self)
+        self.queue.put(event, block)
+
+    def close(self):
+        """
+        deliver the remaining events, and stop the consumer thread
+        """
+        with self.lock:
+            thread, self._thread = self._thread, None
+            _open.discard(self)
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def _deliver(self, event):
+        with self.lock:
+            key = event.egg, event.phase
+            if self._pending.get(key) is event:
+                del self._pending[key]
+        for consumer in self.consumers:
+            try:
+                consumer(event)
+            except Exception:
+                logger.exception('Error in event consumer %r' % consumer)
+
+    def flush(self):
+        """
+        wait until all events emitted so far have been consumed
+        """
+        self.queue.join()
+        sys.stdout.flush()
+
+    def action(self, egg, action):
+        self.emit(Event(ACTION, egg, action))
+
+    def progress_callback(self, phase, egg):
+        """
+        return a callback(so_far, total), as used by write_data_from_url
+        and EggInst, which emits progress events for the egg and phase
+        """
+        def callback(so_far, total):
+            self.emit(Event(PROGRESS, egg, phase, so_far, total))
+        return callback
@@ -6,6 +6,7 @@ import string
 from os.path import isfile, join
 
 import egginst
+from egginst import timing
 
 
 TIME_FMT = '%Y-%m-%d %H:%M:%S %Z'
@@ -107,6 +108,7 @@ class History(object):
             raise Exception('Did not expect: %r' % arg)
         return pkgs[i]
 
+    @timing.timed('history')
     def update(self):
         """
         update the history file (creating a new one if necessary)
@@ -0,0 +1,105 @@
+"""
+An on-disk cache for install sequences computed by a Chain.
+
+The cache key includes the fingerprints (MD5 sums) of the index of every
+repository in the chain, so the cache is automatically invalidated when
+any repository changes: a changed index simply results in a new key.
+The entries for old keys are never looked up again, so whenever an entry
+is written, the least recently used entries beyond max_entries are removed
+(the mtime of an entry is updated when it is used).
+"""
+import os
+import time
+import hashlib
+import tempfile
+from os.path import isdir, isfile, join
+
+
+class ResolveCache(object):
+
+    def __init__(self, dir_path, max_entries=100):
+        self.dir_path = dir_path
+        self.max_entries = max_entries
+
+    def path(self, key):
+        return join(self.dir_path, hashlib.md5(repr(key)).hexdigest() + '.txt')
+
+    def get(self, key):
+        """
+        return the list of distributions stored for the key, or None if
+        nothing is stored
+        """
+        path = self.path(key)
+        if not isfile(path):
+            return None
+        fi = open(path)
+        lines = fi.read().splitlines()
+        fi.close()
+        # the first line holds the key itself, such that we never return
+        # the value for a different key (with the same hash)
+        if not lines or lines[0] != '# ' + repr(key):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return lines[1:]
+
+    def set(self, key, dists):
+        """
+        store the list of distributions for the key, failures to write
+        (e.g. because of permissions) are ignored, as the cache is merely
+        an optimization
+        """
+        try:
+            self._write(self.path(key), key, dists)
+            self.prune()
+        except (IOError, OSError):
+            pass
+
+    def prune(self):
+        """
+        remove the least recently used entries, such that at most
+        max_entries are left, and temporary files left behind by
+        interrupted writes
+        """
+        entries = []
+        remove = []
+        for fn in os.listdir(self.dir_path):
+            path = join(self.dir_path, fn)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                # removed by another process in the mean time
+                continue
+            if fn.endswith('.txt'):
+                entries.append((mtime, path))
+            elif fn.endswith('.part') and time.time() - mtime > 3600:
+                remove.append(path)
+        entries.sort(reverse=True)
+        remove.extend(path for mtime, path in entries[self.max_entries:])
+        for path in remove:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _write(self, path, key, dists):
+        if not isdir(self.dir_path):
+            try:
+                os.makedirs(self.dir_path)
+            except OSError:
+                # another process might have created the directory
+                if not isdir(self.dir_path):
+                    raise
+        # write to a temporary file first, and then rename, such that
+        # concurrent readers never see a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir_path, suffix='.part')
+        fo = os.fdopen(fd, 'w')
+        fo.write('# %r\n' % (key,))
+        for dist in dists:
+            fo.write(dist + '\n')
+        fo.close()
+        if os.name == 'nt' and isfile(path):
+            os.unlink(path)
+        os.rename(tmp_path, path)
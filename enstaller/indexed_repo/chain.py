@@ -1,16 +1,94 @@
 import os
 import sys
 import bz2
-import zipfile
+import hashlib
 from cStringIO import StringIO
 from collections import defaultdict
-from os.path import basename, getsize, isfile, isdir, join
+from os.path import basename, dirname, getsize, isfile, isdir, join
 
 from egginst.utils import pprint_fn_action, rm_rf, console_file_progress
-from enstaller.utils import comparable_version, md5_file, write_data_from_url
+from egginst import timing
+from enstaller import __version__
+from enstaller.utils import (cname_fn, comparable_version, md5_file,
+                             write_data_from_url)
+from enstaller.plat import custom_plat
 import metadata
 import dist_naming
+import requirement
+import delta
 from requirement import Req, add_Reqs_to_spec
+from resolver import Resolver, ResolutionError
+
+
+class DistIndex(object):
+    """
+    A view of the index of a Chain, which maps distributions (i.e. repo +
+    filename strings) to their spec records.  The Chain itself keys the
+    records by (repo_id, filename), such that the repository URL is not
+    stored once for every distribution.
+    """
+    def __init__(self, chain):
+        self._chain = chain
+
+    def __getitem__(self, dist):
+        return self._chain._specs[self._chain._key(dist)]
+
+    def __setitem__(self, dist, spec):
+        key = self._chain._key(dist, True)
+        spec = as_spec(spec)
+        self._chain.fingerprints.pop(self._chain._repo_names[key[0]], None)
+        self._chain._versions.pop(spec.cname, None)
+        self._chain._specs[key] = spec
+
+    def __contains__(self, dist):
+        if not isinstance(dist, basestring):
+            return False
+        try:
+            return self._chain._key(dist) in self._chain._specs
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self._chain._specs)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def get(self, dist, default=None):
+        try:
+            return self[dist]
+        except KeyError:
+            return default
+
+    def iterkeys(self):
+        for key in self._chain._specs:
+            yield self._chain._dist(key)
+
+    def itervalues(self):
+        return self._chain._specs.itervalues()
+
+    def iteritems(self):
+        for key, spec in self._chain._specs.iteritems():
+            yield self._chain._dist(key), spec
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return self._chain._specs.values()
+
+    def items(self):
+        return list(self.iteritems())
+
+
+def as_spec(spec):
+    """
+    return the spec as a Spec record (converting it from a dictionary,
+    if necessary)
+    """
+    if isinstance(spec, metadata.Spec):
+        return spec
+    return metadata.Spec(**spec)
 
 
 class Chain(object):
@@ -22,12 +100,40 @@ class Chain(object):
         self.download_progress_callback = (download_progress_callback or
                                            console_file_progress)
 
-        # maps distributions to specs
-        self.index = {}
+        # maps (repo_id, filename) keys to spec records
+        self._specs = {}
+
+        # maps distributions to specs (view of the above)
+        self.index = DistIndex(self)
 
-        # maps cnames to the list of distributions (in repository order)
+        # maps cnames to the list of (repo_id, filename) keys of the
+        # distributions (in repository order)
         self.groups = defaultdict(list)
 
+        # maps cnames to their version tables (see version_table below) by
+        # Python version, entries are removed when distributions are added
+        self._versions = {}
+
+        # maps repos to repo_ids, and repo_ids to repos
+        self._repo_ids = {}
+        self._repo_names = []
+
+        # maps repos to the MD5 of their index, used as the key for the
+        # resolve_cache (which is only used when all repos have an entry)
+        self.fingerprints = {}
+
+        # optional ResolveCache object, for storing install sequences
+        self.resolve_cache = None
+
+        # optional EggStore object, shared between prefixes, from which
+        # eggs are linked (instead of being downloaded) when possible
+        self.egg_store = None
+
+        # maps repos to their delta index (see delta.py), which is only
+        # fetched when there is an egg in fetch_dir, from which a delta
+        # could be applied
+        self._delta_indices = {}
+
         # Chain of repositories, either local or remote
         self.repos = []
         for repo in repos:
@@ -45,6 +151,39 @@ class Chain(object):
         print
 
 
+    def _key(self, dist, create=False):
+        """
+        return the (repo_id, filename) key for a distribution, the repo
+        is registered when create is True (otherwise a KeyError is raised
+        for unknown repos)
+        """
+        i = max(dist.rfind('/'), dist.rfind('\\')) + 1
+        repo, fn = dist[:i], dist[i:]
+        if create and repo not in self._repo_ids:
+            self._repo_ids[repo] = len(self._repo_names)
+            self._repo_names.append(repo)
+        return self._repo_ids[repo], fn
+
+
+    def _dist(self, key):
+        return self._repo_names[key[0]] + key[1]
+
+
+    def add_dist(self, dist, spec):
+        """
+        add a distribution, and its spec (which may be a Spec record or
+        a dictionary), to the index
+        """
+        key = self._key(dist, True)
+        spec = as_spec(spec)
+        self.fingerprints.pop(self._repo_names[key[0]], None)
+        if key not in self._specs:
+            self.groups[spec.cname].append(key)
+        self._versions.pop(spec.cname, None)
+        self._specs[key] = spec
+
+
+    @timing.timed('add_repo')
     def add_repo(self, repo, index_fn='index-depend.bz2'):
         """
         Add a repo to the chain, i.e. read the index file of the url,
@@ -72,27 +211,30 @@ class Chain(object):
         if self.verbose:
             print " index:", index_fn
 
-        faux = StringIO()
-        write_data_from_url(faux, index_url)
-        index_data = faux.getvalue()
-        faux.close()
+        with timing.timed('add_repo.download'):
+            faux = StringIO()
+            write_data_from_url(faux, index_url)
+            index_data = faux.getvalue()
+            faux.close()
+        timing.count('add_repo.bytes', len(index_data))
 
+        fingerprint = hashlib.md5(index_data).hexdigest()
         if self.verbose:
-            import hashlib
-            print "   md5:", hashlib.md5(index_data).hexdigest()
+            print "   md5:", fingerprint
             print
 
         if index_fn.endswith('.bz2'):
-            index_data = bz2.decompress(index_data)
-
-        new_index = metadata.parse_depend_index(index_data)
-        for spec in new_index.itervalues():
-            add_Reqs_to_spec(spec)
+            with timing.timed('add_repo.decompress'):
+                index_data = bz2.decompress(index_data)
 
-        for distname, spec in new_index.iteritems():
-            dist = repo + distname
-            self.index[dist] = spec
-            self.groups[spec['cname']].append(dist)
+        with timing.timed('add_repo.parse'):
+            n = len(self._specs)
+            for distname, spec in metadata.iter_depend_index(index_data):
+                spec = metadata.Spec(**spec)
+                add_Reqs_to_spec(spec)
+                self.add_dist(repo + distname, spec)
+        timing.count('add_repo.dists', len(self._specs) - n)
+        self.fingerprints[repo] = fingerprint
 
 
     def get_version_build(self, dist):
@@ -111,9 +253,9 @@ class Chain(object):
         repository order)
         """
         assert req.strictness >= 1
-        for dist in self.groups[req.name]:
-            if req.matches(self.index[dist]):
-                yield dist
+        for key in self.groups[req.name]:
+            if req.matches_spec(self._specs[key]):
+                yield self._dist(key)
 
 
     def get_repo(self, req):
@@ -131,15 +273,19 @@ class Chain(object):
         return the distributions with the largest version and build number
         from the first repository which contains any matches
         """
-        repo = self.get_repo(req)
-        if repo is None:
-            return None
-
+        assert req.strictness >= 1
+        repo_id = None
         matches = []
-        for dist in self.iter_dists(req):
-            if dist_naming.repo_dist(dist) == repo:
-                matches.append(dist)
-        return max(matches, key=self.get_version_build)
+        for key in self.groups[req.name]:
+            if repo_id is not None and key[0] != repo_id:
+                continue
+            spec = self._specs[key]
+            if req.matches_spec(spec):
+                repo_id = key[0]
+                matches.append((dist_naming.comparable_spec(spec), key))
+        if not matches:
+            return None
+        return self._dist(max(matches)[1])
 
 
     def reqs_dist(self, dist):
@@ -147,14 +293,14 @@ class Chain(object):
         return the set of requirement objects listed by the given
         distribution
         """
-        return self.index[dist]['Reqs']
+        return self._specs[self._key(dist)].Reqs
 
 
     def cname_dist(self, dist):
         """
         return the canonical project name for a given distribution
         """
-        return self.index[dist]['cname']
+        return self._specs[self._key(dist)].cname
 
 
     def are_complete(self, dists):
@@ -205,7 +351,7 @@ class Chain(object):
                 # see if all required packages were added already
                 if all(bool(name in names_inst) for name in rns[dist]):
                     result.append(dist)
-                    names_inst.add(self.index[dist]['cname'])
+                    names_inst.add(self.cname_dist(dist))
                     assert len(names_inst) == len(result)
 
             if len(result) == n:
@@ -247,6 +393,9 @@ class Chain(object):
                 if d is None:
                     sys.exit('Error: could not resolve %r required by %r' %
                              (r, dist))
+                if d in dists:
+                    # the dependents of d have already been added
+                    continue
                 dists.add(d)
                 add_dependents(d)
 
@@ -271,9 +420,47 @@ class Chain(object):
                 # add the one
                 dists.append(self.get_dist(r))
 
+        if not self.is_consistent(dists):
+            # The distributions picked above, where the strictest
+            # requirement wins, are in conflict, so we need to search.
+            if self.verbose:
+                print "Conflicting requirements, searching for a solution"
+            try:
+                dists = Resolver(self).solve([self.req_root(root)])
+            except ResolutionError as e:
+                sys.exit('Error: %s' % e)
+
         return self.determine_install_order(dists)
 
 
+    def req_root(self, root):
+        """
+        return the requirement which only matches the distribution root
+        """
+        spec = self.index[root]
+        return Req('%s %s-%i' % (spec.cname, spec.version, spec.build))
+
+
+    def is_consistent(self, dists):
+        """
+        return True if the distributions 'dists' are consistent, i.e. each
+        project name is listed only once, and for each distribution all
+        requirements are satisfied by the distributions
+        """
+        specs = {}
+        for dist in dists:
+            spec = self.index[dist]
+            if spec.cname in specs:
+                return False
+            specs[spec.cname] = spec
+        for spec in specs.itervalues():
+            for r in spec.Reqs:
+                if r.name not in specs or not r.matches_spec(specs[r.name]):
+                    return False
+        return True
+
+
+    @timing.timed('resolve')
     def install_sequence(self, req, mode='recur'):
         """
         Return the list of distributions which need to be installed.
@@ -285,10 +472,45 @@ class Chain(object):
 
         'flat':  dependencies are handled only one level deep
 
-        'recur': dependencies are handled recursively (default)
+        'recur': dependencies are handled recursively (default), such
+                 that all requirements of all distributions are satisfied
         """
         if self.verbose:
             print "Determining install sequence for %r" % req
+
+        key = self.cache_key(req, mode)
+        if key is not None:
+            dists = self.resolve_cache.get(key)
+            if dists is not None:
+                if self.verbose:
+                    print "Using cached install sequence"
+                return dists
+
+        dists = self._install_sequence(req, mode)
+        if key is not None and dists is not None:
+            self.resolve_cache.set(key, dists)
+        return dists
+
+
+    def cache_key(self, req, mode):
+        """
+        return the key under which the install sequence for the requirement
+        is stored in the resolve_cache, or None if the result cannot be
+        cached (because there is no cache or not all repositories have a
+        fingerprint)
+        """
+        if self.resolve_cache is None:
+            return None
+        repos = []
+        for repo in self._repo_names:
+            if repo not in self.fingerprints:
+                return None
+            repos.append((repo, self.fingerprints[repo]))
+        return (str(req), mode, tuple(repos), requirement.PY_VER,
+                custom_plat, __version__)
+
+
+    def _install_sequence(self, req, mode):
         root = self.get_dist(req)
         if root is None:
             return None
@@ -305,24 +527,40 @@ class Chain(object):
         raise Exception('did not expect: mode = %r' % mode)
 
 
+    def version_table(self, name):
+        """
+        given the name of a package, returns a sorted list of tuples
+        (version, repo), where repo is the first repository containing
+        the version (which is where get_dist() finds it)
+        """
+        req = Req(name)
+        tables = self._versions.setdefault(req.name, {})
+        try:
+            return tables[requirement.PY_VER]
+        except KeyError:
+            pass
+        repo_ids = {}
+        for key in self.groups[req.name]:
+            spec = self._specs[key]
+            if spec.version not in repo_ids and req.matches_spec(spec):
+                repo_ids[spec.version] = key[0]
+        res = [(version, self._repo_names[repo_ids[version]])
+               for version in sorted(repo_ids, key=comparable_version)]
+        tables[requirement.PY_VER] = res
+        return res
+
+
     def list_versions(self, name):
         """
         given the name of a package, retruns a sorted list of versions for
         package `name` found in any repo.
         """
-        versions = set()
-
-        req = Req(name)
-        for dist in self.groups[req.name]:
-            spec = self.index[dist]
-            if req.matches(spec):
-                versions.add(spec['version'])
-
-        return sorted(versions, key=comparable_version)
+        return [version for version, repo in self.version_table(name)]
 
 
+    @timing.timed('fetch')
     def fetch_dist(self, dist, fetch_dir, force=False, check_md5=False,
-                   dry_run=False):
+                   dry_run=False, progress_callback=None):
         """
         Get a distribution, i.e. copy or download the distribution into
         fetch_dir.
@@ -341,6 +579,10 @@ class Chain(object):
               * If force=True, this option is has no effect, because the file
                 is forcefully downloaded, ignoring any existing file (as well
                 as the MD5).
+
+        progress_callback:
+            called with the download progress, defaults to
+            self.download_progress_callback
         """
         md5 = self.index[dist].get('md5')
         size = self.index[dist].get('size')
@@ -354,21 +596,117 @@ class Chain(object):
             if self.verbose:
                 print "Not forcing refetch, %r already exists" % dst
             return
+        if self.egg_store and md5 and not (force or dry_run):
+            if self.egg_store.get(md5, dst):
+                self.file_action_callback(fn, 'linking')
+                return
         self.file_action_callback(fn, ('copying', 'downloading')
                                   [dist.startswith(('http://', 'https://'))])
         if dry_run:
             return
 
+        progress_callback = (progress_callback or
+                             self.download_progress_callback)
+        # (copying a whole egg from a local repository is as fast as
+        # applying a delta)
+        if (md5 and dist.startswith(('http://', 'https://')) and
+                self.fetch_delta(dist, dst, progress_callback)):
+            if self.egg_store:
+                self.egg_store.add(dst, md5)
+            return
+
         if self.verbose:
             print "Copying: %r" % dist
             print "     to: %r" % dst
 
         fo = open(dst + '.part', 'wb')
         write_data_from_url(fo, dist, md5, size,
-                            progress_callback=self.download_progress_callback)
+                            progress_callback=progress_callback)
+        timing.count('fetch.bytes', fo.tell())
         fo.close()
         rm_rf(dst)
         os.rename(dst + '.part', dst)
+        if self.egg_store and md5:
+            self.egg_store.add(dst, md5)
+
+
+    def delta_index(self, repo):
+        """
+        return the delta index of the repository (see delta.parse_index),
+        which is empty when the repository has no (valid) index-delta.bz2
+        """
+        if repo in self._delta_indices:
+            return self._delta_indices[repo]
+        url = repo + delta.INDEX_FN
+        res = {}
+        try:
+            if url.startswith('file://'):
+                fi = open(url[7:], 'rb')
+            else:
+                from enstaller.utils import open_with_auth
+                fi = open_with_auth(url)
+            data = fi.read()
+            fi.close()
+            res = delta.parse_index(bz2.decompress(data))
+        except (IOError, EOFError, delta.DeltaError):
+            # (urllib2.HTTPError is also an IOError)
+            pass
+        self._delta_indices[repo] = res
+        return res
+
+
+    def fetch_delta(self, dist, dst, progress_callback=None):
+        """
+        Try to reconstruct the distribution at dst from a previous build of
+        the same package (which is in the same directory as dst), and a
+        delta from the repository.  Return True when successful, and False
+        when there is no applicable delta (or applying it failed), in which
+        case the whole distribution has to be fetched.
+        """
+        md5 = self.index[dist].get('md5')
+        repo, fn = dist_naming.split_dist(dist)
+        fetch_dir = dirname(dst)
+        cname = cname_fn(fn)
+        olds = [join(fetch_dir, fn2) for fn2 in os.listdir(fetch_dir)
+                if fn2 != fn and fn2.endswith('.egg') and
+                cname_fn(fn2) == cname]
+        if not olds:
+            return False
+        deltas = self.delta_index(repo).get(md5)
+        if not deltas:
+            return False
+        md5s = dict((md5_file(path), path) for path in olds)
+        deltas = [d for d in deltas if d[0] in md5s]
+        if not deltas:
+            return False
+        old_md5, size, delta_md5 = min(deltas, key=lambda d: d[1])
+
+        self.file_action_callback(fn, 'delta')
+        delta_path = dst + '.delta'
+        try:
+            fo = open(delta_path, 'wb')
+            try:
+                # the MD5 is checked here, as write_data_from_url exits
+                # when it does not match
+                write_data_from_url(fo, repo + delta.delta_fn(old_md5, md5),
+                                    None, size, progress_callback)
+                timing.count('fetch.bytes', fo.tell())
+            finally:
+                fo.close()
+            if md5_file(delta_path) != delta_md5:
+                raise delta.DeltaError("%s: MD5 mismatch" % delta_path)
+            delta.apply_delta(md5s[old_md5], delta_path, dst + '.part', md5)
+        except (IOError, SystemExit, delta.DeltaError) as e:
+            # (write_data_from_url also exits on some HTTP errors)
+            if self.verbose:
+                print "Warning: could not use delta: %s" % e
+            rm_rf(dst + '.part')
+            return False
+        finally:
+            rm_rf(delta_path)
+        rm_rf(dst)
+        os.rename(dst + '.part', dst)
+        return True
 
 
     def index_file(self, filename, repo):
@@ -382,6 +720,8 @@ class Chain(object):
         if self.verbose:
             print "Adding %r to index" % dist
 
+        import zipfile
+
         arcname = 'EGG-INFO/spec/depend'
         z = zipfile.ZipFile(join(dist_naming.dirname_repo(repo), filename))
         if arcname not in z.namelist():
@@ -392,8 +732,7 @@ class Chain(object):
         spec = metadata.parse_data(z.read(arcname))
         z.close()
         add_Reqs_to_spec(spec)
-        self.index[dist] = spec
-        self.groups[spec['cname']].append(dist)
+        self.add_dist(dist, spec)
 
 
     def index_all_files(self, repo):
@@ -403,10 +742,16 @@ class Chain(object):
         """
         dir_path = dist_naming.dirname_repo(repo)
         assert isdir(dir_path), dir_path
-        for fn in os.listdir(dir_path):
+        h = hashlib.md5()
+        for fn in sorted(os.listdir(dir_path)):
             if not fn.endswith('.egg'):
                 continue
             if not dist_naming.is_valid_eggname(fn):
                 print "WARNING: ignoring invalid egg name:", join(dir_path, fn)
                 continue
             self.index_file(fn, repo)
+            st = os.stat(join(dir_path, fn))
+            h.update('%s %d %r\n' % (fn, st.st_size, st.st_mtime))
+        # the fingerprint of a repository without index file is derived
+        # from the names, sizes and modification times of its eggs
+        self.fingerprints[repo] = h.hexdigest()
@@ -0,0 +1,304 @@
+"""
+Delta eggs, which allow reconstructing an egg from a previous build (of the
+same package) which is already in LOCAL-REPO, such that only the parts of
+the egg which changed need to be downloaded.
+
+Eggs are zip files in which each member is compressed on its own, so the
+compressed data of a member which did not change between two builds can
+simply be copied from the old egg.  A delta is therefore a sequence of
+copy and insert operations, which produce the new egg byte by byte:
+
+    copy <offset> <length>      copy a range of the old egg
+    insert <length>             followed by <length> bytes of data
+
+Everything which is not the data of an unchanged member (the zip headers,
+the changed members and the central directory) is inserted.  The delta
+starts with a header line, which contains the MD5 of the old and new egg
+(and the size of the new egg), and is bz2 compressed.
+
+A repository advertises its deltas in index-delta.bz2 (next to
+index-depend.bz2), which has one line per delta:
+
+    <old md5> <new md5> <size> <md5>
+
+where size and md5 refer to the delta file itself, which is located in
+the deltas/ subdirectory of the repository (see delta_fn).  The deltas of
+a repository are generated using:
+
+    python -m enstaller.indexed_repo.delta [options] DIRECTORY
+"""
+import os
+import sys
+import bz2
+import struct
+import hashlib
+import zipfile
+from os.path import getsize, isfile, join
+
+from dist_naming import is_valid_eggname, split_eggname
+from metadata import write_txt_bz2
+
+from enstaller.utils import canonical, comparable_version, md5_file
+
+
+MAGIC = 'enstaller-delta-1'
+INDEX_FN = 'index-delta.bz2'
+# members which are smaller are always inserted, as a copy operation would
+# not be any shorter
+MIN_COPY = 64
+
+
+class DeltaError(Exception):
+    pass
+
+
+def delta_fn(old_md5, new_md5):
+    """
+    return the path of the delta file, relative to the repository
+    """
+    return 'deltas/%s-%s.delta' % (old_md5, new_md5)
+
+
+def data_ranges(path):
+    """
+    return the list of tuples(offset, length) of the (compressed) data of
+    all members of the zip file, sorted by offset
+    """
+    res = []
+    z = zipfile.ZipFile(path)
+    fi = open(path, 'rb')
+    for info in z.infolist():
+        fi.seek(info.header_offset)
+        header = fi.read(30)
+        if header[:4] != 'PK\x03\x04':
+            raise DeltaError("%s: bad local header: %r" %
+                             (path, info.filename))
+        n, m = struct.unpack('<HH', header[26:30])
+        res.append((info.header_offset + 30 + n + m, info.compress_size))
+    fi.close()
+    z.close()
+    res.sort()
+    return res
+
+
+def iter_chunks(fi, offset, length, size=65536):
+    if offset is not None:
+        fi.seek(offset)
+    while length:
+        chunk = fi.read(min(size, length))
+        if not chunk:
+            raise DeltaError("unexpected end of file")
+        length -= len(chunk)
+        yield chunk
+
+
+def range_md5(fi, offset, length):
+    h = hashlib.new('md5')
+    for chunk in iter_chunks(fi, offset, length):
+        h.update(chunk)
+    return h.digest()
+
+
+def write_delta(old_path, new_path, delta_path):
+    """
+    write the delta which turns the old egg into the new egg, and return
+    the number of bytes copied from the old egg
+    """
+    fi_old = open(old_path, 'rb')
+    # maps (MD5, length) of the member data in the old egg to the offset
+    old = {}
+    for offset, length in data_ranges(old_path):
+        if length >= MIN_COPY:
+            old[range_md5(fi_old, offset, length), length] = offset
+
+    ops = []
+    pos = 0
+    fi_new = open(new_path, 'rb')
+    for offset, length in data_ranges(new_path):
+        if length < MIN_COPY:
+            continue
+        old_offset = old.get((range_md5(fi_new, offset, length), length))
+        if old_offset is None:
+            continue
+        if offset > pos:
+            ops.append(('insert', pos, offset - pos))
+        ops.append(('copy', old_offset, length))
+        pos = offset + length
+    new_size = getsize(new_path)
+    if new_size > pos:
+        ops.append(('insert', pos, new_size - pos))
+
+    comp = bz2.BZ2Compressor()
+    fo = open(delta_path, 'wb')
+    fo.write(comp.compress('%s\n%s %s %d\n' % (
+                MAGIC, md5_file(old_path), md5_file(new_path), new_size)))
+    copied = 0
+    for op, offset, length in ops:
+        fo.write(comp.compress('%s %d %d\n' % (op, offset, length)
+                               if op == 'copy' else
+                               '%s %d\n' % (op, length)))
+        if op == 'copy':
+            copied += length
+        else:
+            for chunk in iter_chunks(fi_new, offset, length):
+                fo.write(comp.compress(chunk))
+    fo.write(comp.compress('end\n'))
+    fo.write(comp.flush())
+    fo.close()
+    fi_new.close()
+    fi_old.close()
+    return copied
+
+
+def apply_delta(old_path, delta_path, new_path, md5=None):
+    """
+    reconstruct the new egg from the old egg and the delta, the MD5 of the
+    result is verified (a DeltaError is raised when it does not match, or
+    when the delta is not the one for an egg with the MD5 md5)
+    """
+    fi = bz2.BZ2File(delta_path)
+    fi_old = fo = None
+    h = hashlib.new('md5')
+    size = 0
+    try:
+        if fi.readline() != MAGIC + '\n':
+            raise DeltaError("%s: not a delta file" % delta_path)
+        old_md5, new_md5, new_size = fi.readline().split()
+        if md5 and md5 != new_md5:
+            raise DeltaError("%s: delta is for a different egg" %
+                             delta_path)
+        fi_old = open(old_path, 'rb')
+        fo = open(new_path, 'wb')
+        while True:
+            fields = fi.readline().split()
+            if not fields:
+                raise DeltaError("%s: unexpected end of file" % delta_path)
+            if fields[0] == 'end':
+                break
+            elif fields[0] == 'copy':
+                chunks = iter_chunks(fi_old, int(fields[1]), int(fields[2]))
+            elif fields[0] == 'insert':
+                chunks = iter_chunks(fi, None, int(fields[1]))
+            else:
+                raise DeltaError("%s: invalid operation: %r" %
+                                 (delta_path, fields[0]))
+            for chunk in chunks:
+                h.update(chunk)
+                size += len(chunk)
+                fo.write(chunk)
+    except (IOError, ValueError, EOFError) as e:
+        raise DeltaError("%s: %s" % (delta_path, e))
+    finally:
+        for f in fi, fi_old, fo:
+            if f is not None:
+                f.close()
+    if h.hexdigest() != new_md5 or size != int(new_size):
+        raise DeltaError("%s: MD5 of reconstructed egg does not match" %
+                         delta_path)
+
+
+def parse_index(data):
+    """
+    given the (uncompressed) data of index-delta.bz2, return a dict mapping
+    the MD5 of new eggs to lists of tuples(old md5, size, md5)
+    """
+    res = {}
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            old_md5, new_md5, size, md5 = line.split()
+            size = int(size)
+        except ValueError:
+            raise DeltaError("invalid line in delta index: %r" % line)
+        res.setdefault(new_md5, []).append((old_md5, size, md5))
+    return res
+
+
+def update_deltas(dir_path, keep=1, ratio=0.5, verbose=False):
+    """
+    Creates (in the deltas/ subdirectory of dir_path) the deltas from the
+    `keep` previous builds of each egg in the directory, and updates
+    index-delta.txt and index-delta.bz2.  Deltas which are not smaller
+    than `ratio` times the new egg are not used.
+    """
+    groups = {}
+    for fn in os.listdir(dir_path):
+        if not (fn.endswith('.egg') and is_valid_eggname(fn)):
+            continue
+        name, version, build = split_eggname(fn)
+        groups.setdefault(canonical(name), []).append(
+            ((comparable_version(version), build), fn))
+
+    delta_dir = join(dir_path, 'deltas')
+    if not os.path.isdir(delta_dir):
+        os.mkdir(delta_dir)
+
+    md5s = {}
+    def get_md5(fn):
+        if fn not in md5s:
+            md5s[fn] = md5_file(join(dir_path, fn))
+        return md5s[fn]
+
+    lines = []
+    for cname in sorted(groups):
+        fns = [fn for unused, fn in sorted(groups[cname])]
+        for i, new_fn in enumerate(fns):
+            for old_fn in fns[max(0, i - keep):i]:
+                path = join(dir_path, delta_fn(get_md5(old_fn),
+                                               get_md5(new_fn)))
+                if not isfile(path):
+                    if verbose:
+                        print "Creating delta: %s -> %s" % (old_fn, new_fn)
+                    write_delta(join(dir_path, old_fn),
+                                join(dir_path, new_fn), path)
+                if getsize(path) >= ratio * getsize(join(dir_path, new_fn)):
+                    continue
+                lines.append('%s %s %d %s\n' % (get_md5(old_fn),
+                                                get_md5(new_fn),
+                                                getsize(path),
+                                                md5_file(path)))
+
+    txt_path = join(dir_path, 'index-delta.txt')
+    if verbose:
+        print "Updating:", txt_path
+    write_txt_bz2(txt_path, ''.join(lines))
+
+
+def main():
+    from optparse import OptionParser
+
+    p = OptionParser(usage="usage: %prog [options] DIRECTORY",
+                     description="create the delta eggs of a repository "
+                                 "and update index-delta.bz2")
+
+    p.add_option('-k', "--keep",
+                 action="store",
+                 type="int",
+                 default=1,
+                 help="number of previous builds of each egg to create "
+                      "deltas from, defaults to %default",
+                 metavar='N')
+
+    p.add_option("--ratio",
+                 action="store",
+                 type="float",
+                 default=0.5,
+                 help="only use deltas which are smaller than RATIO times "
+                      "the size of the egg, defaults to %default")
+
+    p.add_option('-v', "--verbose", action="store_true")
+
+    opts, args = p.parse_args()
+    if len(args) != 1:
+        p.error("exactly one argument (the repository directory) expected")
+
+    try:
+        update_deltas(args[0], opts.keep, opts.ratio, opts.verbose)
+    except DeltaError as e:
+        sys.exit("Error: %s" % e)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,6 @@ import sys
 import re
 import bz2
 import string
-import zipfile
 from cStringIO import StringIO
 from collections import defaultdict
 from os.path import basename, isfile, join, getmtime, getsize
@@ -14,6 +13,75 @@ from requirement import Req
 from enstaller.utils import md5_file
 
 
+class Spec(object):
+    """
+    A compact record holding the spec of a distribution, as used in the
+    index of a Chain.  Repeated strings (such as the arch, platform and
+    python values) are interned, such that large indices share them.
+
+    For backwards compatibility, the record may be used like the spec
+    dictionary returned by parse_data(), i.e. spec['cname'], spec.get('md5')
+    and spec['Reqs'] = ... all work.
+    """
+    __slots__ = ('metadata_version', 'name', 'version', 'build',
+                 'arch', 'platform', 'osdist', 'python', 'packages',
+                 'md5', 'size', 'mtime', 'commit', 'cname', 'Reqs')
+
+    _fields = frozenset(__slots__)
+
+    def __init__(self, **kwds):
+        setitem = self.__setitem__
+        fields = self._fields
+        for k, v in kwds.iteritems():
+            if type(v) is str and k in fields:
+                setattr(self, k, intern(v))
+            else:
+                # unknown keys raise KeyError
+                setitem(k, v)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        if type(value) is str:
+            value = intern(value)
+        elif key == 'packages':
+            value = tuple(intern(s) if type(s) is str else s for s in value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [k for k in self.__slots__ if hasattr(self, k)]
+
+    def iteritems(self):
+        for k in self.keys():
+            yield k, getattr(self, k)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return 'Spec(%s)' % ', '.join('%s=%r' % kv for kv in self.iteritems())
+
+
 def parse_index(data):
     """
     Given the data of an index file, such as index-depend.txt, return a
@@ -35,6 +103,23 @@ def parse_index(data):
     return res
 
 
+def iter_index(data):
+    """
+    Like parse_index(), but yields tuples(distribution name, section)
+    one at a time (in the order of the index data).  Unlike parse_index(),
+    a distribution name must not be listed more than once.
+    """
+    sep_pat = re.compile(r'^==>\s*(\S+)\s*<==[ \t\r]*$', re.M)
+    matches = list(sep_pat.finditer(data))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(data)
+        lines = data[m.end():end].splitlines()
+        if lines and lines[0] == '':
+            # the remainder of the separator line
+            del lines[0]
+        yield m.group(1), '\n'.join(line.rstrip() for line in lines)
+
+
 def data_from_spec(spec):
     """
     Given a spec dictionary, returns a the spec file as a well formed string.
@@ -127,10 +212,21 @@ def parse_depend_index(data):
     return d
 
 
+def iter_depend_index(data):
+    """
+    Like parse_depend_index(), but yields tuples(distname, spec dict) one
+    at a time, such that not all specs have to be held in memory at once.
+    """
+    for fn, section in iter_index(data):
+        yield fn, parse_data(section, index=True)
+
+
 def rawspec_from_dist(zip_path):
     """
     Returns the raw spec data, i.e. content of spec/depend as a string.
     """
+    import zipfile
+
     arcname = 'EGG-INFO/spec/depend'
     z = zipfile.ZipFile(zip_path)
     if arcname not in z.namelist():
@@ -149,6 +245,8 @@ def spec_from_dist(zip_path):
 
 
 def commit_from_dist(zip_path):
+    import zipfile
+
     arcname = 'EGG-INFO/spec/__commit__'
     z = zipfile.ZipFile(zip_path)
     if arcname in z.namelist():
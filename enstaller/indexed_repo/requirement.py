@@ -1,6 +1,36 @@
+import re
+
 from dist_naming import split_eggname, filename_dist
 
-from enstaller.utils import PY_VER, canonical
+from enstaller.utils import PY_VER, canonical, comparable_version
+
+
+NAME_PAT = re.compile(r'\s*([^\s<>=!~,]+)\s*(.+)$')
+CONSTRAINT_PAT = re.compile(r'(~=|==|!=|<=|>=|<|>)\s*([\w.]+)$')
+
+def version_cmp(v1, v2):
+    """
+    compare two version strings, using comparable_version() when possible,
+    and falling back to a string comparison otherwise
+    """
+    c1, c2 = comparable_version(v1), comparable_version(v2)
+    if type(c1) is not type(c2):
+        c1, c2 = v1, v2
+    return cmp(c1, c2)
+
+
+def constraint_matches(op, version, v):
+    """
+    return True if the version v satisfies the constraint (op, version)
+    """
+    if op == '~=':
+        # compatible release, e.g. '~=1.4.2' means '>=1.4.2,==1.4.*'
+        prefix = version.rsplit('.', 1)[0]
+        return (version_cmp(v, version) >= 0 and
+                (v == prefix or v.startswith(prefix + '.')))
+    c = version_cmp(v, version)
+    return {'==': c == 0, '!=': c != 0, '<=': c <= 0, '>=': c >= 0,
+            '<': c < 0, '>': c > 0}[op]
 
 
 class Req(object):
@@ -13,24 +43,76 @@ class Req(object):
         1   only the name must match
         2   name and version must match
         3   name, version and build must match
+    constraints: a tuple of (operator, version) tuples, e.g. for the
+        requirement string 'foo >=1.2, <2.0' this is
+        (('>=', '1.2'), ('<', '2.0')), and the strictness is 2.
+        The operators are ==, !=, <, <=, >, >= and ~= (compatible release).
+
+    Requirement objects are immutable, and interned, i.e. creating a
+    requirement from a string which was used before returns the same object.
     """
-    def __init__(self, req_string):
-        for c in '<>=,':
-            assert c not in req_string, req_string
-        lst = req_string.split()
-        assert len(lst) <= 2, req_string
+    __slots__ = ('name', 'version', 'build', 'strictness', 'constraints',
+                 '_hash')
+
+    # maps requirement strings to requirement objects
+    _cache = {}
+
+    def __new__(cls, req_string):
+        try:
+            return cls._cache[req_string]
+        except KeyError:
+            pass
+        self = object.__new__(cls)
+        self._parse(req_string)
+        self._hash = (hash(self.strictness) ^ hash(self.name) ^
+                      hash(self.version) ^ hash(self.build) ^
+                      hash(self.constraints))
+        cls._cache[req_string] = self
+        return self
+
+    def _parse(self, req_string):
+        # names coming from JSON indexes are unicode, which cannot be interned
+        req_string = str(req_string)
         self.strictness = 0
         self.name = self.version = self.build = None
+        self.constraints = ()
+        for c in '<>=!~,':
+            if c in req_string:
+                self._parse_constraints(req_string)
+                return
+        lst = req_string.split()
+        assert len(lst) <= 2, req_string
         if lst:
-            self.name = canonical(lst[0])
+            self.name = intern(canonical(lst[0]))
             self.strictness = 1
         if len(lst) == 2:
             tmp = lst[1]
-            self.version = tmp.split('-')[0]
+            self.version = intern(tmp.split('-')[0])
             self.strictness = 2 + bool('-' in tmp)
             if self.strictness ==  3:
                 self.build = int(tmp.split('-')[1])
 
+    def _parse_constraints(self, req_string):
+        m = NAME_PAT.match(req_string)
+        assert m, req_string
+        name, rest = m.groups()
+        self.name = intern(canonical(name))
+        self.strictness = 2
+        constraints = []
+        for part in rest.split(','):
+            m = CONSTRAINT_PAT.match(part.strip())
+            assert m, req_string
+            op, version = m.groups()
+            assert op != '~=' or '.' in version, req_string
+            constraints.append((op, intern(version)))
+        self.constraints = tuple(constraints)
+
+    def _matches_version(self, version):
+        for op, v in self.constraints:
+            if not constraint_matches(op, v, version):
+                return False
+        return True
+
     def matches(self, spec):
         """
         Returns True if the spec of a distribution matches the requirement
@@ -46,6 +128,8 @@ class Req(object):
             return False
         if self.strictness == 1:
             return True
+        if self.constraints:
+            return self._matches_version(spec['version'])
         if spec['version'] != self.version:
             return False
         if self.strictness == 2:
@@ -53,13 +137,38 @@ class Req(object):
         assert self.strictness == 3
         return spec['build'] == self.build
 
+    def matches_spec(self, spec):
+        """
+        Like matches(), but for Spec records (as held by the index of a
+        Chain), whose metadata version was already checked when they
+        were loaded.
+        """
+        python = spec.python
+        if python is not None and python != PY_VER:
+            return False
+        strictness = self.strictness
+        if strictness == 0:
+            return True
+        if spec.cname != self.name:
+            return False
+        if strictness == 1:
+            return True
+        if self.constraints:
+            return self._matches_version(spec.version)
+        if spec.version != self.version:
+            return False
+        return strictness == 2 or spec.build == self.build
+
     def __str__(self):
         if self.strictness == 0:
             return ''
+        if self.constraints:
+            return '%s %s' % (self.name,
+                              ','.join(op + v for op, v in self.constraints))
         res = self.name
         if self.version:
             res += ' %s' % self.version
-        if self.build:
+        if self.build is not None:
             res += '-%i' % self.build
         return res
 
@@ -69,23 +178,38 @@ class Req(object):
         """
         return 'Req(%r)' % str(self)
 
+    def __reduce__(self):
+        return Req, (str(self),)
+
     def __eq__(self, other):
-        return (self.name == other.name  and
+        return self is other or (
+                self.name == other.name  and
                 self.version == other.version  and
                 self.build == other.build  and
-                self.strictness == other.strictness)
+                self.strictness == other.strictness  and
+                self.constraints == other.constraints)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        return (hash(self.strictness) ^ hash(self.name) ^
-                hash(self.version) ^ hash(self.build))
+        return self._hash
+
 
+# maps tuples of requirement strings to (frozen) sets of requirement objects
+_Reqs_cache = {}
 
 def add_Reqs_to_spec(spec):
     """
     add the 'Reqs' key (which maps to the set of requirement objects),
     as well as the 'cname' key, to a spec dictionary
     """
-    spec['Reqs'] = set(Req(s) for s in spec['packages'])
+    packages = tuple(spec['packages'])
+    try:
+        Reqs = _Reqs_cache[packages]
+    except KeyError:
+        Reqs = _Reqs_cache[packages] = frozenset(Req(s) for s in packages)
+    spec['Reqs'] = Reqs
     spec['cname'] = canonical(spec['name'])
 
 
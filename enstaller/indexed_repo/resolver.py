@@ -0,0 +1,215 @@
+"""
+A backtracking resolver, which finds a consistent set of distributions
+for a list of requirements, i.e. a set containing one distribution per
+project, such that the requirements of each distribution in the set are
+satisfied by the set.
+
+The candidates of each project are tried in the order in which
+Chain.get_dist() prefers them (repository order first, and then largest
+version and build first).  The search uses forward checking (a candidate
+is rejected right away when one of its requirements cannot be met anymore)
+and conflict-directed backjumping (when all candidates of a project fail,
+the search jumps back to the most recent project whose choice was involved
+in the conflicts, rather than to the most recent choice).
+"""
+import dist_naming
+
+
+class ResolutionError(Exception):
+    pass
+
+
+class Resolver(object):
+
+    def __init__(self, chain, max_steps=100000):
+        self.chain = chain
+        # upper bound for the number of candidates tried, such that the
+        # resolution finishes (or fails) in bounded time
+        self.max_steps = max_steps
+        # maps cnames to the sorted list of candidate keys
+        self._candidates = {}
+
+    def candidates(self, cname):
+        """
+        return the list of keys of the distributions of the project cname,
+        in the order of preference
+        """
+        try:
+            return self._candidates[cname]
+        except KeyError:
+            pass
+        keys = self.chain.groups[cname]
+        specs = self.chain._specs
+        # rank the repositories in the order in which they first appear
+        rank = {}
+        for key in keys:
+            rank.setdefault(key[0], len(rank))
+        res = sorted(keys, reverse=True,
+                     key=lambda k: dist_naming.comparable_spec(specs[k]))
+        res.sort(key=lambda k: rank[k[0]])
+        self._candidates[cname] = res
+        return res
+
+    def solve(self, reqs):
+        """
+        return the list of distributions which satisfy the requirements
+        (in no particular order), or raise ResolutionError
+        """
+        self.steps = 0
+        self.assigned = {}              # maps cnames to keys
+        self.reqs = {}                  # maps cnames to [(req, origin)]
+        self.pending = []               # required cnames (in order)
+        # maps cnames to the stack of domains, the last element of each
+        # stack is the list of candidates which satisfy all requirements
+        self.domains = {}
+        for req in reqs:
+            assert req.strictness >= 1
+            self._add_req(req, None)
+
+        conflict = self._search()
+        if conflict is not None:
+            raise ResolutionError("could not resolve %s: conflicting "
+                                  "requirements involving: %s" %
+                                  (', '.join(repr(r) for r in reqs),
+                                   ', '.join(sorted(conflict)) or '-'))
+        return [self.chain._dist(key) for key in self.assigned.itervalues()]
+
+    def _filter(self, keys, req):
+        specs = self.chain._specs
+        return [key for key in keys if req.matches_spec(specs[key])]
+
+    def _add_req(self, req, origin):
+        name = req.name
+        if name not in self.reqs:
+            self.reqs[name] = []
+            self.domains[name] = [self.candidates(name)]
+            self.pending.append(name)
+        self.reqs[name].append((req, origin))
+        stack = self.domains[name]
+        stack.append(self._filter(stack[-1], req))
+
+    def _remove_req(self, req, origin):
+        name = req.name
+        lst = self.reqs[name]
+        assert lst[-1] == (req, origin)
+        del lst[-1]
+        self.domains[name].pop()
+        if not lst:
+            del self.reqs[name]
+            del self.domains[name]
+            self.pending.remove(name)
+
+    def _origins(self, cname):
+        return set(o for r, o in self.reqs.get(cname, ()) if o is not None)
+
+    def _domain(self, cname):
+        """
+        return the keys of the candidates of the project which satisfy
+        all current requirements for the project
+        """
+        return self.domains[cname][-1]
+
+    def _select(self):
+        """
+        select the next project to be assigned, which is the one with the
+        fewest remaining candidates, or return None when all required
+        projects are assigned
+        """
+        best = None
+        for cname in self.pending:
+            if cname in self.assigned:
+                continue
+            n = len(self.domains[cname][-1])
+            if best is None or n < best[0]:
+                best = n, cname
+                if n <= 1:
+                    break
+        return best and best[1]
+
+    def _check(self, cname, spec):
+        """
+        check if the requirements of a candidate can be met, return None
+        if so, and the set of projects in conflict otherwise
+        """
+        specs = self.chain._specs
+        for r in spec.Reqs:
+            if r.name == cname:
+                continue
+            if r.name in self.assigned:
+                if not r.matches_spec(specs[self.assigned[r.name]]):
+                    return set([r.name])
+            elif r.name in self.domains:
+                if not any(r.matches_spec(specs[key])
+                           for key in self.domains[r.name][-1]):
+                    return self._origins(r.name)
+            elif not any(r.matches_spec(specs[key])
+                         for key in self.candidates(r.name)):
+                return set()
+        return None
+
+    def _assign(self, cname, key, spec):
+        self.assigned[cname] = key
+        for r in spec.Reqs:
+            self._add_req(r, cname)
+
+    def _unassign(self, cname, spec):
+        del self.assigned[cname]
+        for r in reversed(list(spec.Reqs)):
+            self._remove_req(r, cname)
+
+    def _search(self):
+        """
+        return None when a solution was found, and the set of projects
+        whose assignments are involved in the failure otherwise (the search
+        uses an explicit stack, as its depth is the number of projects)
+        """
+        cname = self._select()
+        if cname is None:
+            return None
+
+        specs = self.chain._specs
+        # each frame is [cname, candidate keys, index of the next candidate,
+        # conflict, spec of the candidate assigned below this frame or None]
+        stack = [[cname, self._domain(cname), 0, set(), None]]
+        sub = None
+        while stack:
+            frame = stack[-1]
+            cname, keys, i, conflict, spec = frame
+            if spec is not None:
+                # the search below the assigned candidate failed with sub
+                self._unassign(cname, spec)
+                frame[4] = None
+                if cname not in sub:
+                    # the choice for this project is not involved in the
+                    # conflict, so trying its other candidates is pointless
+                    stack.pop()
+                    continue
+                conflict |= sub
+
+            while i < len(keys):
+                key = keys[i]
+                i += 1
+                self.steps += 1
+                if self.steps > self.max_steps:
+                    raise ResolutionError("resolution exceeded %d steps" %
+                                          self.max_steps)
+                spec = specs[key]
+                culprits = self._check(cname, spec)
+                if culprits is not None:
+                    conflict |= culprits
+                    continue
+                self._assign(cname, key, spec)
+                frame[2] = i
+                frame[4] = spec
+                next_cname = self._select()
+                if next_cname is None:
+                    return None
+                stack.append([next_cname, self._domain(next_cname), 0,
+                              set(), None])
+                break
+            else:
+                conflict.discard(cname)
+                conflict |= self._origins(cname)
+                sub = conflict
+                stack.pop()
+        return sub
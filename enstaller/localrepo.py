@@ -0,0 +1,146 @@
+"""
+Garbage collection for the local repository (LOCAL-REPO), into which eggs
+are fetched before they are installed.  Eggs which are referenced by the
+current state of the prefix, or by one of the last few revisions in the
+history, are always kept (such that reverting does not require fetching).
+All other eggs are removed, least recently used first, either entirely or
+until the repository fits a size budget.
+
+The time an egg was last used is recorded in a small sidecar index file
+'.access' in the repository, as file access times are often not reliable.
+"""
+import os
+import time
+import threading
+from os.path import getsize, isdir, isfile, join
+
+import egginst
+
+from history import History
+
+
+class AccessIndex(object):
+    """
+    maps the egg names in a local repository to the time they were last
+    used (fetched or installed)
+    """
+    def __init__(self, egg_dir):
+        self.path = join(egg_dir, '.access')
+        self.times = {}
+        if isfile(self.path):
+            for line in open(self.path):
+                parts = line.split()
+                if len(parts) == 2:
+                    self.times[parts[0]] = float(parts[1])
+
+    def get(self, fn):
+        """
+        return the time the egg was last used, which defaults to the
+        modification time of the egg
+        """
+        try:
+            return self.times[fn]
+        except KeyError:
+            return os.stat(join(os.path.dirname(self.path), fn)).st_mtime
+
+    def touch(self, fns):
+        now = time.time()
+        for fn in fns:
+            self.times[fn] = now
+        self.write()
+
+    def discard(self, fns):
+        for fn in fns:
+            self.times.pop(fn, None)
+        self.write()
+
+    def write(self):
+        if not isdir(os.path.dirname(self.path)):
+            return
+        # the temporary file is unique to the process and thread, such
+        # that concurrent writers don't rename each other's files
+        tmp_path = '%s.%d.%d.part' % (self.path, os.getpid(),
+                                      threading.current_thread().ident)
+        fo = open(tmp_path, 'w')
+        for fn in sorted(self.times):
+            fo.write('%s %.0f\n' % (fn, self.times[fn]))
+        fo.close()
+        if os.name == 'nt' and isfile(self.path):
+            os.unlink(self.path)
+        os.rename(tmp_path, self.path)
+
+
+# serializes reading and updating the access index (eggs are installed by
+# several threads at once, see scheduler.py)
+_lock = threading.Lock()
+
+def touch(egg_dir, fns):
+    """
+    record that the eggs have just been used
+    """
+    if isdir(egg_dir):
+        with _lock:
+            AccessIndex(egg_dir).touch(fns)
+
+
+def referenced_eggs(prefix, keep_revisions):
+    """
+    return the set of eggs installed in the prefix, or referenced by one
+    of the last keep_revisions revisions in its history
+    """
+    res = set(egginst.get_installed(prefix))
+    history = History(prefix)
+    if isfile(history.path) and keep_revisions > 0:
+        for dt, eggs in history.construct_states()[-keep_revisions:]:
+            res.update(eggs)
+    return res
+
+
+def collect(egg_dir, prefix, keep_revisions=3, max_size=None,
+            dry_run=False):
+    """
+    remove the eggs from the local repository egg_dir which are not
+    referenced (see above), least recently used first, until the total
+    size of the eggs is at most max_size bytes (when max_size is None,
+    all eggs which are not referenced are removed).  Returns the tuple
+    (list of eggs removed, bytes reclaimed), where only files which are
+    not hardlinked elsewhere (e.g. to an egg store) count as reclaimed.
+    """
+    if not isdir(egg_dir):
+        return [], 0
+    keep = referenced_eggs(prefix, keep_revisions)
+    access = AccessIndex(egg_dir)
+    total = 0
+    candidates = []
+    for fn in os.listdir(egg_dir):
+        path = join(egg_dir, fn)
+        if fn.endswith('.part'):
+            # left behind by an interrupted download (unless the download
+            # is still in progress)
+            if time.time() - os.stat(path).st_mtime > 86400:
+                candidates.append((0, fn))
+            continue
+        if not fn.endswith('.egg') or not isfile(path):
+            continue
+        total += getsize(path)
+        if fn not in keep:
+            candidates.append((access.get(fn), fn))
+    candidates.sort()
+
+    removed = []
+    reclaimed = 0
+    for atime, fn in candidates:
+        if max_size is not None and total <= max_size:
+            break
+        path = join(egg_dir, fn)
+        st = os.stat(path)
+        if fn.endswith('.egg'):
+            total -= st.st_size
+        if st.st_nlink == 1:
+            reclaimed += st.st_size
+        removed.append(fn)
+        if not dry_run:
+            os.unlink(path)
+    if not dry_run:
+        access.discard(removed)
+    return removed, reclaimed
@@ -0,0 +1,243 @@
+"""
+Lockfiles describe an exact environment, i.e. the list of eggs installed
+into a prefix (in install order), such that the environment can be
+reproduced elsewhere without resolving any requirements.  Each line of a
+lockfile contains the URL, MD5 and size of an egg:
+
+    # enpkg lockfile
+    http://www.enthought.com/repo/epd/eggs/RedHat/5/nose-1.0.0-1.egg <md5> <size>
+    ...
+
+Lines starting with '#' are comments.
+"""
+import os
+import time
+import threading
+from Queue import Queue
+from os.path import getsize, isfile, join
+
+import egginst
+from egginst.utils import rm_rf
+
+from enstaller import __version__
+from plat import custom_plat
+from utils import cname_fn, md5_file, write_data_from_url
+from indexed_repo import dist_naming, filename_as_req
+
+
+class LockfileError(Exception):
+    pass
+
+
+def installed_order(enst):
+    """
+    return the list of eggs installed into the (first) prefix of the
+    Enstaller object, such that each egg comes after its dependencies
+    """
+    prefix = enst.prefixes[0]
+    eggs = dict((cname_fn(fn), fn) for fn in egginst.get_installed(prefix))
+    deps = enst.get_dependencies()
+    res = []
+    visited = set()
+
+    def visit(cname):
+        if cname in visited or cname not in eggs:
+            return
+        visited.add(cname)
+        if cname in deps:
+            for name in sorted(r.name for r in deps[cname]['Reqs']):
+                visit(name)
+        res.append(eggs[cname])
+
+    for cname in sorted(eggs):
+        visit(cname)
+    return res
+
+
+def installed_repo(prefix, cname):
+    """
+    return the repository from which a package was installed, or None
+    if this is unknown
+    """
+    path = join(prefix, 'EGG-INFO', cname, '__enpkg__.txt')
+    if not isfile(path):
+        return None
+    d = {}
+    execfile(path, d)
+    return d.get('repo')
+
+
+def export(enst, path):
+    """
+    write the lockfile for the packages installed into the (first) prefix
+    of the Enstaller object, the MD5 and size of each egg is taken from
+    the index of the chain (or the egg itself, for local repositories)
+    """
+    entries = []
+    missing = []
+    for fn in installed_order(enst):
+        repo = installed_repo(enst.prefixes[0], cname_fn(fn))
+        # packages installed by egginst (or enpkg --revert) don't know
+        # their repository
+        dist = repo and repo + fn
+        if dist is None or dist not in enst.chain.index:
+            dist = enst.chain.get_dist(filename_as_req(fn))
+        if dist is None:
+            missing.append(fn)
+            continue
+        spec = enst.chain.index[dist]
+        md5, size = spec.get('md5'), spec.get('size')
+        if md5 is None and dist.startswith('file://'):
+            # eggs in local repositories without index file
+            md5, size = md5_file(dist[7:]), getsize(dist[7:])
+        entries.append((dist, md5, size))
+    if missing:
+        raise LockfileError("not available in any repository: %s" %
+                            ', '.join(missing))
+    write(path, entries)
+    return entries
+
+
+def write(path, entries):
+    """
+    write the list of tuples(url, md5, size) to a lockfile
+    """
+    fo = open(path, 'w')
+    fo.write('# enpkg lockfile, created by enstaller %s on %s\n' %
+             (__version__, time.strftime('%Y-%m-%d %H:%M:%S')))
+    fo.write('# platform: %s\n' % custom_plat)
+    for url, md5, size in entries:
+        fo.write('%s %s %d\n' % (url, md5, size))
+    fo.close()
+
+
+def read(path):
+    """
+    read a lockfile and return the list of tuples(url, md5, size)
+    """
+    res = []
+    for n, line in enumerate(open(path)):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split()
+        if len(parts) != 3 or len(parts[1]) != 32 or not parts[2].isdigit():
+            raise LockfileError("%s:%d: invalid line: %r" % (path, n + 1,
+                                                             line))
+        if not dist_naming.is_valid_eggname(dist_naming.filename_dist(
+                parts[0])):
+            raise LockfileError("%s:%d: invalid egg name: %r" %
+                                (path, n + 1, parts[0]))
+        res.append((parts[0], parts[1], int(parts[2])))
+    return res
+
+
+def fetch_one(url, md5, size, fetch_dir, egg_store=None):
+    """
+    download (or copy) an egg into fetch_dir, unless an egg with the
+    expected MD5 is already present (or in the egg store), and raise
+    LockfileError when the data received does not match the MD5
+    """
+    dst = join(fetch_dir, dist_naming.filename_dist(url))
+    if isfile(dst) and getsize(dst) == size and md5_file(dst) == md5:
+        return False
+    if egg_store and egg_store.get(md5, dst):
+        return False
+    fo = open(dst + '.part', 'wb')
+    try:
+        write_data_from_url(fo, url)
+    except SystemExit:
+        # write_data_from_url exits on some errors (it is used by the CLI),
+        # which is not what we want in a worker thread
+        raise LockfileError("could not fetch: %s" % url)
+    finally:
+        fo.close()
+    if md5_file(dst + '.part') != md5:
+        rm_rf(dst + '.part')
+        raise LockfileError("MD5 mismatch: %s" % url)
+    rm_rf(dst)
+    os.rename(dst + '.part', dst)
+    if egg_store:
+        egg_store.add(dst, md5)
+    return True
+
+
+def fetch(entries, fetch_dir, n_threads=4, action_callback=None,
+          egg_store=None):
+    """
+    fetch the eggs (tuples(url, md5, size)) concurrently, using up to
+    n_threads threads, into fetch_dir, the callback is called (from
+    the worker threads, but never concurrently) with the egg name and
+    action, after an egg was fetched
+    """
+    if not os.path.isdir(fetch_dir):
+        os.makedirs(fetch_dir)
+    lock = threading.Lock()
+    errors = []
+    queue = Queue()
+    for entry in entries:
+        queue.put(entry)
+
+    def worker():
+        while True:
+            url, md5, size = queue.get()
+            try:
+                if not errors:
+                    fetched = fetch_one(url, md5, size, fetch_dir,
+                                        egg_store)
+                    if action_callback and fetched:
+                        with lock:
+                            action_callback(dist_naming.filename_dist(url),
+                                            ('copied', 'downloaded')[
+                                    url.startswith(('http://', 'https://'))])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                queue.task_done()
+
+    for dummy in xrange(min(n_threads, len(entries))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+    queue.join()
+    if errors:
+        raise errors[0]
+
+
+def install(enst, path, n_threads=4):
+    """
+    make the (first) prefix of the Enstaller object match the lockfile,
+    i.e. remove all packages which are not listed, and install the listed
+    eggs (in the order of the lockfile) which are not already installed,
+    each package is replaced within its own transaction (like enpkg does)
+    """
+    entries = read(path)
+    locked = set(dist_naming.filename_dist(url) for url, md5, size in entries)
+    if len(locked) != len(entries):
+        raise LockfileError("%s: duplicate eggs" % path)
+    enst.recover()
+
+    if enst.dry_run:
+        for url, md5, size in entries:
+            if not isfile(join(enst.egg_dir, dist_naming.filename_dist(url))):
+                enst.events.action(dist_naming.filename_dist(url),
+                                   'fetching')
+    else:
+        fetch(entries, enst.egg_dir, n_threads, enst.events.action,
+              enst.chain.egg_store)
+
+    curr = set(egginst.get_installed(enst.prefixes[0]))
+    # packages are removed before the packages they depend on, unless
+    # another version of the package is listed, which replaces it below
+    locked_cnames = set(cname_fn(fn) for fn in locked)
+    for fn in reversed(installed_order(enst)):
+        if fn not in locked and cname_fn(fn) not in locked_cnames:
+            with enst.transaction(fn) as tx:
+                enst.remove_egg(fn, tx)
+    for url, md5, size in entries:
+        fn = dist_naming.filename_dist(url)
+        if fn not in curr:
+            with enst.transaction(fn) as tx:
+                enst.remove_installed(fn, tx)
+                enst.install_egg(url, tx)
+    enst.events.flush()
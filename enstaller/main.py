@@ -7,24 +7,24 @@ enpkg can access distributions from local and HTTP repositories.
 import os
 import re
 import sys
+import atexit
 import string
-import subprocess
-import textwrap
 from argparse import ArgumentParser
 from os.path import isdir, isfile, join
 
 import egginst
 from egginst.utils import bin_dir_name, rel_site_packages, pprint_fn_action, \
-                   console_file_progress
+                   console_file_progress, human_bytes
 
 from enstaller import __version__
 import config
-from history import History
-from proxy.api import setup_proxy
 from utils import (canonical, cname_fn, get_info, comparable_version,
                    shorten_repo, get_installed_info, get_available)
-from indexed_repo import (Chain, Req, add_Reqs_to_spec, filename_as_req,
-                          spec_as_req, parse_data, dist_naming)
+
+# Modules which are only needed by some of the commands (the indexed
+# repositories, the history, the local repository, subprocess, the proxy
+# support, the event stream, ...) are imported by the functions using them,
+# such that commands like --version, --list and --path start quickly.
 
 
 class DistributionNotFound(Exception):
@@ -39,6 +39,19 @@ def noop_callback(*args):
     pass
 
 
+def get_egg_store():
+    """
+    return the EggStore object for the configured store (or None)
+    """
+    path = config.get('egg_store')
+    if not path:
+        return None
+    from egg_store import EggStore
+
+    max_size = config.get('egg_store_max_size')
+    return EggStore(path, max_size and int(max_size * 1024 ** 2))
+
+
 class Enstaller(object):
     """ enpkg back-end
 
@@ -50,8 +63,19 @@ class Enstaller(object):
         self.chain = chain
         self.prefixes = prefixes or [sys.prefix]
         self.dry_run = dry_run
+        # number of eggs which are fetched (and installed) at the same time,
+        # see scheduler.py
+        self.jobs = 1
+        from indexed_repo.cache import ResolveCache
+        from events import EventStream
+
         self.egg_dir = config.get('local',
                                   join(self.prefixes[0], 'LOCAL-REPO'))
+        if self.chain.resolve_cache is None:
+            self.chain.resolve_cache = ResolveCache(
+                join(self.egg_dir, '.resolve-cache'))
+        if self.chain.egg_store is None and config.get('egg_store'):
+            self.chain.egg_store = get_egg_store()
 
         # Callback to be called before an install/remove is done
         #
@@ -74,31 +98,27 @@ class Enstaller(object):
         #
         # Signature should be callback(egg_name, action)
         #   egg_name: name of the egg being installed
-        #   action: 'copying', 'downloading', 'installing', 'removing'
+        #   action: 'copying', 'downloading', 'linking', 'installing',
+        #           'removing'
         self.file_action_callback = noop_callback
 
-    def path_commands(self):
-        commands = []
-        cmd = ('export', 'set')[sys.platform == 'win32']
-        # Set PATH
-        commands.append("%s PATH=%s" % (cmd, os.pathsep.join(
-            join(p, bin_dir_name) for p in self.prefixes)))
-
-        # Set PYTHONPATH, if needed
-        if self.prefixes != [sys.prefix]:
-            commands.append("%s PYTHONPATH=%s" % (cmd, os.pathsep.join(
-                join(prefix, rel_site_packages) for prefix in self.prefixes)))
-
-        # Set *_LIBRARY_PATH, as needed
-        if sys.platform != 'win32':
-            if sys.platform == 'darwin':
-                name = 'DYLD_LIBRARY_PATH'
-            else:
-                name = 'LD_LIBRARY_PATH'
-            commands.append("%s %s=%s" % (cmd, name, os.pathsep.join(
-                join(p, 'lib') for p in self.prefixes)))
+        # The callbacks above are called (from a separate thread) by the
+        # consumer of this event stream, see events.py
+        self.events = EventStream()
+        self.events.subscribe(self.dispatch_event)
 
-        return commands
+    def dispatch_event(self, event):
+        from events import ACTION
+
+        if event.type == ACTION:
+            self.file_action_callback(event.egg, event.phase)
+        elif event.phase == 'download':
+            self.download_progress_callback(event.so_far, event.total)
+        else:
+            self.install_progress_callback(event.so_far, event.total)
+
+    def path_commands(self):
+        return path_commands(self.prefixes)
 
     def can_write_prefix(self):
         prefix = self.prefixes[0]
@@ -141,6 +161,8 @@ class Enstaller(object):
         distributions that must be installed, regardless of their current
         installation status.
         """
+        from indexed_repo import dist_naming
+
         dists = self.chain.install_sequence(req, mode)
         if not dists:
             raise DistributionNotFound(
@@ -164,6 +186,8 @@ class Enstaller(object):
             return None
 
     def get_dependencies(self):
+        from indexed_repo import add_Reqs_to_spec, parse_data
+
         if not getattr(self, '_dependencies', None):
             egg_info_dir = join(self.prefixes[0], 'EGG-INFO')
             if not isdir(egg_info_dir):
@@ -179,10 +203,11 @@ class Enstaller(object):
         return self._dependencies
 
     def set_chain_callbacks(self):
-        self.chain.file_action_callback = self.file_action_callback
-        self.chain.download_progress_callback = self.download_progress_callback
+        self.chain.file_action_callback = self.events.action
 
     def egginst_subprocess(self, egg_path, action):
+        import subprocess
+
         path = join(sys.prefix, bin_dir_name, 'egginst-script.py')
         args = [sys.executable, path, '--prefix', self.prefixes[0]]
         if self.dry_run:
@@ -191,42 +216,95 @@ class Enstaller(object):
             args.append('--remove')
         if config.get('noapp'):
             args.append('--noapp')
+        if config.get('precompile') and action == 'install':
+            args.append('--precompile')
         args.append(egg_path)
         subprocess.call(args)
 
-    def install_egg(self, dist):
+    def transaction(self, eggname, lock=None):
+        """
+        return the transaction (see egginst/journal.py) for replacing the
+        installed version of the egg's package by the egg
+        """
+        from egginst import journal
+
+        return journal.Transaction(self.prefixes[0], cname_fn(eggname),
+                                   lock=lock)
+
+    def recover(self):
+        """
+        roll back the transactions which were interrupted in a previous run
+        """
+        from egginst import journal
+
+        if self.dry_run:
+            return
+        for name in journal.recover(self.prefixes[0]):
+            self.events.action(name, 'recovered')
+
+    def install_egg(self, dist, tx=None):
+        from indexed_repo import dist_naming
+        import localrepo
+
         repo, eggname = dist_naming.split_dist(dist)
         pkg_path = join(self.egg_dir, eggname)
         if (sys.platform == 'win32' and
             eggname.lower().startswith(('appinst-', 'pywin32-'))):
             self.egginst_subprocess(pkg_path, 'install')
             return
-        self.file_action_callback(eggname, 'installing')
+        self.events.action(eggname, 'installing')
         if self.dry_run:
             return
         ei = egginst.EggInst(pkg_path, self.prefixes[0],
-                             noapp=config.get('noapp'))
-        ei.progress_callback = self.install_progress_callback
+                             noapp=config.get('noapp'),
+                             store_dir=config.get('extract_store'), tx=tx,
+                             precompile=config.get('precompile'))
+        ei.progress_callback = self.events.progress_callback('install',
+                                                             eggname)
         ei.install()
+        localrepo.touch(self.egg_dir, [eggname])
         info = self.get_installed_info(cname_fn(eggname))[0][1]
         path = join(info['meta_dir'], '__enpkg__.txt')
         with open(path, 'w') as f:
             f.write('repo = %r\n' % repo)
 
-    def remove_egg(self, eggname):
+    def remove_egg(self, eggname, tx=None, new_egg=None):
+        """
+        remove the installed egg, when the (fetched) egg new_egg, which is
+        going to be installed within the same transaction, is given, the
+        files which are identical in both eggs are left in place
+        """
         if (sys.platform == 'win32' and
             eggname.lower().startswith(('appinst-', 'pywin32-'))):
             self.egginst_subprocess(eggname, 'remove')
             return
-        self.file_action_callback(eggname, 'removing')
+        self.events.action(eggname, 'removing')
         if self.dry_run:
             return
         ei = egginst.EggInst(eggname, self.prefixes[0],
-                             noapp=config.get('noapp'))
-        ei.progress_callback = self.install_progress_callback
+                             noapp=config.get('noapp'), tx=tx)
+        if tx is not None and new_egg:
+            new_ei = egginst.EggInst(join(self.egg_dir, new_egg),
+                                     self.prefixes[0])
+            tx.keep = new_ei.unchanged_files(ei)
+        ei.progress_callback = self.events.progress_callback('remove',
+                                                             eggname)
         ei.remove()
 
+    def remove_installed(self, eggname, tx=None):
+        """
+        remove the currently installed version of the egg's package, if any
+        (when tx is given, the egg is installed afterwards within the same
+        transaction, and only the files which changed are removed)
+        """
+        info = self.get_installed_info(cname_fn(eggname))[0][1]
+        if info and info.get('egg_name'):
+            self.remove_egg(info['egg_name'], tx, eggname)
+
     def install(self, req, mode='recur', force=False, force_all=False):
+        from indexed_repo import dist_naming
+
+        self.recover()
         # get distributions that need to be installed
         dists = self.get_install_sequence(req, mode, force, force_all)
 
@@ -234,35 +312,59 @@ class Enstaller(object):
             self.pre_install_callback(self, dists, 'install')
         self.set_chain_callbacks()
 
-        # Get eggname for each dist, since it's used so much
-        dists = [(dist, dist_naming.filename_dist(dist))
-                 for dist in dists]
-
-        # fetch distributions
-        if not isdir(self.egg_dir):
-            os.makedirs(self.egg_dir)
-        for dist, eggname in dists:
-            self.chain.fetch_dist(dist, self.egg_dir,
-                                  check_md5=force or force_all,
-                                  dry_run=self.dry_run)
-
-        # remove packages (in reverse install order)
-        for dist, eggname in reversed(dists):
-            # Get the currently installed version, to remove
-            info = self.get_installed_info(cname_fn(eggname))[0][1]
-            eggname = info and info.get('egg_name')
-            if not eggname:
-                continue
-            self.remove_egg(eggname)
+        try:
+            # Get eggname for each dist, since it's used so much
+            dists = [(dist, dist_naming.filename_dist(dist))
+                     for dist in dists]
+
+            if not isdir(self.egg_dir):
+                os.makedirs(self.egg_dir)
+            if self.jobs > 1:
+                from scheduler import install_pipelined
+
+                installed_count = install_pipelined(
+                    self, [dist for dist, eggname in dists],
+                    check_md5=force or force_all)
+                if self.chain.egg_store and not self.dry_run:
+                    self.chain.egg_store.evict()
+                return installed_count
+
+            # fetch distributions
+            for dist, eggname in dists:
+                callback = self.events.progress_callback('download', eggname)
+                self.chain.fetch_dist(dist, self.egg_dir,
+                                      check_md5=force or force_all,
+                                      dry_run=self.dry_run,
+                                      progress_callback=callback)
+            if self.chain.egg_store and not self.dry_run:
+                self.chain.egg_store.evict()
+
+            # replace the installed versions of the packages, such that a
+            # failed install only rolls back the package it failed on
+            installed_count = 0
+            for dist, eggname in dists:
+                with self.transaction(eggname) as tx:
+                    self.remove_installed(eggname, tx)
+                    self.install_egg(dist, tx)
+                installed_count += 1
+            return installed_count
+        finally:
+            self.events.flush()
 
-        # install packages
-        installed_count = 0
-        for dist, eggname in dists:
-            self.install_egg(dist)
-            installed_count += 1
-        return installed_count
+    def collect_garbage(self, max_size=None):
+        """
+        remove unreferenced eggs from the local repository, until its size
+        is at most max_size bytes (or remove all of them, when max_size is
+        None), return the tuple(list of eggs removed, bytes reclaimed)
+        """
+        import localrepo
+
+        return localrepo.collect(self.egg_dir, self.prefixes[0],
+                                 int(config.get('local_keep_revisions')),
+                                 max_size, self.dry_run)
 
     def remove(self, req):
+        self.recover()
         d = self.get_installed_info(req.name)[0][1]
         if not d:
             raise DistributionNotFound(
@@ -278,15 +380,40 @@ class Enstaller(object):
             dist = self.chain.get_dist(req)
             self.pre_install_callback(self, [dist], 'remove')
         self.remove_egg(d['egg_name'])
+        self.events.flush()
+
+
+def path_commands(prefixes):
+    commands = []
+    cmd = ('export', 'set')[sys.platform == 'win32']
+    # Set PATH
+    commands.append("%s PATH=%s" % (cmd, os.pathsep.join(
+        join(p, bin_dir_name) for p in prefixes)))
 
+    # Set PYTHONPATH, if needed
+    if prefixes != [sys.prefix]:
+        commands.append("%s PYTHONPATH=%s" % (cmd, os.pathsep.join(
+            join(prefix, rel_site_packages) for prefix in prefixes)))
 
-def print_path(enst):
+    # Set *_LIBRARY_PATH, as needed
+    if sys.platform != 'win32':
+        if sys.platform == 'darwin':
+            name = 'DYLD_LIBRARY_PATH'
+        else:
+            name = 'LD_LIBRARY_PATH'
+        commands.append("%s %s=%s" % (cmd, name, os.pathsep.join(
+            join(p, 'lib') for p in prefixes)))
+
+    return commands
+
+
+def print_path(prefixes):
     print "Prefixes:"
-    for p in enst.prefixes:
+    for p in prefixes:
         print '    %s%s' % (p, ['', ' (sys)'][p == sys.prefix])
     print
 
-    for command in enst.path_commands():
+    for command in path_commands(prefixes):
         print command
 
 
@@ -312,6 +439,9 @@ def print_installed_info(enst, cname):
 
 
 def info_option(enst, cname):
+    import textwrap
+    from indexed_repo import Req, dist_naming
+
     info = get_info()
     if info and cname in info:
         spec = info[cname]
@@ -364,6 +494,8 @@ def list_option(prefix, pat=None):
 
 
 def whats_new(enst):
+    from indexed_repo import Req, dist_naming
+
     fmt = '%-25s %-15s %s'
     print fmt % ('Name', 'installed', 'available')
     print 60 * "="
@@ -400,12 +532,8 @@ def search(enst, pat=None):
     for name in sorted(enst.chain.groups.keys(), key=string.lower):
         if pat and not pat.search(name):
             continue
-        versions = enst.chain.list_versions(name)
         disp_name = name
-        for version in versions:
-            req = Req(name + ' ' + version)
-            dist = enst.chain.get_dist(req)
-            repo = dist_naming.repo_dist(dist)
+        for version, repo in enst.chain.version_table(name):
             print fmt % (disp_name, version,  shorten_repo(repo))
             disp_name = ''
 
@@ -421,6 +549,8 @@ def depend_warn(enst, dists, action):
     a package is removed it does not matter which version is required.
     Hence, in remove_req() this function is called with ignore_version=True.
     """
+    from indexed_repo import spec_as_req, dist_naming
+
     if action == 'remove':
         ignore_version = True
     else:
@@ -488,6 +618,8 @@ Once you have obtained a subscription, you can proceed here.
 
 
 def add_url(url, verbose):
+    from indexed_repo import Chain, dist_naming
+
     url = dist_naming.cleanup_reponame(url)
 
     arch_url = config.arch_filled_url(url)
@@ -501,6 +633,10 @@ def add_url(url, verbose):
 
 
 def revert(enst, rev_in):
+    from history import History
+    from indexed_repo import filename_as_req
+    import localrepo
+
     history = History(enst.prefixes[0])
     try:
         rev = int(rev_in)
@@ -525,6 +661,7 @@ def revert(enst, rev_in):
     # remove packages
     for fn in curr - state:
         enst.remove_egg(fn)
+    enst.events.flush()
 
     # install packages (fetch from server if necessary)
     to_install = []
@@ -546,15 +683,46 @@ def revert(enst, rev_in):
             ei = egginst.EggInst(egg_path)
             ei.progress_callback = console_file_progress
             ei.install()
+    localrepo.touch(enst.egg_dir, to_install)
 
     history.update()
 
 
+def gc_option(enst, max_size=None):
+    removed, reclaimed = enst.collect_garbage(max_size)
+    if max_size is not None and not removed:
+        return
+    for fn in sorted(removed):
+        pprint_fn_action(fn, 'removing')
+    print "removed %d eggs from %s, reclaimed %s" % (
+        len(removed), enst.egg_dir, human_bytes(reclaimed))
+
+
+def auto_gc(enst):
+    """
+    keep the local repository within the budget set in the config file
+    """
+    max_mb = config.get('local_max_size')
+    if max_mb:
+        gc_option(enst, int(max_mb * 1024 ** 2))
+
+
+def evict_store(max_mb):
+    store = get_egg_store()
+    if store is None:
+        sys.exit("Error: no egg_store configured")
+    n, removed = store.evict(int(max_mb * 1024 ** 2))
+    print "removed %d eggs (%s) from: %s" % (n, human_bytes(removed),
+                                              store.dir_path)
+
+
 def iter_dists_excl(dists, exclude_fn):
     """
     Iterates over all dists, excluding the ones whose filename is an element
     of exclude_fn.  Yields the distribution.
     """
+    from indexed_repo import dist_naming
+
     for dist in dists:
         fn = dist_naming.filename_dist(dist)
         if fn in exclude_fn:
@@ -584,6 +752,15 @@ def install_req(enst, req, opts):
         print_installed_info(enst, req.name)
 
 
+def profile_report(path=None):
+    from egginst import timing
+
+    print
+    timing.print_report()
+    if path:
+        timing.write_json(path)
+
+
 def main():
     p = ArgumentParser(description=__doc__)
     p.add_argument('cnames', metavar='CNAME', nargs='*',
@@ -598,8 +775,26 @@ def main():
     p.add_argument("--forceall", action="store_true",
                    help="force install of all packages "
                         "(i.e. including dependencies)")
+    p.add_argument("--evict-store", metavar='MB', type=float,
+                   help="remove the least recently used eggs from the "
+                        "egg store, until its size is at most MB megabytes")
+    p.add_argument("--export-lock", metavar='FILE',
+                   help="write a lockfile listing the exact eggs installed "
+                        "into the prefix")
+    p.add_argument("--gc", action="store_true",
+                   help="remove the eggs from the local repository which are "
+                        "neither installed nor referenced by one of the "
+                        "last revisions (see --log)")
     p.add_argument('-i', "--info", action="store_true",
                    help="show information about a package")
+    p.add_argument("--install-lock", metavar='FILE',
+                   help="make the prefix match the lockfile, i.e. install "
+                        "the eggs listed (without resolving dependencies) "
+                        "and remove all others")
+    p.add_argument('-j', "--jobs", metavar='N', type=int, default=1,
+                   help="fetch and install up to N eggs at the same time, "
+                        "where an egg is installed as soon as it is fetched "
+                        "and its dependencies are installed (default 1)")
     p.add_argument("--log", action="store_true", help="print revision log")
     p.add_argument('-l', "--list", action="store_true",
                    help="list the packages currently installed on the system")
@@ -613,6 +808,13 @@ def main():
     p.add_argument("--prefix", metavar='PATH',
                    help="install prefix (disregarding of any settings in "
                         "the config file)")
+    p.add_argument("--profile", action="store_true",
+                   help="print how much time was spent in each phase "
+                        "(downloading indexes, resolving, fetching, "
+                        "extracting, ...)")
+    p.add_argument("--profile-json", metavar='FILE',
+                   help="like --profile, and also write the timings to FILE "
+                        "(in JSON format)")
     p.add_argument("--proxy", metavar='URL', help="use a proxy for downloads")
     p.add_argument("--remove", action="store_true", help="remove a package")
     p.add_argument("--revert", metavar="REV",
@@ -636,7 +838,9 @@ def main():
     args = p.parse_args()
 
     if len(args.cnames) > 0 and (args.config or args.path or args.userpass or
-                                 args.revert or args.log or args.whats_new):
+                                 args.revert or args.log or args.whats_new or
+                                 args.export_lock or args.install_lock or
+                                 args.evict_store is not None or args.gc):
         p.error("Option takes no arguments")
 
     if args.prefix and args.sys_prefix:
@@ -645,10 +849,21 @@ def main():
     if args.force and args.forceall:
         p.error("Options --force and --forceall exclude each ohter")
 
+    if args.jobs < 1:
+        p.error("Option --jobs requires a positive number")
+
+    if args.profile or args.profile_json:
+        atexit.register(profile_report, args.profile_json)
+
     pat = None
     if (args.list or args.search) and args.cnames:
         pat = re.compile(args.cnames[0], re.I)
 
+    try:
+        config.read()
+    except config.ConfigError as e:
+        sys.exit("Error: %s" % e)
+
     if args.sys_prefix:
         prefix = sys.prefix
     elif args.prefix:
@@ -662,6 +877,8 @@ def main():
         prefixes = [prefix, sys.prefix]
 
     if args.log:                                  # --log
+        from history import History
+
         History(prefix).print_log()
         return
 
@@ -681,6 +898,18 @@ def main():
         list_option(prefix, pat)
         return
 
+    if args.evict_store is not None:              # --evict-store
+        evict_store(args.evict_store)
+        return
+
+    if args.path:                                 # --path
+        print_path(prefixes)
+        return
+
+    from proxy.api import setup_proxy
+    from history import History
+    from indexed_repo import Chain, Req
+
     if args.proxy:                                # --proxy
         setup_proxy(args.proxy)
     elif config.get('proxy'):
@@ -691,8 +920,12 @@ def main():
     dry_run = args.dry_run
     verbose = args.verbose
 
-    enst = Enstaller(chain=Chain(config.get('IndexedRepos'), args.verbose),
-                     prefixes=prefixes, dry_run=dry_run)
+    if args.install_lock or args.gc:
+        # the lockfile lists the exact eggs, so no index is needed
+        chain = Chain(verbose=args.verbose)
+    else:
+        chain = Chain(config.get('IndexedRepos'), args.verbose)
+    enst = Enstaller(chain=chain, prefixes=prefixes, dry_run=dry_run)
     if args.verbose:
         enst.pre_install_callback = verbose_depend_warn
     else:
@@ -700,17 +933,45 @@ def main():
     enst.file_action_callback = pprint_fn_action
     enst.download_progress_callback = console_file_progress
     enst.install_progress_callback = console_file_progress
+    if args.jobs > 1:
+        # progress bars of eggs handled at the same time would be mixed up
+        enst.jobs = args.jobs
+        enst.download_progress_callback = noop_callback
+        enst.install_progress_callback = noop_callback
 
     if args.add_url:                              # --add-url
         add_url(args.add_url, args.verbose)
         return
 
-    if args.path:                                 # --path
-        print_path(enst)
+    if args.gc:                                   # --gc
+        gc_option(enst)
         return
 
     if args.revert:                               # --revert
         revert(enst, args.revert)
+        auto_gc(enst)
+        return
+
+    if args.export_lock or args.install_lock:
+        import lockfile
+
+    if args.export_lock:                          # --export-lock
+        try:
+            entries = lockfile.export(enst, args.export_lock)
+        except lockfile.LockfileError as e:
+            sys.exit("Error: %s" % e)
+        print "wrote %d eggs to: %s" % (len(entries), args.export_lock)
+        return
+
+    if args.install_lock:                         # --install-lock
+        print "prefix:", prefix
+        check_write(enst)
+        with History(prefix):
+            try:
+                lockfile.install(enst, args.install_lock)
+            except lockfile.LockfileError as e:
+                sys.exit("Error: %s" % e)
+        auto_gc(enst)
         return
 
     if args.search:                               # --search
@@ -757,6 +1018,7 @@ def main():
                 remove_req(enst, req)
             else:
                 install_req(enst, req, args)
+    auto_gc(enst)
 
 
 if __name__ == '__main__':
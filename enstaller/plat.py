@@ -1,8 +1,10 @@
 import sys
-import platform
+import struct
 
 
-if '64' in platform.architecture()[0]:
+# platform.architecture() runs the 'file' command, which is too slow
+# for something done every time enpkg starts
+if struct.calcsize('P') == 8:
     arch = 'amd64'
     bits = 64
 else:
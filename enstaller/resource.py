@@ -1,11 +1,15 @@
+import os
 import sys
 import json
+import socket
+import hashlib
+import threading
 from collections import defaultdict
-from httplib import HTTPConnection
+from httplib import HTTPConnection, HTTPSConnection, HTTPException
 import logging
+from multiprocessing.pool import ThreadPool
 from os import makedirs
-from os.path import isdir, join
-import re
+from os.path import isdir, isfile, join
 from urllib2 import HTTPError, urlopen, Request
 from urlparse import urlsplit
 
@@ -20,10 +24,72 @@ from verlib import IrrationalVersionError
 from indexed_repo.chain import Chain, Req
 from indexed_repo import dist_naming
 from indexed_repo.requirement import add_Reqs_to_spec
+from search_index import SearchIndex
 
 logger = logging.getLogger(__name__)
 
 
+def vb_egg(fn):
+    try:
+        n, v, b = dist_naming.split_eggname(fn)
+        return comparable_version(v), b
+    except IrrationalVersionError:
+        return None
+    except AssertionError:
+        return None
+
+
+class ConnectionPool(object):
+    """
+    keep-alive HTTP(S) connections, which are shared between threads
+    (each connection is only used by one thread at a time)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = defaultdict(list)
+
+    def _get(self, key):
+        with self.lock:
+            if self.idle[key]:
+                return self.idle[key].pop()
+        scheme, netloc = key
+        if scheme == 'https':
+            return HTTPSConnection(netloc)
+        return HTTPConnection(netloc)
+
+    def request(self, url, headers={}):
+        """
+        GET the url (a SplitResult), and return the tuple(response, data)
+        """
+        key = url.scheme, url.netloc
+        path = url.path + ('?' + url.query if url.query else '')
+        for retry in (True, False):
+            conn = self._get(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+                break
+            except (HTTPException, socket.error):
+                # the server may have closed an idle keep-alive connection
+                conn.close()
+                if not retry:
+                    raise
+        if res.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                self.idle[key].append(conn)
+        return res, data
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.itervalues():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+
 class Resources(object):
 
     def __init__(self, index_root=None, urls=[], verbose=False, prefix=None,
@@ -36,18 +102,25 @@ class Resources(object):
         self.enst = Enstaller(Chain(verbose=verbose), [prefix or sys.prefix])
         self.product_index_path = 'products'
         self.authenticate = True
-
-        for url in urls:
-            self.add_product(url)
-
-        if index_root:
-            self.load_index(index_root)
+        # maximal number of product indexes fetched concurrently
+        self.max_workers = 8
+        # directory in which product indexes are cached (along with their
+        # ETag), set to None to disable caching
+        self.cache_dir = join(self.enst.egg_dir, '.index-cache')
+        self.connections = ConnectionPool()
+        # inverted index of the names and descriptions of all eggs
+        self.search_index = SearchIndex()
 
         # Cache attributes
         self._installed_cnames = None
         self._status = None
         self._installed = None
 
+        self.add_products(urls)
+
+        if index_root:
+            self.load_index(index_root)
+
     def clear_cache(self):
         self._installed_cnames = None
         self._status = None
@@ -56,7 +129,7 @@ class Resources(object):
     def _http_auth(self):
         username, password = config.get_auth()
         if username and password and self.authenticate:
-            return (username + ':' + password).encode('base64')
+            return (username + ':' + password).encode('base64').strip()
         else:
             return None
 
@@ -79,46 +152,86 @@ class Resources(object):
 
         for product in index:
             product_url = '%s/products/%s' % (url, product['product'])
-            try:
-                product['base_url'] = url
-                product['url'] = product_url.rstrip('/')
-                self.add_product(product)
-            except HTTPError:
-                logger.exception('Error getting index file %s' % product_url)
+            product['base_url'] = url
+            product['url'] = product_url.rstrip('/')
+        self.add_products(index)
+
+    def _cache_path(self, product_url):
+        return join(self.cache_dir,
+                    hashlib.md5(product_url).hexdigest() + '.json')
+
+    def _read_cache(self, product_url):
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(product_url)
+        if not isfile(path):
+            return None
+        try:
+            cache = json.load(open(path))
+        except ValueError:
+            return None
+        if cache.get('product_url') != product_url:
+            return None
+        return cache
+
+    def _write_cache(self, product_url, index_url, etag, data):
+        if not (self.cache_dir and etag):
+            return
+        try:
+            if not isdir(self.cache_dir):
+                makedirs(self.cache_dir)
+            path = self._cache_path(product_url)
+            fo = open(path + '.part', 'w')
+            json.dump(dict(product_url=product_url, index_url=index_url,
+                           etag=etag, data=data), fo)
+            fo.close()
+            if sys.platform == 'win32' and isfile(path):
+                os.unlink(path)
+            os.rename(path + '.part', path)
+        except (IOError, OSError):
+            logger.exception('Error writing index cache for %s' % product_url)
 
     def _read_product_index(self, product_url):
         """ Get the product index.
 
         Try the platform-independent one first, then try the
-        platform-specific one if that one doesn't exist. Does both
-        HTTP requests simultaneously.
+        platform-specific one if that one doesn't exist.  Both requests
+        are made on the same (keep-alive) connection.  A cached index is
+        revalidated using its ETag, and used when the server is not
+        reachable.
 
         """
-        independent = urlsplit('%s/index.json' % (product_url))
-        specific = urlsplit('%s/index-%s.json' % (product_url, self.plat))
-        logger.debug('Trying for JSON from URLs: %s, %s' %
-                     (independent.geturl(), specific.geturl()))
-        conn1 = HTTPConnection(independent.netloc)
-        conn2 = HTTPConnection(specific.netloc)
+        independent = '%s/index.json' % product_url
+        specific = '%s/index-%s.json' % (product_url, self.plat)
+        cache = self._read_cache(product_url)
+        urls = [independent, specific]
+        if cache and cache['index_url'] in urls:
+            # try the URL which worked last time first
+            urls.remove(cache['index_url'])
+            urls.insert(0, cache['index_url'])
+        logger.debug('Trying for JSON from URLs: %s' % ', '.join(urls))
+
+        headers = {}
         auth = self._http_auth()
         if auth:
-            headers = {'Authorization': auth}
-        else:
-            headers = {}
-        conn1.request('GET', independent.path, headers=headers)
-        conn2.request('GET', specific.path, headers=headers)
+            headers['Authorization'] = auth
 
+        data = None
         try:
-            res = conn1.getresponse()
-            if res.status == 200:
-                data = res.read()
-                return independent, json.loads(data)
-            res = conn2.getresponse()
-            if res.status == 200:
-                data = res.read()
-                return specific, json.loads(data)
-            else:
-                raise HTTPError(specific, res.code, res.reason, res.msg)
+            for url in urls:
+                h = dict(headers)
+                if cache and cache['index_url'] == url:
+                    h['If-None-Match'] = cache['etag']
+                res, data = self.connections.request(urlsplit(url), h)
+                if res.status == 304:
+                    logger.debug('Using cached index: %s' % url)
+                    return urlsplit(url), cache['data']
+                if res.status == 200:
+                    product_index = json.loads(data)
+                    self._write_cache(product_url, url, res.getheader('etag'),
+                                      product_index)
+                    return urlsplit(url), product_index
+            raise HTTPError(url, res.status, res.reason, res.msg, None)
         except ValueError:
             logger.exception('Error parsing index for %s' % product_url)
             logger.error('Invalid index file: """%s"""' % data)
@@ -126,16 +239,48 @@ class Resources(object):
         except HTTPError:
             logger.exception('Error reading index for %s' % product_url)
             return None, None
+        except (HTTPException, socket.error):
+            if cache:
+                logger.warning('Could not reach %s, using cached index' %
+                               product_url)
+                return urlsplit(cache['index_url']), cache['data']
+            logger.exception('Error reading index for %s' % product_url)
+            return None, None
+
+    def add_products(self, indexes):
+        """
+        add the products (index dictionaries, or simply product URLs),
+        whose indexes are fetched concurrently, but added in order
+        """
+        indexes = [{'url': index.rstrip('/')}
+                   if isinstance(index, basestring) else index
+                   for index in indexes]
+        if not indexes:
+            return
+        if self.verbose:
+            for index in indexes:
+                print "Adding product:", index['url']
+        pool = ThreadPool(min(self.max_workers, len(indexes)))
+        try:
+            results = pool.map(self._read_product_index,
+                               [index['url'] for index in indexes])
         finally:
-            conn1.close()
-            conn2.close()
+            pool.close()
+            pool.join()
+        for index, (index_url, product_index) in zip(indexes, results):
+            self._merge_product(index, index_url, product_index)
 
     def add_product(self, index):
+        if isinstance(index, basestring):
+            index = {'url': index.rstrip('/')}
 
         if self.verbose:
             print "Adding product:", index['url']
 
         index_url, product_index = self._read_product_index(index['url'])
+        return self._merge_product(index, index_url, product_index)
+
+    def _merge_product(self, index, index_url, product_index):
         if product_index is None:
             return
 
@@ -148,6 +293,10 @@ class Resources(object):
 
         if 'eggs' in index:
             self._add_egg_repos(index['url'], index)
+            self._update_status(index['eggs'])
+            for cname, project in index['eggs'].iteritems():
+                self.search_index.add(cname, project.get('name'),
+                                      project.get('description'))
 
         self.index.append(index)
         return index
@@ -156,11 +305,13 @@ class Resources(object):
         if 'egg_repos' in index:
             repos = [url + '/' + path + '/' for path in index['egg_repos']]
         else:
-            repos = [url]
+            repos = [url + '/']
         self.enst.chain.repos.extend(repos)
 
-        for cname, project in index['eggs'].iteritems():
-            for distname, data in project['files'].iteritems():
+        # sorted, such that the order of the chain does not depend on the
+        # order of the (JSON) dictionaries
+        for cname, project in sorted(index['eggs'].iteritems()):
+            for distname, data in sorted(project['files'].iteritems()):
                 name, version, build = dist_naming.split_eggname(distname)
                 spec = dict(metadata_version='1.1',
                             name=name, version=version, build=build,
@@ -169,61 +320,70 @@ class Resources(object):
                 add_Reqs_to_spec(spec)
                 assert spec['cname'] == cname, distname
                 dist = repos[data.get('repo', 0)] + distname
-                self.enst.chain.index[dist] = spec
-                self.enst.chain.groups[cname].append(dist)
+                self.enst.chain.add_dist(dist, spec)
 
     def get_installed_cnames(self):
         if not self._installed_cnames:
             self._installed_cnames = self.enst.get_installed_cnames()
         return self._installed_cnames
 
+    def _status_entry(self, cname):
+        """
+        return the status dictionary of a single package, or None if the
+        package is neither installed nor available
+        """
+        d = None
+        info = self.enst.get_installed_info(cname)[0][1]
+        if info is not None:
+            d = defaultdict(str)
+            d.update(info)
+
+        if cname in self.enst.chain.groups:
+            dist = self.enst.chain.get_dist(Req(cname))
+            if dist is not None:
+                repo, fn = dist_naming.split_dist(dist)
+                n, v, b = dist_naming.split_eggname(fn)
+                if d is None:
+                    d = defaultdict(str)
+                    d['name'] = cname
+                d['a-egg'] = fn
+                d['a-ver'] = '%s-%d' % (v, b)
+
+        if d is None:
+            return None
+
+        if d['egg_name']:                    # installed
+            if d['a-egg']:
+                if vb_egg(d['egg_name']) >= vb_egg(d['a-egg']):
+                    d['status'] = 'up-to-date'
+                else:
+                    d['status'] = 'updateable'
+            else:
+                d['status'] = 'installed'
+        else:                                # not installed
+            d['status'] = 'installable'
+        return d
+
+    def _update_status(self, cnames):
+        """
+        recompute the status of the given packages only
+        """
+        self._installed = None
+        if self._status is None:
+            return
+        for cname in cnames:
+            d = self._status_entry(cname)
+            if d is None:
+                self._status.pop(cname, None)
+            else:
+                self._status[cname] = d
+
     def get_status(self):
-        if not self._status:
+        if self._status is None:
             # the result is a dict mapping cname to ...
-            res = {}
-            for cname in self.get_installed_cnames():
-                d = defaultdict(str)
-                info = self.enst.get_installed_info(cname)[0][1]
-                if info is None:
-                    continue
-                d.update(info)
-                res[cname] = d
-
-                for cname in self.enst.chain.groups.iterkeys():
-                    dist = self.enst.chain.get_dist(Req(cname))
-                    if dist is None:
-                        continue
-                    repo, fn = dist_naming.split_dist(dist)
-                    n, v, b = dist_naming.split_eggname(fn)
-                    if cname not in res:
-                        d = defaultdict(str)
-                        d['name'] = d.get('name', cname)
-                        res[cname] = d
-                    res[cname]['a-egg'] = fn
-                    res[cname]['a-ver'] = '%s-%d' % (v, b)
-
-            def vb_egg(fn):
-                try:
-                    n, v, b = dist_naming.split_eggname(fn)
-                    return comparable_version(v), b
-                except IrrationalVersionError:
-                    return None
-                except AssertionError:
-                    return None
-
-            for d in res.itervalues():
-                if d['egg_name']:                    # installed
-                    if d['a-egg']:
-                        if vb_egg(d['egg_name']) >= vb_egg(d['a-egg']):
-                            d['status'] = 'up-to-date'
-                        else:
-                            d['status'] = 'updateable'
-                    else:
-                        d['status'] = 'installed'
-                else:                                # not installed
-                    if d['a-egg']:
-                        d['status'] = 'installable'
-            self._status = res
+            self._status = {}
+            self._update_status(set(self.get_installed_cnames()) |
+                                set(self.enst.chain.groups))
         return self._status
 
     def get_installed(self):
@@ -236,17 +396,10 @@ class Resources(object):
     def search(self, text):
         """ Search for eggs with name or description containing the given text.
 
-        Returns a list of canonical names for the matching eggs.
+        Returns a list of canonical names for the matching eggs, ordered by
+        relevance (see search_index.py).
         """
-        regex = re.compile(re.escape(text), re.IGNORECASE)
-        results = []
-        for product in self.index:
-            for cname, metadata in product.get('eggs', {}).iteritems():
-                name = metadata.get('name', '')
-                description = metadata.get('description', '')
-                if regex.search(name) or regex.search(description):
-                    results.append(cname)
-        return results
+        return self.search_index.search(text)
 
     def _req_list(self, reqs):
         """ Take a single req or a list of reqs and return a list of
@@ -261,28 +414,41 @@ class Resources(object):
                 reqs[i] = Req(req)
         return reqs
 
+    def _installed_changes(self, func, *args):
+        """
+        call func(*args) and update the status of the packages whose
+        installed egg has changed
+        """
+        prefix = self.enst.prefixes[0]
+        before = set(egginst.get_installed(prefix))
+        try:
+            return func(*args)
+        finally:
+            changed = before ^ set(egginst.get_installed(prefix))
+            self._installed_cnames = None
+            self._update_status(set(cname_fn(fn) for fn in changed))
+
     def install(self, reqs):
         reqs = self._req_list(reqs)
 
-        with self.history:
-            installed_count = 0
-            for req in reqs:
-                installed_count += self.enst.install(req)
-
-        # Clear the cache, since the status of several packages could now be
-        # invalid
-        self.clear_cache()
+        def install_reqs():
+            with self.history:
+                installed_count = 0
+                for req in reqs:
+                    installed_count += self.enst.install(req)
+            return installed_count
 
-        return installed_count
+        return self._installed_changes(install_reqs)
 
     def uninstall(self, reqs):
         reqs = self._req_list(reqs)
 
-        with self.history:
-            for req in reqs:
-                self.enst.remove(req)
+        def remove_reqs():
+            with self.history:
+                for req in reqs:
+                    self.enst.remove(req)
 
-        self.clear_cache()
+        self._installed_changes(remove_reqs)
         return 1
 
 
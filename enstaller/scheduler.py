@@ -0,0 +1,209 @@
+"""
+Pipelined install, i.e. instead of fetching all eggs, then removing all
+old versions, and then installing all eggs, each egg goes through these
+stages on its own, such that the extraction of the first eggs overlaps
+with the download of the following ones:
+
+    fetch  -->  remove (the installed version)  -->  install
+
+An egg is only removed (and then installed) once its file is fetched and
+all its dependencies (within the eggs being installed) are installed, so
+independent eggs are installed in parallel.  The remove stage is skipped
+when no version of the package is installed.  Removing files (and empty
+directories) while another egg is being extracted is not safe, therefore
+the remove stage never runs at the same time as the install stage.
+
+When a task fails, no further tasks are started (the tasks already
+running are finished), and the error of the first failed task (in
+install order) is raised, regardless of which task happened to fail
+first in time.  Similarly, when the main thread is interrupted (e.g. by
+Ctrl-C), the running tasks are waited for before the exception is
+propagated, such that the transactions of the eggs which were not
+installed are only rolled back once nothing is writing to them anymore.
+"""
+import sys
+import threading
+from Queue import Queue, Empty
+from functools import partial
+
+from utils import cname_fn
+from indexed_repo import dist_naming
+
+
+class Task(object):
+
+    def __init__(self, stage, name, func, deps, order):
+        self.stage = stage
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.order = order
+        # one of: 'waiting', 'running', 'done', 'failed', 'skipped'
+        self.state = 'waiting'
+        self.exc_info = None
+
+    def __repr__(self):
+        return '<Task %s %s: %s>' % (self.stage, self.name, self.state)
+
+
+class Scheduler(object):
+
+    def __init__(self, limits, conflicts=()):
+        # maps stages to the maximal number of tasks running at once
+        self.limits = limits
+        # pairs of stages, whose tasks may not run at the same time
+        self.conflicts = conflicts
+        self.tasks = []
+        self.running = dict((stage, 0) for stage in limits)
+        self._done = Queue()
+
+    def add(self, stage, name, func, deps=()):
+        """
+        add a task, which is run once all tasks in deps are done, and
+        return it (tasks which are added first are also started first)
+        """
+        assert stage in self.limits, stage
+        task = Task(stage, name, func, list(deps), len(self.tasks))
+        self.tasks.append(task)
+        return task
+
+    def _conflicting(self, stage):
+        for a, b in self.conflicts:
+            if (stage == a and self.running[b]) or (
+                stage == b and self.running[a]):
+                return True
+        return False
+
+    def _ready(self):
+        for task in self.tasks:
+            if (task.state == 'waiting' and
+                    all(d.state == 'done' for d in task.deps) and
+                    self.running[task.stage] < self.limits[task.stage] and
+                    not self._conflicting(task.stage)):
+                return task
+        return None
+
+    def _execute(self, task):
+        try:
+            task.func()
+        except BaseException:
+            task.exc_info = sys.exc_info()
+        self._done.put(task)
+
+    def _wait(self):
+        # a blocking get without timeout can't be interrupted by Ctrl-C
+        while True:
+            try:
+                return self._done.get(timeout=60)
+            except Empty:
+                pass
+
+    def _finished(self, task):
+        self.running[task.stage] -= 1
+        if task.exc_info:
+            task.state = 'failed'
+        else:
+            task.state = 'done'
+
+    def run(self):
+        failed = False
+        threads = []
+        try:
+            while True:
+                while not failed:
+                    task = self._ready()
+                    if task is None:
+                        break
+                    task.state = 'running'
+                    self.running[task.stage] += 1
+                    t = threading.Thread(target=self._execute, args=(task,))
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+
+                if not any(self.running.itervalues()):
+                    break
+
+                task = self._wait()
+                self._finished(task)
+                if task.state == 'failed':
+                    failed = True
+        except BaseException:
+            # no further tasks are started, and the running ones are
+            # waited for, as they can't be stopped in the middle of their
+            # work (joining the threads, rather than waiting for their
+            # tasks, also covers a task whose result was already taken)
+            for t in threads:
+                t.join()
+            for task in self.tasks:
+                if task.state == 'running':
+                    task.state = 'failed' if task.exc_info else 'done'
+            self._skip_waiting()
+            raise
+
+        self._skip_waiting()
+        if failed:
+            task = min((t for t in self.tasks if t.state == 'failed'),
+                       key=lambda t: t.order)
+            raise task.exc_info[0], task.exc_info[1], task.exc_info[2]
+
+    def _skip_waiting(self):
+        for task in self.tasks:
+            if task.state == 'waiting':
+                task.state = 'skipped'
+
+
+def install_pipelined(enst, dists, check_md5=False):
+    """
+    install the distributions (in install order) using enst (an Enstaller
+    object), running enst.jobs fetch and install tasks at the same time,
+    and return the number of distributions installed
+    """
+    chain = enst.chain
+    sched = Scheduler(dict(fetch=enst.jobs, remove=1, install=enst.jobs),
+                      conflicts=[('remove', 'install')])
+    # maps cnames to the install tasks
+    installed = {}
+    # maps eggnames to their transactions, which are begun by the remove
+    # task (if any) and committed by the install task
+    txs = {}
+    committed = set()
+    # the transactions of eggs which are installed at the same time may
+    # write into the same (new) directories
+    lock = threading.Lock() if enst.jobs > 1 else None
+
+    def remove(eggname):
+        enst.remove_installed(eggname, txs[eggname])
+
+    def install(dist, eggname):
+        enst.install_egg(dist, txs[eggname])
+        txs[eggname].commit()
+        committed.add(eggname)
+
+    for dist in dists:
+        eggname = dist_naming.filename_dist(dist)
+        fetch = sched.add('fetch', eggname, partial(
+                chain.fetch_dist, dist, enst.egg_dir, check_md5=check_md5,
+                dry_run=enst.dry_run,
+                progress_callback=enst.events.progress_callback('download',
+                                                                eggname)))
+        deps = [fetch] + [installed[r.name] for r in chain.reqs_dist(dist)
+                          if r.name in installed]
+        txs[eggname] = enst.transaction(eggname, lock)
+        if enst.get_installed_info(cname_fn(eggname))[0][1]:
+            # (the remove stage is only used when there is something to
+            # remove, as it blocks the install stage)
+            deps = [sched.add('remove', eggname,
+                              partial(remove, eggname), deps)]
+        installed[cname_fn(eggname)] = sched.add(
+            'install', eggname, partial(install, dist, eggname), deps)
+    try:
+        sched.run()
+    except:
+        # restore the packages which were removed but not (successfully)
+        # installed (run() only returns or raises once no task is running)
+        for eggname, tx in txs.iteritems():
+            if eggname not in committed:
+                tx.rollback()
+        raise
+    return len(dists)
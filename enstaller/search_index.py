@@ -0,0 +1,136 @@
+"""
+An inverted index, mapping (lower case) word tokens of the names and
+descriptions of packages to their canonical names, which is used to answer
+search queries without scanning all package descriptions.
+
+A query matches a package when the query text is contained (ignoring case)
+in the name or description of the package.  Candidates are found by looking
+up each word of the query in the sorted token list (by prefix, and then by
+substring), and are then verified and ranked:
+
+    0: the name equals the query
+    1: the name starts with the query
+    2: the name contains the query
+    3: the description contains the query as a word (prefix)
+    4: the description contains the query
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+
+word_pat = re.compile(r'\w+', re.U)
+
+def tokenize(text):
+    """
+    return the set of lower case word tokens of the text
+    """
+    return set(word_pat.findall(text.lower()))
+
+
+class SearchIndex(object):
+
+    def __init__(self):
+        # maps tokens to the set of cnames
+        self.tokens = defaultdict(set)
+        # maps cnames to tuple(lower case name, lower case description)
+        self.docs = {}
+        # sorted list of tokens, created when needed
+        self._sorted = None
+
+    def add(self, cname, name='', description=''):
+        """
+        add (or update) a package to the index
+        """
+        name = (name or cname).lower()
+        description = (description or '').lower()
+        if self.docs.get(cname) == (name, description):
+            return
+        if cname in self.docs:
+            self.remove(cname)
+        self.docs[cname] = name, description
+        for token in tokenize(name) | tokenize(description):
+            if token not in self.tokens:
+                self._sorted = None
+            self.tokens[token].add(cname)
+
+    def remove(self, cname):
+        name, description = self.docs.pop(cname)
+        for token in tokenize(name) | tokenize(description):
+            cnames = self.tokens[token]
+            cnames.discard(cname)
+            if not cnames:
+                del self.tokens[token]
+                self._sorted = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, cname):
+        return cname in self.docs
+
+    def _matching_tokens(self, word):
+        """
+        return the list of tokens which contain the word, tokens starting
+        with the word (found by bisection) come first
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self.tokens)
+        res = []
+        i = bisect_left(self._sorted, word)
+        while i < len(self._sorted) and self._sorted[i].startswith(word):
+            res.append(self._sorted[i])
+            i += 1
+        res.extend(t for t in self._sorted
+                   if word in t and not t.startswith(word))
+        return res
+
+    def candidates(self, text):
+        """
+        return the set of cnames which may match the text, i.e. each word
+        of the text is part of a token of the package
+        """
+        words = tokenize(text)
+        if not words:
+            return set(self.docs)
+        res = None
+        # start with the longest (most selective) word
+        for word in sorted(words, key=len, reverse=True):
+            cnames = set()
+            for token in self._matching_tokens(word):
+                cnames.update(self.tokens[token])
+            res = cnames if res is None else res & cnames
+            if not res:
+                break
+        return res
+
+    def rank(self, cname, text):
+        """
+        return the rank of the package for the (lower case) text, or None
+        if the package does not match
+        """
+        name, description = self.docs[cname]
+        if name == text:
+            return 0
+        if name.startswith(text):
+            return 1
+        if text in name:
+            return 2
+        if text not in description:
+            return None
+        if re.search(r'(^|\W)' + re.escape(text), description, re.U):
+            return 3
+        return 4
+
+    def search(self, text):
+        """
+        return the list of cnames which match the text, ordered by rank
+        (and then by name)
+        """
+        text = text.lower()
+        res = []
+        for cname in self.candidates(text):
+            r = self.rank(cname, text)
+            if r is not None:
+                res.append((r, cname))
+        return [cname for r, cname in sorted(res)]
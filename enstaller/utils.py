@@ -1,12 +1,6 @@
-import bz2
 import re
 import sys
 import time
-import hashlib
-import logging
-import urlparse
-import urllib2
-from cStringIO import StringIO
 from os.path import abspath, expanduser, getmtime, isfile, join
 
 from egginst import name_version_fn
@@ -14,8 +8,6 @@ from egginst.utils import human_bytes
 from enstaller import __version__
 from enstaller.verlib import NormalizedVersion, IrrationalVersionError
 
-logger = logging.getLogger(__name__)
-
 PY_VER = '%i.%i' % sys.version_info[:2]
 
 
@@ -48,16 +40,25 @@ def comparable_version(version):
     whereas:
         '1.3.10' > '1.3.8'  # False
     """
+    try:
+        return _comparable_versions[version]
+    except KeyError:
+        pass
     try:
         # This hack makes it possible to use 'rc' in the version, where
         # 'rc' must be followed by a single digit.
         ver = version.replace('rc', '.dev99999')
-        return NormalizedVersion(ver)
+        res = NormalizedVersion(ver)
     except IrrationalVersionError:
         # If obtaining the RationalVersion object fails (for example for
         # the version '2009j'), simply return the string, such that
         # a string comparison can be made.
-        return version
+        res = version
+    _comparable_versions[version] = res
+    return res
+
+# maps version strings to the results of comparable_version()
+_comparable_versions = {}
 
 
 def md5_file(path):
@@ -65,6 +66,8 @@ def md5_file(path):
     Returns the md5sum of the file (located at `path`) as a hexadecimal
     string of length 32.
     """
+    import hashlib
+
     fi = open(path, 'rb')
     h = hashlib.new('md5')
     while True:
@@ -80,8 +83,12 @@ def open_with_auth(url):
     """
     Open a urllib2 request, handling HTTP authentication
     """
+    import logging
+    import urllib2
+    import urlparse
     import config
 
+    logger = logging.getLogger(__name__)
     scheme, netloc, path, params, query, frag = urlparse.urlparse(url)
     assert not query
     auth, host = urllib2.splituser(netloc)
@@ -133,6 +140,8 @@ def write_data_from_url(fo, url, md5=None, size=None, progress_callback=None):
         path = url[7:]
         fi = open(path, 'rb')
     elif url.startswith(('http://', 'https://')):
+        import urllib2
+
         try:
             fi = open_with_auth(url)
         except urllib2.HTTPError as e:
@@ -148,15 +157,11 @@ Use "enpkg --userpass" to update authentication in configuration file.
     else:
         sys.exit("Error: invalid url: %r" % url)
 
+    import hashlib
     h = hashlib.new('md5')
 
-    if size and size < 16384:
-        buffsize = 1
-    else:
-        buffsize = 256
-
     while True:
-        chunk = fi.read(buffsize)
+        chunk = fi.read(65536)
         if not chunk:
             break
         fo.write(chunk)
@@ -219,6 +224,8 @@ def get_info():
     containing additional meta-data of the project which is not contained
     in the index-depend data
     """
+    import bz2
+    from cStringIO import StringIO
     from indexed_repo.metadata import parse_index
     import config
 
@@ -248,6 +255,7 @@ def get_available():
     return a dict mapping canonical project names to versions which
     are available in the subscriber repositories
     """
+    from cStringIO import StringIO
     import plat
     import config
 
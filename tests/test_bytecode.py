@@ -0,0 +1,110 @@
+import os
+import sys
+import shutil
+import subprocess
+import threading
+import tempfile
+import unittest
+import zipfile
+from os.path import isdir, isfile, join
+
+from egginst import bytecode
+from egginst.main import EggInst
+from egginst.utils import rel_site_packages
+
+
+def noop(*args):
+    pass
+
+
+class TestBytecode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prefix = join(self.tmp_dir, 'prefix')
+        self.sp = join(self.prefix, rel_site_packages)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def egginst(self, files):
+        path = join(self.tmp_dir, 'foo-1.0-1.egg')
+        z = zipfile.ZipFile(path, 'w')
+        for arcname, data in files.iteritems():
+            z.writestr(arcname, data)
+        z.writestr('EGG-INFO/spec/depend', "name = 'foo'\n")
+        z.close()
+        ei = EggInst(path, self.prefix, precompile=True)
+        ei.progress_callback = noop
+        return ei
+
+    def test_install_remove(self):
+        ei = self.egginst({'foo/__init__.py': '',
+                           'foo/a.py': 'x = 1\n',
+                           'foo/b.py': 'x = 2\n',
+                           'foo/b.pyc': 'shipped',
+                           'foo/bad.py': 'def f(:\n',
+                           'foo/ext.py': 'x = 3\n',
+                           'foo/ext.so': '',
+                           'EGG-INFO/scripts/foo': '#!/usr/bin/python\n'})
+        ei.install()
+        pkg = join(self.sp, 'foo')
+        self.assert_(isfile(join(pkg, 'a.pyc')))
+        self.assert_(isfile(join(pkg, '__init__.pyc')))
+        # the shipped .pyc is not replaced
+        self.assertEqual(open(join(pkg, 'b.pyc')).read(), 'shipped')
+        self.assertFalse(isfile(join(pkg, 'bad.pyc')))
+        self.assertFalse(isfile(join(pkg, 'ext.pyc')))
+
+        ei = self.egginst({})
+        ei.read_meta()
+        self.assert_(join(pkg, 'a.pyc') in ei.files)
+
+        # although the .pyc files are not in the egg, they are removed
+        ei.remove()
+        self.assertFalse(isdir(pkg))
+
+    def test_pool(self):
+        n = 3 * bytecode.CHUNK
+        files = dict(('foo/m%03d.py' % i, 'x = %d\n' % i) for i in xrange(n))
+        files['foo/bad.py'] = 'def f(:\n'
+        ei = self.egginst(files)
+        # use a pool of two processes, regardless of the number of CPUs
+        compile_modules = bytecode.compile_modules
+        bytecode.compile_modules = lambda egg: compile_modules(egg, 2)
+        try:
+            # like the installs of the scheduler, in a worker thread
+            t = threading.Thread(target=ei.install)
+            t.start()
+            t.join()
+        finally:
+            bytecode.compile_modules = compile_modules
+        pkg = join(self.sp, 'foo')
+        self.assertEqual(len([fn for fn in os.listdir(pkg)
+                              if fn.endswith('.pyc')]), n)
+        self.assertFalse(isfile(join(pkg, 'bad.pyc')))
+        ei = self.egginst({})
+        ei.read_meta()
+        self.assertEqual(len([p for p in ei.files if p.endswith('.pyc')]), n)
+
+    def test_optimized(self):
+        ei = self.egginst({'foo/__init__.py': '',
+                           'foo/a.py': 'x = 1\n'})
+        # install with -O, which compiles to .pyo files
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        subprocess.check_call([sys.executable, '-O', '-m', 'egginst.main',
+                               '--precompile', '--prefix', self.prefix,
+                               ei.fpath], env=env, stdout=subprocess.PIPE)
+        pkg = join(self.sp, 'foo')
+        self.assert_(isfile(join(pkg, 'a.pyo')))
+        self.assertFalse(isfile(join(pkg, 'a.pyc')))
+
+        ei = self.egginst({})
+        ei.read_meta()
+        self.assert_(join(pkg, 'a.pyo') in ei.files)
+        ei.remove()
+        self.assertFalse(isdir(pkg))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import isfile, join
+
+from enstaller import config, plat
+
+
+RC = """\
+# comment
+EPD_auth = 'dXNlcjpwYXNz'
+IndexedRepos = [
+  'http://www.example.com/repo/{ARCH}',
+  %(repo)r,
+]
+prefix = '~/foo'
+noapp = True
+local_max_size = 1000
+"""
+
+
+class TestParse(unittest.TestCase):
+
+    def test_literals(self):
+        self.assertEqual(config.parse("a = 'x'\nb = [1, -2.5]\nc = None\n"
+                                      "d = {'k': (True, False)}\n"),
+                         {'a': 'x', 'b': [1, -2.5], 'c': None,
+                          'd': {'k': (True, False)}})
+        self.assertEqual(config.parse("# only a comment\n"), {})
+
+    def test_errors(self):
+        for data in ["import os\n",
+                     "a = os.getcwd()\n",
+                     "a = b = 1\n",
+                     "a.b = 1\n",
+                     "a = 1 +\n",
+                     "execfile('x')\n"]:
+            self.assertRaises(config.ConfigError, config.parse, data)
+
+    def test_lineno(self):
+        try:
+            config.parse("a = 1\n\nb = open('x')\n", 'rc')
+        except config.ConfigError as e:
+            self.assertEqual(str(e), "rc, line 3: value of 'b' is not "
+                                     "a literal")
+        else:
+            self.fail("ConfigError not raised")
+
+
+class TestRead(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = join(self.tmp_dir, '.enstaller4rc')
+        self.repo = join(self.tmp_dir, 'repo')
+        os.mkdir(self.repo)
+        fo = open(self.path, 'w')
+        fo.write(RC % dict(repo=self.repo))
+        fo.close()
+        self.get_path = config.get_path
+        config.get_path = lambda: self.path
+        config.clear_cache()
+
+    def tearDown(self):
+        config.clear_cache()
+        config.get_path = self.get_path
+        shutil.rmtree(self.tmp_dir)
+
+    def forget(self):
+        # forget the configuration held in memory, but not the cache file
+        del config.read.cache
+
+    def test_read(self):
+        conf = config.read()
+        self.assertEqual(conf['IndexedRepos'], [
+                'http://www.example.com/repo/%s/' % plat.arch,
+                'file://%s/' % self.repo])
+        self.assertEqual(conf['prefix'], os.path.expanduser('~/foo'))
+        self.assertEqual(conf['noapp'], True)
+        self.assertEqual(config.get('local_max_size'), 1000)
+        self.assertEqual(config.get_auth(), ['user', 'pass'])
+
+    def test_cache(self):
+        conf = config.read()
+        self.assertTrue(isfile(config.cache_path(self.path)))
+        # the cache is used, even when the repository no longer exists
+        self.forget()
+        os.rmdir(self.repo)
+        self.assertEqual(config.read(), conf)
+
+    def test_cache_invalidated(self):
+        config.read()
+        self.forget()
+        fo = open(self.path, 'a')
+        fo.write("noapp = False\n")
+        fo.close()
+        self.assertEqual(config.read()['noapp'], False)
+
+    def test_cache_cwd(self):
+        fo = open(self.path, 'a')
+        fo.write("local = 'eggs'\n")
+        fo.close()
+        cwd = os.getcwd()
+        try:
+            for d in self.tmp_dir, self.repo:
+                os.chdir(d)
+                # the relative path is resolved against the new directory
+                self.assertEqual(config.read()['local'],
+                                 join(os.getcwd(), 'eggs'))
+                self.forget()
+        finally:
+            os.chdir(cwd)
+
+    def test_invalid(self):
+        fo = open(self.path, 'a')
+        fo.write("local = os.getcwd()\n")
+        fo.close()
+        # the error is not only raised the first time
+        for i in xrange(2):
+            self.assertRaises(config.ConfigError, config.read)
+        self.assertFalse(isfile(config.cache_path(self.path)))
+
+    def test_bad_cache(self):
+        fo = open(config.cache_path(self.path), 'wb')
+        fo.write('garbage')
+        fo.close()
+        self.assertEqual(config.read()['noapp'], True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import getsize, isfile, join
+
+from enstaller.indexed_repo import Chain, delta, metadata
+from enstaller.utils import md5_file
+
+
+SPEC = """\
+metadata_version = '1.1'
+name = 'foo'
+version = %r
+build = 1
+
+arch = None
+platform = None
+osdist = None
+python = None
+packages = []
+"""
+
+
+def random_text(seed, n=20000):
+    r = random.Random(seed)
+    return ''.join(r.choice('abcdefgh \n') for i in xrange(n))
+
+
+def noop(*args):
+    pass
+
+
+class TestDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo = join(self.tmp_dir, 'repo')
+        os.mkdir(self.repo)
+        files = dict(('foo/%s.py' % c, random_text(c)) for c in 'abcdef')
+        self.old = self.write_egg('1.0', files)
+        # b.py is changed, and g.py is added
+        files.update({'foo/b.py': random_text('x'),
+                      'foo/g.py': random_text('g')})
+        self.new = self.write_egg('1.1', files)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_egg(self, version, files):
+        path = join(self.repo, 'foo-%s-1.egg' % version)
+        z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        for arcname in sorted(files):
+            z.writestr(arcname, files[arcname])
+        z.writestr('EGG-INFO/spec/depend', SPEC % version)
+        z.close()
+        return path
+
+    def test_roundtrip(self):
+        delta_path = join(self.tmp_dir, 'x.delta')
+        copied = delta.write_delta(self.old, self.new, delta_path)
+        # all files, except for b.py and g.py, are copied
+        self.assert_(copied > getsize(self.new) * 0.6)
+        self.assert_(getsize(delta_path) < getsize(self.new) * 0.4)
+
+        dst = join(self.tmp_dir, 'new.egg')
+        delta.apply_delta(self.old, delta_path, dst, md5_file(self.new))
+        self.assertEqual(open(dst, 'rb').read(), open(self.new, 'rb').read())
+
+    def test_errors(self):
+        delta_path = join(self.tmp_dir, 'x.delta')
+        delta.write_delta(self.old, self.new, delta_path)
+        dst = join(self.tmp_dir, 'new.egg')
+        # delta for another egg
+        self.assertRaises(delta.DeltaError, delta.apply_delta,
+                          self.old, delta_path, dst, 32 * 'a')
+        # applied to the wrong old egg
+        self.assertRaises(delta.DeltaError, delta.apply_delta,
+                          self.new, delta_path, dst)
+        open(delta_path, 'wb').write('garbage')
+        self.assertRaises(delta.DeltaError, delta.apply_delta,
+                          self.old, delta_path, dst)
+
+    def test_update_deltas(self):
+        delta.update_deltas(self.repo)
+        index = delta.parse_index(
+            open(join(self.repo, 'index-delta.txt')).read())
+        self.assertEqual(index.keys(), [md5_file(self.new)])
+        [(old_md5, size, md5)] = index[md5_file(self.new)]
+        self.assertEqual(old_md5, md5_file(self.old))
+        path = join(self.repo, delta.delta_fn(old_md5, md5_file(self.new)))
+        self.assertEqual((getsize(path), md5_file(path)), (size, md5))
+        self.assert_(isfile(join(self.repo, 'index-delta.bz2')))
+
+    def test_fetch_delta(self):
+        metadata.update_index(self.repo)
+        delta.update_deltas(self.repo)
+        local = join(self.tmp_dir, 'local')
+        os.mkdir(local)
+        chain = Chain(['file://' + self.repo + '/'],
+                      file_action_callback=noop)
+        dist = 'file://%s/foo-1.1-1.egg' % self.repo
+        dst = join(local, 'foo-1.1-1.egg')
+        # no previous build in the local directory
+        self.assertFalse(chain.fetch_delta(dist, dst))
+
+        shutil.copy(self.old, local)
+        self.assert_(chain.fetch_delta(dist, dst, noop))
+        self.assertEqual(md5_file(dst), md5_file(self.new))
+        self.assertEqual(sorted(os.listdir(local)),
+                         ['foo-1.0-1.egg', 'foo-1.1-1.egg'])
+
+        # the delta does not apply to a different previous build
+        os.unlink(dst)
+        shutil.copy(self.new, join(local, 'foo-1.0-1.egg'))
+        self.assertFalse(chain.fetch_delta(dist, dst))
+        self.assertFalse(isfile(dst))
+
+    def test_fetch_delta_fails(self):
+        metadata.update_index(self.repo)
+        delta.update_deltas(self.repo)
+        local = join(self.tmp_dir, 'local')
+        os.mkdir(local)
+        shutil.copy(self.old, local)
+        chain = Chain(['file://' + self.repo + '/'],
+                      file_action_callback=noop)
+        dist = 'file://%s/foo-1.1-1.egg' % self.repo
+        dst = join(local, 'foo-1.1-1.egg')
+        path = join(self.repo, delta.delta_fn(md5_file(self.old),
+                                              md5_file(self.new)))
+        # the delta is corrupt (MD5 mismatch), and then missing
+        open(path, 'ab').write('x')
+        self.assertFalse(chain.fetch_delta(dist, dst, noop))
+        os.unlink(path)
+        self.assertFalse(chain.fetch_delta(dist, dst, noop))
+        self.assertEqual(os.listdir(local), ['foo-1.0-1.egg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import isfile, join
+
+from enstaller.egg_store import EggStore
+
+
+class TestEggStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = EggStore(join(self.tmp_dir, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def add(self, md5, size, mtime):
+        src = join(self.tmp_dir, md5 + '.egg')
+        open(src, 'wb').write(size * 'x')
+        self.store.add(src, md5)
+        os.utime(self.store.path(md5), (mtime, mtime))
+
+    def test_get(self):
+        dst = join(self.tmp_dir, 'foo-1.0-1.egg')
+        self.assertFalse(self.store.get(32 * 'a', dst))
+        self.assertFalse(isfile(dst))
+        self.add(32 * 'a', 100, 1000)
+        self.assert_(self.store.get(32 * 'a', dst))
+        self.assertEqual(open(dst, 'rb').read(), 100 * 'x')
+
+    def test_evict(self):
+        for md5, mtime in [(32 * 'a', 3000), (32 * 'b', 1000),
+                           (32 * 'c', 2000)]:
+            self.add(md5, 100, mtime)
+        self.assertEqual(self.store.size(), 300)
+        self.assertEqual(self.store.evict(), (0, 0))
+
+        # using an egg makes it the most recently used one
+        self.store.get(32 * 'b', join(self.tmp_dir, 'b.egg'))
+        self.assertEqual(self.store.evict(150), (2, 200))
+        self.assert_(isfile(self.store.path(32 * 'b')))
+        self.assertFalse(isfile(self.store.path(32 * 'a')))
+
+
+if __name__ == '__main__':
+    unittest.main()
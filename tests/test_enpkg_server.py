@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', 'web-interface'))
+
+from enpkg_server.api import StatusCache, JobQueue
+
+
+# the "enpkg" command of the jobs: rewrite the __egginst__.txt given by the
+# first argument (like upgrading a package, which does not change the
+# mtime of the EGG-INFO directory), optionally logging the start and end
+UPGRADE = """\
+import sys, time
+if len(sys.argv) > 3:
+    open(sys.argv[3], 'a').write('start\\n')
+    time.sleep(0.05)
+open(sys.argv[1], 'w').write('egg_name = %r\\n' % sys.argv[2])
+print 'upgraded to', sys.argv[2]
+if len(sys.argv) > 3:
+    open(sys.argv[3], 'a').write('end\\n')
+"""
+
+
+def wait(job, timeout=10):
+    t0 = time.time()
+    while job['finished'] is None:
+        if time.time() - t0 > timeout:
+            raise AssertionError("job %(id)d did not finish" % job)
+        time.sleep(0.01)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prefix = join(self.tmp_dir, 'prefix')
+        meta_dir = join(self.prefix, 'EGG-INFO', 'foo')
+        os.makedirs(meta_dir)
+        self.meta_txt = join(meta_dir, '__egginst__.txt')
+        open(self.meta_txt, 'w').write("egg_name = 'foo-1.0-1.egg'\n")
+        self.sc = StatusCache(self.prefix, repos=[])
+        self.jq = JobQueue(self.sc, cmd=[sys.executable, '-c', UPGRADE])
+        self.jq.start()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_status_cached(self):
+        self.assertEqual(self.sc.get_status()['foo']['version'], '1.0-1')
+        self.assertEqual(self.sc.get_status()['foo']['status'], 'installed')
+        open(self.meta_txt, 'w').write("egg_name = 'foo-2.0-1.egg'\n")
+        # EGG-INFO did not change, so the installed packages are not rescanned
+        self.assertEqual(self.sc.get_status()['foo']['version'], '1.0-1')
+        os.mkdir(join(self.prefix, 'EGG-INFO', 'bar'))
+        os.utime(join(self.prefix, 'EGG-INFO'), (0, 0))
+        self.assertEqual(self.sc.get_status()['foo']['version'], '2.0-1')
+
+    def test_invalidated_by_job(self):
+        self.assertEqual(self.sc.get_status()['foo']['version'], '1.0-1')
+        job = self.jq.submit([self.meta_txt, 'foo-2.0-1.egg'])
+        wait(job)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['returncode'], 0)
+        self.assertEqual(job['output'], ['upgraded to foo-2.0-1.egg'])
+        self.assertEqual(self.sc.get_status()['foo']['version'], '2.0-1')
+
+    def test_one_at_a_time(self):
+        log = join(self.tmp_dir, 'log')
+        jobs = [self.jq.submit([self.meta_txt, 'foo-%d.0-1.egg' % i, log])
+                for i in xrange(1, 4)]
+        self.assertEqual([job['id'] for job in self.jq.list()], [1, 2, 3])
+        for job in jobs:
+            wait(job)
+        self.assertEqual([job['state'] for job in jobs], 3 * ['done'])
+        self.assertEqual(open(log).read().split(), 3 * ['start', 'end'])
+        # the last job which was submitted also finished last
+        self.assertEqual(self.sc.get_status()['foo']['version'], '3.0-1')
+        self.assertEqual(self.jq.get(2), jobs[1])
+
+    def test_failed(self):
+        job = self.jq.submit([])
+        wait(job)
+        self.assertEqual(job['state'], 'failed')
+        self.assert_(job['returncode'] != 0)
+        self.assert_(job['output'][-1].startswith('IndexError'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import gc
+import time
+import threading
+import unittest
+
+from enstaller import events
+from enstaller.events import EventStream, Event, ACTION, PROGRESS
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = EventStream()
+        self.events = []
+        self.stream.subscribe(self.slow_consumer)
+
+    def slow_consumer(self, event):
+        time.sleep(0.001)
+        self.events.append((event.type, event.egg, event.phase,
+                            event.so_far, event.total))
+
+    def test_coalesce(self):
+        cb = self.stream.progress_callback('download', 'foo-1.0-1.egg')
+        for n in xrange(0, 100001, 100):
+            cb(n, 100000)
+        self.stream.flush()
+        progress = [so_far for t, egg, phase, so_far, total in self.events]
+        # the first and final events are always delivered
+        self.assertEqual(progress[0], 0)
+        self.assertEqual(progress[-1], 100000)
+        self.assert_(len(progress) < 1001)
+        self.assertEqual(progress, sorted(set(progress)))
+
+    def test_order(self):
+        self.stream.action('foo-1.0-1.egg', 'downloading')
+        cb = self.stream.progress_callback('download', 'foo-1.0-1.egg')
+        cb(0, 10)
+        cb(5, 10)
+        cb(10, 10)
+        self.stream.action('bar-1.0-1.egg', 'installing')
+        self.stream.flush()
+        self.assertEqual(self.events, [
+                (ACTION, 'foo-1.0-1.egg', 'downloading', None, None),
+                (PROGRESS, 'foo-1.0-1.egg', 'download', 0, 10),
+                (PROGRESS, 'foo-1.0-1.egg', 'download', 5, 10),
+                (PROGRESS, 'foo-1.0-1.egg', 'download', 10, 10),
+                (ACTION, 'bar-1.0-1.egg', 'installing', None, None)])
+
+    def test_threads(self):
+        def produce(egg):
+            cb = self.stream.progress_callback('install', egg)
+            for n in xrange(1001):
+                cb(n, 1000)
+        threads = [threading.Thread(target=produce, args=('egg%d' % i,))
+                   for i in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.stream.flush()
+        for i in xrange(4):
+            progress = [e[3] for e in self.events if e[1] == 'egg%d' % i]
+            self.assertEqual(progress[0], 0)
+            self.assertEqual(progress[-1], 1000)
+
+    def test_consumer_error(self):
+        def bad_consumer(event):
+            raise ValueError
+        self.stream.consumers.insert(0, bad_consumer)
+        self.stream.emit(Event(ACTION, 'foo-1.0-1.egg', 'removing'))
+        self.stream.flush()
+        self.assertEqual(len(self.events), 1)
+
+    def test_close(self):
+        self.stream.action('foo-1.0-1.egg', 'installing')
+        thread = self.stream._thread
+        self.assert_(self.stream in events._open)
+        self.stream.close()
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.stream in events._open)
+        self.assertEqual(len(self.events), 1)
+
+    def test_collected(self):
+        self.stream.action('foo-1.0-1.egg', 'installing')
+        self.stream.flush()
+        thread = self.stream._thread
+        n = len(events._open)
+        del self.stream
+        gc.collect()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(events._open), n - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
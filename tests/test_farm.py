@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import isfile, join
+
+from egginst.main import EggInst
+from egginst.utils import bin_dir_name, rel_site_packages
+
+
+def noop(*args):
+    pass
+
+
+class TestFarm(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = join(self.tmp_dir, 'store')
+        self.egg_path = join(self.tmp_dir, 'foo-1.0-1.egg')
+        z = zipfile.ZipFile(self.egg_path, 'w')
+        z.writestr('foo/__init__.py', 'x = 1\n')
+        z.writestr('foo/_bar.so',
+                   '\x7fELF' + 30 * '/PLACEHOLD' + '\0' + 100 * '\0')
+        z.writestr('EGG-INFO/scripts/foo', '#!/usr/bin/python\nimport foo\n')
+        z.writestr('EGG-INFO/prefix/%s2/data' % bin_dir_name, 'data\n')
+        z.writestr('EGG-INFO/spec/depend', "name = 'foo'\n")
+        z.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def install(self, prefix):
+        ei = EggInst(self.egg_path, prefix, store_dir=self.store_dir)
+        ei.progress_callback = noop
+        ei.install()
+        return ei
+
+    def test_install_remove(self):
+        prefixes = [join(self.tmp_dir, 'prefix%d' % i) for i in range(2)]
+        for prefix in prefixes:
+            self.install(prefix)
+
+        sp = [join(prefix, rel_site_packages) for prefix in prefixes]
+        # pure Python files are shared
+        st = os.stat(join(sp[0], 'foo', '__init__.py'))
+        self.assertEqual(st.st_nlink, 3)
+        self.assertEqual(st.st_ino,
+                         os.stat(join(sp[1], 'foo', '__init__.py')).st_ino)
+        # (also in directories next to the bin directory)
+        self.assertEqual(os.stat(join(prefixes[0], bin_dir_name + '2',
+                                      'data')).st_nlink, 3)
+        # object code with placeholders and scripts are copied
+        for path in [join(sp[0], 'foo', '_bar.so'),
+                     join(prefixes[0], bin_dir_name, 'foo')]:
+            self.assertEqual(os.stat(path).st_nlink, 1)
+        self.assert_('PLACEHOLD' not in
+                     open(join(sp[0], 'foo', '_bar.so'), 'rb').read())
+        # while the store remains unchanged
+        store_so, = [join(dp, fn) for dp, dn, fns in os.walk(self.store_dir)
+                     for fn in fns if fn == '_bar.so']
+        self.assert_('PLACEHOLD' in open(store_so, 'rb').read())
+
+        ei = EggInst(self.egg_path, prefixes[0])
+        ei.progress_callback = noop
+        ei.remove()
+        self.assertFalse(isfile(join(sp[0], 'foo', '__init__.py')))
+        self.assertEqual(os.stat(join(sp[1], 'foo', '__init__.py')).st_nlink,
+                         2)
+
+
+if __name__ == '__main__':
+    unittest.main()
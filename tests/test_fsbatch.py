@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import isdir, join
+
+from egginst.fsbatch import DirCache
+
+
+class TestDirCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_makedirs(self):
+        dirs = DirCache()
+        path = join(self.tmp_dir, 'a', 'b')
+        self.assertFalse(dirs.isdir(path))
+        dirs.makedirs(path)
+        self.assert_(isdir(path))
+        self.assert_(dirs.isdir(path))
+        # the directory is known to exist, and is not checked again
+        os.rmdir(path)
+        dirs.makedirs(path)
+        self.assertFalse(isdir(path))
+
+    def test_is_new(self):
+        dirs = DirCache()
+        self.assertFalse(dirs.is_new(join(self.tmp_dir, 'foo.py')))
+        path = join(self.tmp_dir, 'a', 'foo.py')
+        self.assert_(dirs.is_new(path))
+        dirs.makedirs(join(self.tmp_dir, 'a'))
+        self.assert_(dirs.is_new(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
+import os
 import sys
+import shutil
+import tempfile
 import unittest
-from os.path import abspath, dirname
+from os.path import abspath, basename, dirname, join
 
-from enstaller.indexed_repo import Chain
+from enstaller.indexed_repo import Chain, Spec
+from enstaller.indexed_repo.cache import ResolveCache
+from enstaller.indexed_repo.resolver import Resolver
 import enstaller.indexed_repo.dist_naming as dist_naming
 import enstaller.indexed_repo.requirement as requirement
 from enstaller.indexed_repo.requirement import (Req, dist_as_req,
@@ -140,6 +145,47 @@ class TestReq(unittest.TestCase):
         self.assertEqual(Req('foo').matches(spec25), False)
         self.assertEqual(Req('foo').matches(spec26), True)
 
+    def test_constraints(self):
+        for req_string, constraints in [
+            ('foo >=1.2, <2.0', (('>=', '1.2'), ('<', '2.0'))),
+            ('foo>=1.2',        (('>=', '1.2'),)),
+            ('foo ~=1.4.2',     (('~=', '1.4.2'),)),
+            ('foo != 1.3',      (('!=', '1.3'),)),
+            ]:
+            r = Req(req_string)
+            self.assertEqual(r.name, 'foo')
+            self.assertEqual(r.strictness, 2)
+            self.assertEqual(r.version, None)
+            self.assertEqual(r.constraints, constraints)
+            self.assertEqual(eval(repr(r)), r)
+
+        self.assertNotEqual(Req('foo >=1.2'), Req('foo >1.2'))
+        self.assertRaises(AssertionError, Req, 'foo ~=1')
+        self.assertRaises(AssertionError, Req, 'foo =>1.2')
+
+    def test_matches_constraints(self):
+        spec = dict(metadata_version='1.1', cname='foo', version='1.4.5',
+                    build=1, python=None)
+        for req_string, m in [
+            ('foo >=1.2,<2.0', True),
+            ('foo >=1.4.10', False),
+            ('foo <1.4.5', False),
+            ('foo <=1.4.5', True),
+            ('foo >1.4.5', False),
+            ('foo ==1.4.5', True),
+            ('foo !=1.4.5', False),
+            ('foo ~=1.4.2', True),
+            ('foo ~=1.4', True),
+            ('foo ~=1.5', False),
+            ('foo ~=1.4.6', False),
+            ('bar >=1.0', False),
+            ]:
+            self.assertEqual(Req(req_string).matches(spec), m, req_string)
+
+    def test_interned(self):
+        self.assert_(Req('foo 1.2') is Req('foo 1.2'))
+        self.assertEqual(len(set([Req('foo'), Req('Foo'), Req('foo')])), 1)
+
     def test_dist_as_req(self):
         for req_string, s in [
             ('numpy', 1),
@@ -163,6 +209,32 @@ class TestReq(unittest.TestCase):
 
 
 
+class TestSpec(unittest.TestCase):
+
+    def test_dict_access(self):
+        spec = Spec(metadata_version='1.1', name='foo', version='1.0',
+                    build=2, python=None, packages=['bar 1.2'])
+        self.assertEqual(spec['name'], 'foo')
+        self.assertEqual(spec.build, 2)
+        self.assertEqual(spec.get('md5'), None)
+        self.assert_('python' in spec)
+        self.assert_('md5' not in spec)
+        self.assertRaises(KeyError, spec.__getitem__, 'md5')
+        self.assertRaises(KeyError, spec.__getitem__, 'get')
+        self.assertRaises(KeyError, spec.__setitem__, 'foo', 1)
+        self.assertRaises(KeyError, Spec, foo=1)
+        self.assertRaises(KeyError, Spec, foo='bar')
+        self.assertRaises(KeyError, Spec, get='bar')
+        spec['md5'] = 32 * 'a'
+        self.assertEqual(dict(spec)['md5'], 32 * 'a')
+        self.assertEqual(spec['packages'], ('bar 1.2',))
+
+    def test_interned(self):
+        s1 = Spec(arch=''.join(['am', 'd64']))
+        s2 = Spec(arch=''.join(['amd', '64']))
+        self.assert_(s1.arch is s2.arch)
+
+
 def eggs_rs(c, req_string):
     return [dist_naming.filename_dist(d)
             for d in c.install_sequence(Req(req_string))]
@@ -229,6 +301,15 @@ class TestChain1(unittest.TestCase):
             ]:
             self.assertEqual(self.c.get_dist(Req(req_string)), dist)
 
+    def test_index(self):
+        dist = self.repos['epd'] + 'FiPy-2.1-1.egg'
+        self.assert_(dist in self.c.index)
+        self.assert_(self.repos['gpl'] + 'FiPy-2.1-1.egg' not in self.c.index)
+        self.assert_('http://example.com/FiPy-2.1-1.egg' not in self.c.index)
+        self.assertEqual(self.c.index[dist]['cname'], 'fipy')
+        self.assertEqual(self.c.cname_dist(dist), 'fipy')
+        self.assert_(dist in self.c.index.keys())
+
     def test_reqs_dist(self):
         dist = self.repos['epd'] + 'FiPy-2.1-1.egg'
         self.assertEqual(self.c.reqs_dist(dist),
@@ -284,6 +365,141 @@ class TestChain2(unittest.TestCase):
         lst = self.c.install_sequence(Req('ets'))
         self.assert_(self.repos['epd'] + 'numpy-1.5.1-2.egg' in lst)
 
+    def test_version_table(self):
+        for name in 'numpy', 'epd', 'foo', 'nonexisting':
+            table = self.c.version_table(name)
+            self.assertEqual([v for v, repo in table],
+                             self.c.list_versions(name))
+            for version, repo in table:
+                dist = self.c.get_dist(Req('%s %s' % (name, version)))
+                self.assertEqual(repo, dist_naming.repo_dist(dist))
+
+    def test_version_table_cache(self):
+        c = Chain(verbose=0)
+        c.add_repo(self.repos['open'], 'index-7.1.txt')
+        table = c.version_table('foo')
+        self.assert_(c.version_table('foo') is table)
+        # the table is invalidated when a distribution is added
+        spec = dict(metadata_version='1.1', name='foo', version='99.0',
+                    build=1, python='2.7', packages=[])
+        add_Reqs_to_spec(spec)
+        c.add_dist(self.repos['epd'] + 'foo-99.0-1.egg', spec)
+        self.assertEqual(c.version_table('Foo'),
+                         table + [('99.0', self.repos['epd'])])
+
+
+class TestResolver(unittest.TestCase):
+
+    repo = 'file:///repo/'
+
+    def chain(self, specs):
+        c = Chain(verbose=0)
+        for fn, packages in specs:
+            name, version, build = dist_naming.split_eggname(fn)
+            spec = dict(metadata_version='1.1', name=name, version=version,
+                        build=build, python=None, packages=packages)
+            add_Reqs_to_spec(spec)
+            c.add_dist(self.repo + fn, spec)
+        return c
+
+    def test_conflict(self):
+        requirement.PY_VER = '2.7'
+        c = self.chain([
+                ('a-1.0-1.egg', ['b', 'c']),
+                ('b-2.0-1.egg', ['d 2.0']),
+                ('b-1.0-1.egg', ['d 1.0']),
+                ('c-1.0-1.egg', ['d <2.0']),
+                ('d-2.0-1.egg', []),
+                ('d-1.0-1.egg', []),
+                ])
+        self.assertEqual(eggs_rs(c, 'a'),
+                         ['d-1.0-1.egg', 'b-1.0-1.egg', 'c-1.0-1.egg',
+                          'a-1.0-1.egg'])
+        self.assertEqual(eggs_rs(c, 'b'), ['d-2.0-1.egg', 'b-2.0-1.egg'])
+
+    def test_unresolvable(self):
+        requirement.PY_VER = '2.7'
+        c = self.chain([
+                ('a-1.0-1.egg', ['b', 'c']),
+                ('b-1.0-1.egg', ['d >=2.0']),
+                ('c-1.0-1.egg', ['d <2.0']),
+                ('d-2.0-1.egg', []),
+                ('d-1.0-1.egg', []),
+                ])
+        self.assertRaises(SystemExit, c.install_sequence, Req('a'))
+
+    def test_deep(self):
+        requirement.PY_VER = '2.7'
+        # a chain of dependencies longer than the recursion limit
+        n = sys.getrecursionlimit() + 100
+        c = self.chain([('p%d-1.0-1.egg' % i, ['p%d' % (i + 1)])
+                        for i in xrange(n)] + [('p%d-1.0-1.egg' % n, [])])
+        dists = Resolver(c).solve([Req('p0')])
+        self.assertEqual(sorted(dist_naming.filename_dist(d) for d in dists),
+                         sorted('p%d-1.0-1.egg' % i for i in xrange(n + 1)))
+
+
+class TestResolveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def chain(self, names):
+        c = Chain(verbose=0)
+        for name in names:
+            repo = 'file://%s/%s/' % (abspath(dirname(__file__)), name)
+            c.add_repo(repo, 'index-7.1.txt')
+        c.resolve_cache = ResolveCache(self.tmp_dir)
+        return c
+
+    def test_lookup(self):
+        requirement.PY_VER = '2.7'
+        c = self.chain(['epd'])
+        key = c.cache_key(Req('scipy'), 'recur')
+        self.assertEqual(c.resolve_cache.get(key), None)
+        dists = c.install_sequence(Req('scipy'))
+        self.assertEqual(c.resolve_cache.get(key), dists)
+
+        # a second resolution is a lookup
+        c.resolve_cache.set(key, ['file:///foo/bar-1.0-1.egg'])
+        self.assertEqual(c.install_sequence(Req('scipy')),
+                         ['file:///foo/bar-1.0-1.egg'])
+
+    def test_prune(self):
+        cache = ResolveCache(self.tmp_dir, max_entries=3)
+        for i in xrange(5):
+            cache.set(('key', i), ['file:///foo/bar-1.0-%d.egg' % i])
+            # entries written in the same second have the same mtime
+            os.utime(cache.path(('key', i)), (1000 + i, 1000 + i))
+        # using an entry makes it the most recently used one
+        self.assertEqual(cache.get(('key', 2)), ['file:///foo/bar-1.0-2.egg'])
+        part = join(self.tmp_dir, 'x.part')
+        open(part, 'w').close()
+        os.utime(part, (0, 0))
+        cache.set(('key', 5), [])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         sorted(basename(cache.path(('key', i)))
+                                for i in (2, 4, 5)))
+
+    def test_key(self):
+        c1 = self.chain(['epd'])
+        c2 = self.chain(['epd', 'gpl'])
+        k1 = c1.cache_key(Req('scipy'), 'recur')
+        self.assertEqual(k1, self.chain(['epd']).cache_key(Req('scipy'),
+                                                           'recur'))
+        self.assertNotEqual(k1, c1.cache_key(Req('scipy'), 'flat'))
+        self.assertNotEqual(k1, c2.cache_key(Req('scipy'), 'recur'))
+
+        # changing the index invalidates the key
+        c1.add_dist('file:///foo/bar-1.0-1.egg',
+                    dict(metadata_version='1.1', name='bar', version='1.0',
+                         build=1, python=None, packages=[], cname='bar',
+                         Reqs=set()))
+        self.assertEqual(c1.cache_key(Req('scipy'), 'recur'), None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,241 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+import zipfile
+from os.path import isdir, isfile, join
+
+import egginst
+from egginst import journal
+from egginst.main import EggInst
+from egginst.utils import bin_dir_name, rel_site_packages
+
+
+def noop(*args):
+    pass
+
+
+def fail():
+    raise IOError('No space left on device')
+
+
+def tree(dir_path):
+    """
+    return a dict mapping the relative paths of all files to their content
+    """
+    res = {}
+    for root, dirs, files in os.walk(dir_path):
+        for fn in files:
+            path = join(root, fn)
+            res[path[len(dir_path) + 1:]] = open(path, 'rb').read()
+    return res
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prefix = join(self.tmp_dir, 'prefix')
+        self.eggs = {}
+        for version, files in [
+            ('1.0', {'foo/__init__.py': 'x = 1\n',
+                     'foo/same.py': 'same = True\n',
+                     'foo/old.py': 'old = True\n',
+                     'EGG-INFO/scripts/foo': '#!/usr/bin/python\n'}),
+            ('2.0', {'foo/__init__.py': 'x = 2\n',
+                     'foo/same.py': 'same = True\n',
+                     'foo/new.py': 'new = True\n',
+                     'EGG-INFO/scripts/foo': '#!/usr/bin/python\n# 2\n'}),
+            ('3.0', {'foo/__init__.py': 'x = 3\n',
+                     'EGG-INFO/post_egginst.py': 'import sys\n'
+                                                 'sys.exit(1)\n'}),
+            ]:
+            path = join(self.tmp_dir, 'foo-%s-1.egg' % version)
+            z = zipfile.ZipFile(path, 'w')
+            for arcname, data in files.iteritems():
+                z.writestr(arcname, data)
+            z.writestr('EGG-INFO/spec/depend', "name = 'foo'\n")
+            z.close()
+            self.eggs[version] = path
+
+        self.sp = join(self.prefix, rel_site_packages)
+        self.egginst('1.0').install()
+        self.before = tree(self.prefix)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def egginst(self, version, tx=None):
+        ei = EggInst(self.eggs[version], self.prefix, tx=tx)
+        ei.progress_callback = noop
+        return ei
+
+    def assert_no_tx(self):
+        self.assertEqual([fn for fn in os.listdir(self.prefix)
+                          if fn.startswith(journal.TX_PREFIX)], [])
+
+    def test_install(self):
+        self.assertEqual(open(join(self.sp, 'foo', '__init__.py')).read(),
+                         'x = 1\n')
+        self.assert_(isfile(join(self.prefix, bin_dir_name, 'foo')))
+        self.assert_no_tx()
+
+    def test_replace(self):
+        with journal.Transaction(self.prefix, 'foo') as tx:
+            self.egginst('1.0', tx).remove()
+            self.egginst('2.0', tx).install()
+        self.assertEqual(list(egginst.get_installed(self.prefix)),
+                         ['foo-2.0-1.egg'])
+        self.assertEqual(open(join(self.sp, 'foo', '__init__.py')).read(),
+                         'x = 2\n')
+        self.assertFalse(isfile(join(self.sp, 'foo', 'old.py')))
+        self.assert_no_tx()
+
+    def test_upgrade(self):
+        same = join(self.sp, 'foo', 'same.py')
+        ino = os.stat(same).st_ino
+        with journal.Transaction(self.prefix, 'foo') as tx:
+            old = self.egginst('1.0', tx)
+            new = self.egginst('2.0', tx)
+            tx.keep = new.unchanged_files(old)
+            # __init__.py and scripts are always rewritten
+            self.assertEqual(tx.keep, set([same]))
+            old.remove()
+            new.install()
+        self.assertEqual(os.stat(same).st_ino, ino)
+        self.assertEqual(open(same).read(), 'same = True\n')
+        self.assertFalse(isfile(join(self.sp, 'foo', 'old.py')))
+        self.assertEqual(open(join(self.sp, 'foo', 'new.py')).read(),
+                         'new = True\n')
+
+        ei = self.egginst('2.0')
+        ei.read_meta()
+        self.assert_(same in ei.files)
+        self.assert_(same in ei.crcs)
+        self.assert_(set(ei.crcs) <= set(ei.files))
+        # the kept file is removed along with the package
+        ei.remove()
+        self.assertFalse(isfile(same))
+
+    def test_upgrade_rollback(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        try:
+            with tx:
+                old = self.egginst('1.0', tx)
+                new = self.egginst('2.0', tx)
+                tx.keep = new.unchanged_files(old)
+                old.remove()
+                new.entry_points = fail
+                new.install()
+        except IOError:
+            pass
+        self.assertEqual(tree(self.prefix), self.before)
+
+    def test_rollback(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        try:
+            with tx:
+                self.egginst('1.0', tx).remove()
+                ei = self.egginst('2.0', tx)
+                ei.entry_points = fail
+                ei.install()
+        except IOError:
+            pass
+        else:
+            self.fail("IOError not raised")
+        self.assertEqual(tree(self.prefix), self.before)
+        self.assertFalse(isfile(join(self.sp, 'foo', 'new.py')))
+        self.assert_no_tx()
+
+    def test_post_egginst_fails(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        try:
+            with tx:
+                self.egginst('1.0', tx).remove()
+                self.egginst('3.0', tx).install()
+        except subprocess.CalledProcessError:
+            pass
+        else:
+            self.fail("CalledProcessError not raised")
+        self.assertEqual(tree(self.prefix), self.before)
+        self.assert_no_tx()
+
+    def test_recover_truncated(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        self.egginst('1.0', tx).remove()
+        # the process is killed while writing an entry
+        tx.close()
+        open(tx.journal_path, 'a').write('backup\t99')
+        self.assertEqual(journal.recover(self.prefix), ['foo'])
+        self.assertEqual(tree(self.prefix), self.before)
+        self.assert_no_tx()
+
+    def test_recover_interrupted(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        self.egginst('1.0', tx).remove()
+        ei = self.egginst('2.0', tx)
+        ei.entry_points = fail
+        self.assertRaises(IOError, ei.install)
+        # the process is killed, i.e. there is no rollback
+        tx.close()
+        self.assertNotEqual(tree(self.prefix), self.before)
+
+        self.assertEqual(journal.recover(self.prefix), ['foo'])
+        self.assertEqual(tree(self.prefix), self.before)
+        self.assertEqual(journal.recover(self.prefix), [])
+
+    def test_recover_committed(self):
+        tx = journal.Transaction(self.prefix, 'foo')
+        self.egginst('1.0', tx).remove()
+        self.egginst('2.0', tx).install()
+        # the process is killed after the commit, before the cleanup
+        tx.log('commit')
+        tx.close()
+        after = tree(self.prefix)
+        self.assertEqual(journal.recover(self.prefix), ['foo'])
+        after = dict((k, v) for k, v in after.iteritems()
+                     if not k.startswith(journal.TX_PREFIX))
+        self.assertEqual(tree(self.prefix), after)
+        self.assertEqual(list(egginst.get_installed(self.prefix)),
+                         ['foo-2.0-1.egg'])
+        self.assert_no_tx()
+
+    def test_commit_staged_twice(self):
+        path = join(self.sp, 'foo', 'new.py')
+        with journal.Transaction(self.prefix, 'foo') as tx:
+            open(tx.stage_path(path), 'w').write('new = True\n')
+            tx.commit_staged([path, path])
+            self.assertEqual([e[0] for e in tx.entries()].count('new'), 1)
+        self.assertEqual(open(path).read(), 'new = True\n')
+        self.assert_no_tx()
+
+    def test_concurrent_new_dir(self):
+        # both transactions find the directory missing, but the second one
+        # must not overwrite the file written by the first one without
+        # backing it up
+        lock = threading.Lock()
+        path = join(self.sp, 'bar', 'common.py')
+        tx1 = journal.Transaction(self.prefix, 'bar', lock=lock)
+        tx2 = journal.Transaction(self.prefix, 'baz', lock=lock)
+        for tx, data in [(tx1, 'bar\n'), (tx2, 'baz\n')]:
+            open(tx.stage_path(path), 'w').write(data)
+            self.assertTrue(tx.dirs.is_new(path))
+        tx1.commit_staged([path])
+        tx1.commit()
+        tx2.commit_staged([path])
+        self.assertEqual(open(path).read(), 'baz\n')
+        tx2.rollback()
+        self.assertEqual(open(path).read(), 'bar\n')
+        self.assert_no_tx()
+
+    def test_remove(self):
+        self.egginst('1.0').remove()
+        self.assertFalse(isdir(join(self.sp, 'foo')))
+        self.assertEqual(list(egginst.get_installed(self.prefix)), [])
+        self.assert_no_tx()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from os.path import join
+
+from enstaller import localrepo
+
+
+HISTORY = """\
+==> 2011-08-01 21:17:22 CDT <==
+a-1.0-1.egg
+b-1.0-1.egg
+==> 2011-08-01 22:38:37 CDT <==
+-a-1.0-1.egg
++a-1.1-1.egg
+==> 2011-08-01 23:05:07 CDT <==
+-b-1.0-1.egg
++b-1.1-1.egg
+"""
+
+
+class TestCollect(unittest.TestCase):
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        open(join(self.prefix, 'enpkg.hist'), 'w').write(HISTORY)
+        self.egg_dir = join(self.prefix, 'LOCAL-REPO')
+        os.mkdir(self.egg_dir)
+        for i, fn in enumerate(['a-1.0-1.egg', 'a-1.1-1.egg', 'b-1.0-1.egg',
+                                'b-1.1-1.egg', 'c-1.0-1.egg', 'd-1.0-1.egg']):
+            path = join(self.egg_dir, fn)
+            open(path, 'wb').write(100 * 'x')
+            os.utime(path, (1000 + i, 1000 + i))
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def test_referenced(self):
+        self.assertEqual(localrepo.referenced_eggs(self.prefix, 1),
+                         set(['a-1.1-1.egg', 'b-1.1-1.egg']))
+        self.assertEqual(localrepo.referenced_eggs(self.prefix, 2),
+                         set(['a-1.1-1.egg', 'b-1.0-1.egg', 'b-1.1-1.egg']))
+
+    def test_collect_all(self):
+        removed, reclaimed = localrepo.collect(self.egg_dir, self.prefix, 2)
+        self.assertEqual(sorted(removed),
+                         ['a-1.0-1.egg', 'c-1.0-1.egg', 'd-1.0-1.egg'])
+        self.assertEqual(reclaimed, 300)
+        self.assertEqual(sorted(fn for fn in os.listdir(self.egg_dir)
+                                if fn.endswith('.egg')),
+                         ['a-1.1-1.egg', 'b-1.0-1.egg', 'b-1.1-1.egg'])
+
+    def test_collect_budget(self):
+        # c was used recently, so a and d are removed first
+        localrepo.touch(self.egg_dir, ['c-1.0-1.egg'])
+        removed, reclaimed = localrepo.collect(self.egg_dir, self.prefix, 1,
+                                               max_size=350)
+        self.assertEqual(removed, ['a-1.0-1.egg', 'b-1.0-1.egg',
+                                   'd-1.0-1.egg'])
+        self.assertEqual(reclaimed, 300)
+
+    def test_touch_threads(self):
+        errors = []
+        def touch(i):
+            try:
+                for j in xrange(50):
+                    localrepo.touch(self.egg_dir, ['t%d-%d.egg' % (i, j)])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=touch, args=(i,))
+                   for i in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(localrepo.AccessIndex(self.egg_dir).times), 200)
+        self.assertEqual([fn for fn in os.listdir(self.egg_dir)
+                          if fn.endswith('.part')], [])
+
+    def test_dry_run(self):
+        removed, reclaimed = localrepo.collect(self.egg_dir, self.prefix, 1,
+                                               dry_run=True)
+        self.assertEqual(len(removed), 4)
+        self.assertEqual(len(os.listdir(self.egg_dir)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
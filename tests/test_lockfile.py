@@ -0,0 +1,210 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import zipfile
+from os.path import isfile, join
+
+from egginst.main import EggInst
+from enstaller import lockfile
+from enstaller.indexed_repo import Chain, Req
+from enstaller.utils import md5_file
+
+
+SPEC = """\
+metadata_version = '1.1'
+name = %(name)r
+version = %(version)r
+build = 1
+
+arch = None
+platform = None
+osdist = None
+python = None
+packages = %(packages)r
+"""
+
+
+def noop(*args):
+    pass
+
+
+def make_egg(repo_dir, fn, packages=[]):
+    name, version, build = fn[:-4].split('-')
+    path = join(repo_dir, fn)
+    z = zipfile.ZipFile(path, 'w')
+    z.writestr('%s/__init__.py' % name, '')
+    z.writestr('EGG-INFO/spec/depend', SPEC % dict(name=name,
+                                                   version=version,
+                                                   packages=packages))
+    z.close()
+    return path
+
+
+class Transaction(object):
+
+    def __init__(self, log, eggname):
+        self.log = log
+        self.eggname = eggname
+
+    def __enter__(self):
+        self.log.append(('begin', self.eggname))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.log.append(('commit', self.eggname))
+
+
+class Events(object):
+
+    def action(self, eggname, action):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Enstaller(object):
+    """
+    records what lockfile.install does, instead of installing and removing
+    """
+    dry_run = False
+
+    def __init__(self, prefix, chain, deps={}):
+        self.prefixes = [prefix]
+        self.chain = chain
+        self.deps = deps
+        self.egg_dir = join(prefix, 'LOCAL-REPO')
+        self.events = Events()
+        self.log = []
+
+    def get_dependencies(self):
+        return self.deps
+
+    def recover(self):
+        self.log.append(('recover',))
+
+    def transaction(self, eggname):
+        return Transaction(self.log, eggname)
+
+    def remove_egg(self, eggname, tx=None):
+        self.assert_tx(tx, eggname)
+        self.log.append(('remove', eggname))
+
+    def remove_installed(self, eggname, tx=None):
+        self.assert_tx(tx, eggname)
+        self.log.append(('remove_installed', eggname))
+
+    def install_egg(self, dist, tx=None):
+        eggname = dist.split('/')[-1]
+        self.assert_tx(tx, eggname)
+        self.log.append(('install', eggname))
+
+    def assert_tx(self, tx, eggname):
+        assert tx is not None and tx.eggname == eggname
+
+
+class TestLockfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_dir = join(self.tmp_dir, 'repo')
+        os.mkdir(self.repo_dir)
+        self.entries = []
+        for fn, data in [('foo-1.0-1.egg', 'foo data'),
+                         ('bar-2.1-3.egg', 'bar data' * 10000)]:
+            open(join(self.repo_dir, fn), 'wb').write(data)
+            self.entries.append(('file://%s/%s' % (self.repo_dir, fn),
+                                 hashlib.md5(data).hexdigest(), len(data)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_read(self):
+        path = join(self.tmp_dir, 'env.lock')
+        lockfile.write(path, self.entries)
+        self.assertEqual(lockfile.read(path), self.entries)
+
+    def test_read_invalid(self):
+        path = join(self.tmp_dir, 'env.lock')
+        for line in ['file:///foo-1.0-1.egg 1234 10',
+                     'file:///foo-1.0-1.egg %s' % (32 * 'a'),
+                     'file:///foo.egg %s 10' % (32 * 'a')]:
+            open(path, 'w').write('# comment\n%s\n' % line)
+            self.assertRaises(lockfile.LockfileError, lockfile.read, path)
+
+    def test_fetch(self):
+        fetch_dir = join(self.tmp_dir, 'fetch')
+        fetched = []
+        lockfile.fetch(self.entries, fetch_dir, 2,
+                       lambda fn, action: fetched.append(fn))
+        self.assertEqual(sorted(fetched), ['bar-2.1-3.egg', 'foo-1.0-1.egg'])
+        for fn in fetched:
+            self.assert_(isfile(join(fetch_dir, fn)))
+
+        # existing eggs are not fetched again
+        del fetched[:]
+        lockfile.fetch(self.entries, fetch_dir, 2,
+                       lambda fn, action: fetched.append(fn))
+        self.assertEqual(fetched, [])
+
+    def test_fetch_md5_mismatch(self):
+        fetch_dir = join(self.tmp_dir, 'fetch')
+        url, md5, size = self.entries[0]
+        self.assertRaises(lockfile.LockfileError, lockfile.fetch,
+                          [(url, 32 * '0', size)], fetch_dir)
+        self.assertEqual(os.listdir(fetch_dir), [])
+
+    def test_export_without_repo(self):
+        repo_dir = join(self.tmp_dir, 'repo2')
+        os.mkdir(repo_dir)
+        path = make_egg(repo_dir, 'baz-1.0-1.egg')
+        # installed by egginst, i.e. without __enpkg__.txt
+        prefix = join(self.tmp_dir, 'prefix')
+        ei = EggInst(path, prefix)
+        ei.progress_callback = noop
+        ei.install()
+
+        chain = Chain(['file://%s/' % repo_dir],
+                      file_action_callback=noop)
+        lock_path = join(self.tmp_dir, 'env.lock')
+        entries = lockfile.export(Enstaller(prefix, chain), lock_path)
+        self.assertEqual(entries, [('file://%s/baz-1.0-1.egg' % repo_dir,
+                                    md5_file(path),
+                                    os.path.getsize(path))])
+        self.assertEqual(lockfile.read(lock_path), entries)
+
+    def test_install(self):
+        repo_dir = join(self.tmp_dir, 'repo2')
+        os.mkdir(repo_dir)
+        prefix = join(self.tmp_dir, 'prefix')
+        for fn in 'a-1.0-1.egg', 'b-1.0-1.egg', 'c-1.0-1.egg':
+            ei = EggInst(make_egg(repo_dir, fn), prefix)
+            ei.progress_callback = noop
+            ei.install()
+        path = make_egg(repo_dir, 'c-2.0-1.egg')
+        lock_path = join(self.tmp_dir, 'env.lock')
+        lockfile.write(lock_path, [('file://' + path, md5_file(path),
+                                    os.path.getsize(path))])
+
+        # a depends on b
+        enst = Enstaller(prefix, Chain(), {'a': {'Reqs': [Req('b')]}})
+        lockfile.install(enst, lock_path)
+        self.assertEqual(enst.log, [
+                ('recover',),
+                # dependents are removed first, in their own transactions
+                ('begin', 'a-1.0-1.egg'), ('remove', 'a-1.0-1.egg'),
+                ('commit', 'a-1.0-1.egg'),
+                ('begin', 'b-1.0-1.egg'), ('remove', 'b-1.0-1.egg'),
+                ('commit', 'b-1.0-1.egg'),
+                # c is upgraded within one transaction
+                ('begin', 'c-2.0-1.egg'),
+                ('remove_installed', 'c-2.0-1.egg'),
+                ('install', 'c-2.0-1.egg'),
+                ('commit', 'c-2.0-1.egg')])
+        self.assert_(isfile(join(enst.egg_dir, 'c-2.0-1.egg')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from os.path import isfile, join
+
+from egginst import registry
+from egginst.main import EggInst
+from egginst.utils import rel_site_packages
+
+
+class TestCompiled(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src = join(self.tmp_dir, 'registry.txt')
+        self.dst = join(self.tmp_dir, 'registry.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup(self):
+        names = ['a', 'a.b', 'ab', 'b_c', 'zzz'] + ['m%d' % i
+                                                    for i in range(100)]
+        fo = open(self.src, 'w')
+        fo.write('# pkg: foo-1.0-1\n')
+        for name in names:
+            fo.write('%s  /pkgs/%s\n' % (name, name))
+        fo.write('-pth-  /pkgs/foo-1.0-1/x y\n')
+        fo.write('a  /pkgs/other\n')
+        fo.close()
+        registry.compile_file(self.src, self.dst)
+
+        finder = registry.RegistryFinder(self.dst)
+        for name in names:
+            self.assertEqual(finder.lookup(name), '/pkgs/' + name)
+        for name in ['', 'a.', 'aa', 'b', 'm100', 'zzzz', '-pth-']:
+            self.assertEqual(finder.lookup(name), None)
+        self.assertEqual(finder.pth_paths(), ['/pkgs/foo-1.0-1/x y'])
+
+    def test_empty(self):
+        open(self.src, 'w').close()
+        registry.compile_file(self.src, self.dst)
+        finder = registry.RegistryFinder(self.dst)
+        self.assertEqual(finder.lookup('a'), None)
+        self.assertEqual(finder.pth_paths(), [])
+
+    def test_import(self):
+        pkg_dir = join(self.tmp_dir, 'pkgs', 'spam-1.0-1')
+        os.makedirs(join(pkg_dir, 'spampkg'))
+        open(join(pkg_dir, 'spampkg', '__init__.py'), 'w').write('x = 1\n')
+        open(join(pkg_dir, 'spammod.py'), 'w').write('y = 2\n')
+        reg, pth = registry.create_hooks_dir(pkg_dir)
+        fo = open(self.src, 'w')
+        for kv in reg.iteritems():
+            fo.write('%s  %s\n' % kv)
+        fo.close()
+        registry.compile_file(self.src, self.dst)
+
+        finder = registry.install_finder(self.dst)
+        try:
+            import spampkg
+            import spammod
+            self.assertEqual((spampkg.x, spammod.y), (1, 2))
+        finally:
+            sys.meta_path.remove(finder)
+            for name in 'spampkg', 'spammod':
+                sys.modules.pop(name, None)
+
+
+class TestCreateHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_files_as_walk(self):
+        egg_path = join(self.tmp_dir, 'foo-1.0-1.egg')
+        z = zipfile.ZipFile(egg_path, 'w')
+        for arcname, data in [
+            ('foo/__init__.py', ''),
+            ('foo/bar.py', ''),
+            ('mod1.py', ''),
+            ('mod1.pyc', ''),
+            ('mod2.so', ''),
+            ('mod2.py', ''),
+            ('ns/__init__.py', "__import__('pkg_resources')"
+                               ".declare_namespace(__name__)\n"),
+            ('ns/__init__.pyc', ''),
+            ('ns/sub/__init__.py', ''),
+            ('ns/sub/x.py', ''),
+            ('ns/ns2/__init__.py', ''),
+            ('ns/ns2/deep/__init__.py', ''),
+            ('ns/ns2/deep/y.py', ''),
+            ('foo.pth', 'lib\n# comment\n'),
+            ('lib/z.py', ''),
+            ('some-dir/a.py', ''),
+            ('bad-name.py', ''),
+            ('data/readme.txt', ''),
+            ('EGG-INFO/spec/depend', "name = 'foo'\n"),
+            ('EGG-INFO/scripts/foo', '#!/usr/bin/python\n'),
+            ]:
+            z.writestr(arcname, data)
+        z.close()
+
+        ei = EggInst(egg_path, join(self.tmp_dir, 'prefix'), hook=True)
+        ei.progress_callback = lambda *args: None
+        ei.install()
+
+        reg1, pth1 = registry.create_hooks_dir(ei.pkg_dir)
+        reg2, pth2 = registry.create_hooks_files(ei.pkg_dir,
+                                                 ei.files + [ei.meta_txt])
+        self.assertEqual(reg1, reg2)
+        self.assertEqual(pth1, pth2)
+        self.assert_('ns.ns2.deep' in reg1)
+        self.assertEqual(pth1, [join(ei.pkg_dir, 'lib')])
+
+    def test_post_egginst_as_walk(self):
+        egg_path = join(self.tmp_dir, 'foo-1.0-1.egg')
+        z = zipfile.ZipFile(egg_path, 'w')
+        z.writestr('empty/', '')
+        z.writestr('foo/__init__.py', '')
+        z.writestr('EGG-INFO/spec/depend', "name = 'foo'\n")
+        # the install script creates a module, and an (empty) package
+        # directory, in the package directory
+        z.writestr('EGG-INFO/post_egginst.py', """\
+import os
+pkg_dir = os.path.dirname(os.getcwd())
+os.mkdir(os.path.join(pkg_dir, 'gen'))
+open(os.path.join(pkg_dir, 'genmod.py'), 'w').close()
+""")
+        z.close()
+
+        ei = EggInst(egg_path, join(self.tmp_dir, 'prefix'), hook=True)
+        ei.progress_callback = lambda *args: None
+        ei.install()
+
+        reg, pth = registry.create_hooks_dir(ei.pkg_dir)
+        self.assertEqual(sorted(reg), ['foo', 'gen', 'genmod'])
+        lines = [line.split(None, 1)
+                 for line in registry.stripped_lines(ei.registry_txt)]
+        self.assertEqual(dict(lines), reg)
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.prefix = join(self.tmp_dir, 'prefix')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_import(self):
+        egg_path = join(self.tmp_dir, 'spam-1.0-1.egg')
+        z = zipfile.ZipFile(egg_path, 'w')
+        z.writestr('spampkg/__init__.py', 'x = 1\n')
+        z.writestr('EGG-INFO/spec/depend', "name = 'spam'\n")
+        z.close()
+        ei = EggInst(egg_path, self.prefix, hook=True)
+        ei.progress_callback = lambda *args: None
+        ei.install()
+
+        sp = join(self.prefix, rel_site_packages)
+        pth_path = join(sp, registry.PTH_NAME)
+        self.assert_(isfile(pth_path))
+        # a new interpreter, in which the site-packages directory of the
+        # prefix is processed like at startup, imports the hooked package
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        code = ('import site; site.addsitedir(%r); import spampkg; '
+                'print spampkg.x, spampkg.__file__' % sp)
+        out = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(out.split(), ['1', join(ei.pkg_dir, 'spampkg',
+                                                 '__init__.py')])
+
+        ei = EggInst(egg_path, self.prefix, hook=True)
+        ei.progress_callback = lambda *args: None
+        ei.remove()
+        self.assertFalse(isfile(pth_path))
+        self.assertFalse(isfile(join(self.prefix, 'pkgs', 'registry.bin')))
+
+
+if __name__ == '__main__':
+    unittest.main()
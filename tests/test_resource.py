@@ -0,0 +1,157 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from os.path import join
+
+from enstaller.indexed_repo import Req
+from enstaller.plat import custom_plat
+from enstaller.resource import Resources
+
+
+def product_index(name, n):
+    files = dict(('%s-1.%d-1.egg' % (name, i), {'depends': []})
+                 for i in xrange(n))
+    return {'eggs': {name: {'name': name, 'files': files}}}
+
+
+PAGES = {
+    '/products': [{'product': 'p%d' % i} for i in xrange(10)],
+}
+for i in xrange(10):
+    # odd products only have a platform specific index
+    fn = 'index-%s.json' % custom_plat if i % 2 else 'index.json'
+    PAGES['/products/p%d/%s' % (i, fn)] = product_index('egg%d' % i, i + 1)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path not in PAGES:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%s"' % abs(hash(self.path))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = json.dumps(PAGES[self.path])
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        self.server = Server(('127.0.0.1', 0), Handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        del Handler.requests[:]
+        self.resources = []
+
+    def tearDown(self):
+        # close the keep-alive connections, such that the handler threads
+        # finish before the server goes away
+        for r in self.resources:
+            r.connections.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.prefix)
+
+    def make_resources(self, **kwds):
+        r = Resources(prefix=self.prefix, **kwds)
+        self.resources.append(r)
+        return r
+
+    def test_load_index(self):
+        r = self.make_resources()
+        r.authenticate = False
+        r.load_index(self.url)
+        # the products are merged in the order of the products file
+        self.assertEqual([index['product'] for index in r.index],
+                         ['p%d' % i for i in xrange(10)])
+        self.assertEqual(len(r.enst.chain.index), 55)
+        self.assertEqual(r.enst.chain.get_dist(Req('egg9')),
+                         '%sproducts/p9/egg9-1.9-1.egg' % self.url)
+        self.assertEqual(r.search('EGG9'), ['egg9'])
+        self.assertEqual(r.search('egg'), ['egg%d' % i for i in xrange(10)])
+
+    def test_cache(self):
+        r = self.make_resources()
+        r.authenticate = False
+        r.load_index(self.url)
+        first = sorted(Handler.requests)
+        del Handler.requests[:]
+
+        r = self.make_resources()
+        r.authenticate = False
+        r.load_index(self.url)
+        # the platform independent index is not tried again for products
+        # which only have a platform specific one
+        self.assertEqual(len(Handler.requests), 11)
+        self.assert_(len(first) > 11)
+        self.assertEqual(len(r.enst.chain.index), 55)
+
+    def test_urls(self):
+        r = self.make_resources(urls=[self.url + 'products/p3/',
+                                      self.url + 'products/p0'])
+        self.assertEqual([index['url'] for index in r.index],
+                         [self.url + 'products/p3', self.url + 'products/p0'])
+
+    def fake_install(self, cname, egg_name):
+        meta_dir = join(self.prefix, 'EGG-INFO', cname)
+        if not os.path.isdir(meta_dir):
+            os.makedirs(meta_dir)
+        open(join(meta_dir, '__egginst__.txt'), 'w').write(
+            'egg_name = %r\n' % egg_name)
+
+    def test_status(self):
+        self.fake_install('egg1', 'egg1-1.0-1.egg')
+        self.fake_install('other', 'other-2.0-1.egg')
+        r = self.make_resources()
+        r.authenticate = False
+        r.load_index(self.url)
+        status = r.get_status()
+        self.assertEqual(len(status), 11)
+        self.assertEqual(status['egg0']['status'], 'installable')
+        self.assertEqual(status['egg1']['status'], 'updateable')
+        self.assertEqual(status['other']['status'], 'installed')
+
+        # only the packages which changed are recomputed
+        computed = []
+        status_entry = r._status_entry
+        def spy(cname):
+            computed.append(cname)
+            return status_entry(cname)
+        r._status_entry = spy
+        r._installed_changes(self.fake_install, 'egg1', 'egg1-1.1-1.egg')
+        self.assertEqual(computed, ['egg1'])
+        self.assertEqual(r.get_status()['egg1']['status'], 'up-to-date')
+        self.assert_('egg1-1.1-1.egg' in r.get_installed())
+
+
+if __name__ == '__main__':
+    unittest.main()
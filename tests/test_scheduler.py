@@ -0,0 +1,234 @@
+import time
+import threading
+import unittest
+
+from enstaller.events import EventStream
+from enstaller.indexed_repo import Req
+from enstaller.scheduler import Scheduler, install_pipelined
+
+
+def interrupt(self):
+    raise KeyboardInterrupt
+
+
+class Recorder(object):
+    """
+    records the start and end of tasks, and the maximal number of tasks
+    running at the same time (for each stage)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.log = []
+        self.running = {}
+        self.max_running = {}
+
+    def task(self, stage, name, delay=0.01, error=None):
+        def func():
+            with self.lock:
+                self.log.append(('start', stage, name))
+                n = self.running[stage] = self.running.get(stage, 0) + 1
+                self.max_running[stage] = max(
+                    n, self.max_running.get(stage, 0))
+            time.sleep(delay)
+            with self.lock:
+                self.running[stage] -= 1
+                self.log.append(('end', stage, name))
+            if error:
+                raise error
+        return func
+
+    def index(self, event, stage, name):
+        return self.log.index((event, stage, name))
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_dependencies(self):
+        r = Recorder()
+        s = Scheduler(dict(a=4))
+        t1 = s.add('a', '1', r.task('a', '1'))
+        t2 = s.add('a', '2', r.task('a', '2'), [t1])
+        s.add('a', '3', r.task('a', '3'), [t1, t2])
+        s.add('a', '4', r.task('a', '4'))
+        s.run()
+        self.assert_(r.index('end', 'a', '1') < r.index('start', 'a', '2'))
+        self.assert_(r.index('end', 'a', '2') < r.index('start', 'a', '3'))
+        # 4 does not depend on anything, and runs together with 1
+        self.assert_(r.index('start', 'a', '4') < r.index('end', 'a', '1'))
+        self.assertEqual([t.state for t in s.tasks], 4 * ['done'])
+
+    def test_limits(self):
+        r = Recorder()
+        s = Scheduler(dict(a=2, b=1))
+        for i in xrange(6):
+            s.add('a', str(i), r.task('a', str(i)))
+            s.add('b', str(i), r.task('b', str(i)))
+        s.run()
+        self.assertEqual(r.max_running, dict(a=2, b=1))
+
+    def test_conflicts(self):
+        r = Recorder()
+        s = Scheduler(dict(a=3, b=3), conflicts=[('a', 'b')])
+        for i in xrange(3):
+            s.add('a', str(i), r.task('a', str(i)))
+            s.add('b', str(i), r.task('b', str(i)))
+        s.run()
+        running = dict(a=0, b=0)
+        for event, stage, name in r.log:
+            running[stage] += 1 if event == 'start' else -1
+            self.assertFalse(running['a'] and running['b'])
+
+    def test_failure(self):
+        r = Recorder()
+        s = Scheduler(dict(a=3))
+        t1 = s.add('a', '1', r.task('a', '1', 0.05, ValueError('1')))
+        t2 = s.add('a', '2', r.task('a', '2', 0.0, KeyError('2')))
+        t3 = s.add('a', '3', r.task('a', '3'), [t2])
+        t4 = s.add('a', '4', r.task('a', '4', 0.05))
+        # although 2 fails first, the error of 1 (in order) is raised
+        self.assertRaises(ValueError, s.run)
+        self.assertEqual([t1.state, t2.state, t3.state, t4.state],
+                         ['failed', 'failed', 'skipped', 'done'])
+
+    def test_interrupt(self):
+        r = Recorder()
+        s = Scheduler(dict(a=2))
+        t1 = s.add('a', '1', r.task('a', '1', 0.1))
+        t2 = s.add('a', '2', r.task('a', '2'), [t1])
+        # Ctrl-C while waiting for the tasks
+        s._wait = lambda: interrupt(s)
+        self.assertRaises(KeyboardInterrupt, s.run)
+        # the running task was finished first
+        self.assertEqual(r.log, [('start', 'a', '1'), ('end', 'a', '1')])
+        self.assertEqual([t1.state, t2.state], ['done', 'skipped'])
+
+
+class Chain(object):
+
+    def __init__(self, depends):
+        self.depends = depends
+        self.fetched = []
+
+    def reqs_dist(self, dist):
+        return [Req(name) for name in self.depends[dist]]
+
+    def fetch_dist(self, dist, fetch_dir, check_md5=False, dry_run=False,
+                   progress_callback=None):
+        self.fetched.append(dist)
+
+
+class Transaction(object):
+
+    def __init__(self, log, eggname):
+        self.log = log
+        self.eggname = eggname
+        self.state = None
+
+    def commit(self):
+        self.state = 'committed'
+
+    def rollback(self):
+        assert self.state is None
+        self.state = 'rolled back'
+        self.log.append(('rollback', self.eggname))
+
+
+class Enstaller(object):
+
+    def __init__(self, chain, installed):
+        self.chain = chain
+        self.egg_dir = '/LOCAL-REPO'
+        self.dry_run = False
+        self.jobs = 3
+        self.events = EventStream()
+        self.installed = installed
+        self.log = []
+        self.txs = {}
+
+    def get_installed_info(self, cname):
+        return [(None, self.installed.get(cname))]
+
+    def transaction(self, eggname, lock=None):
+        return self.txs.setdefault(eggname, Transaction(self.log, eggname))
+
+    def remove_installed(self, eggname, tx):
+        self.log.append(('remove', eggname))
+
+    def install_egg(self, dist, tx):
+        if dist.endswith('bad-1.0-1.egg'):
+            raise IOError('No space left on device')
+        if dist.endswith('slow-1.0-1.egg'):
+            time.sleep(0.1)
+        self.log.append(('install', dist.split('/')[-1]))
+
+
+class TestInstallPipelined(unittest.TestCase):
+
+    def test_order(self):
+        repo = 'http://example.com/repo/'
+        chain = Chain({repo + 'c-1.0-1.egg': [],
+                       repo + 'b-1.0-1.egg': ['c'],
+                       repo + 'a-1.0-1.egg': ['b', 'c'],
+                       repo + 'd-1.0-1.egg': []})
+        dists = [repo + fn for fn in ['c-1.0-1.egg', 'd-1.0-1.egg',
+                                      'b-1.0-1.egg', 'a-1.0-1.egg']]
+        enst = Enstaller(chain, {'b': {'egg_name': 'b-0.9-1.egg'}})
+        self.assertEqual(install_pipelined(enst, dists), 4)
+        self.assertEqual(sorted(chain.fetched), sorted(dists))
+
+        log = enst.log
+        # only b has an installed version which is removed
+        self.assertEqual([x for x in log if x[0] == 'remove'],
+                         [('remove', 'b-1.0-1.egg')])
+        self.assert_(log.index(('install', 'c-1.0-1.egg')) <
+                     log.index(('remove', 'b-1.0-1.egg')) <
+                     log.index(('install', 'b-1.0-1.egg')) <
+                     log.index(('install', 'a-1.0-1.egg')))
+        self.assertEqual(set(tx.state for tx in enst.txs.itervalues()),
+                         set(['committed']))
+
+    def test_failure(self):
+        repo = 'http://example.com/repo/'
+        chain = Chain({repo + 'bad-1.0-1.egg': [],
+                       repo + 'a-1.0-1.egg': ['bad'],
+                       repo + 'd-1.0-1.egg': []})
+        dists = [repo + fn for fn in ['bad-1.0-1.egg', 'd-1.0-1.egg',
+                                      'a-1.0-1.egg']]
+        enst = Enstaller(chain, {'a': {'egg_name': 'a-0.9-1.egg'}})
+        self.assertRaises(IOError, install_pipelined, enst, dists)
+        # a was not removed, as its dependency failed to install
+        self.assertEqual(sorted(enst.log),
+                         [('install', 'd-1.0-1.egg'),
+                          ('rollback', 'a-1.0-1.egg'),
+                          ('rollback', 'bad-1.0-1.egg')])
+        self.assertEqual(enst.txs['d-1.0-1.egg'].state, 'committed')
+        self.assertEqual(enst.txs['bad-1.0-1.egg'].state, 'rolled back')
+        self.assertEqual(enst.txs['a-1.0-1.egg'].state, 'rolled back')
+
+    def test_interrupt(self):
+        repo = 'http://example.com/repo/'
+        chain = Chain({repo + 'slow-1.0-1.egg': [],
+                       repo + 'a-1.0-1.egg': ['slow']})
+        dists = [repo + 'slow-1.0-1.egg', repo + 'a-1.0-1.egg']
+        enst = Enstaller(chain, {})
+        wait = Scheduler._wait
+        def interrupt_install(sched):
+            # Ctrl-C while slow is being installed
+            if sched.running['install']:
+                raise KeyboardInterrupt
+            return wait(sched)
+        Scheduler._wait = interrupt_install
+        try:
+            self.assertRaises(KeyboardInterrupt, install_pipelined, enst,
+                              dists)
+        finally:
+            Scheduler._wait = wait
+        # the transactions are rolled back only once the running install
+        # is finished, and the committed one is left alone
+        self.assertEqual(enst.log, [('install', 'slow-1.0-1.egg'),
+                                    ('rollback', 'a-1.0-1.egg')])
+        self.assertEqual(enst.txs['slow-1.0-1.egg'].state, 'committed')
+
+
+if __name__ == '__main__':
+    unittest.main()
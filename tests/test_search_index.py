@@ -0,0 +1,61 @@
+import unittest
+
+from enstaller.search_index import SearchIndex, tokenize
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    docs = [
+        ('numpy', 'NumPy', 'Array processing for numbers, strings, records'),
+        ('scipy', 'SciPy', 'Scientific tools for Python, based on NumPy'),
+        ('numexpr', 'numexpr', 'Fast numerical array expression evaluator'),
+        ('pil', 'PIL', 'Python Imaging Library'),
+        ('pyparsing', 'pyparsing', 'General parsing module'),
+        ('nose', 'nose', None),
+    ]
+
+    def setUp(self):
+        self.si = SearchIndex()
+        for cname, name, description in self.docs:
+            self.si.add(cname, name, description)
+
+    def scan(self, text):
+        # the result of searching without index
+        text = text.lower()
+        return set(cname for cname, name, description in self.docs
+                   if text in name.lower() or
+                      text in (description or '').lower())
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Fast numerical-array, (Expr)'),
+                         set(['fast', 'numerical', 'array', 'expr']))
+
+    def test_same_as_scan(self):
+        for text in ['', 'n', 'num', 'NUMPY', 'py', 'array', 'rray',
+                     'based on num', 'on, n', 'r e', 'tools for', ', ',
+                     'imaging lib', 'xyz', 'parsing mod', 'g m']:
+            res = self.si.search(text)
+            self.assertEqual(len(res), len(set(res)))
+            self.assertEqual(set(res), self.scan(text), text)
+
+    def test_rank(self):
+        self.assertEqual(self.si.search('numpy'), ['numpy', 'scipy'])
+        self.assertEqual(self.si.search('num'),
+                         ['numexpr', 'numpy', 'scipy'])
+        self.assertEqual(self.si.search('py'),
+                         ['pyparsing', 'numpy', 'scipy', 'pil'])
+        self.assertEqual(self.si.search('parsing'),
+                         ['pyparsing'])
+
+    def test_update(self):
+        self.si.add('nose', 'nose', 'Unit testing framework')
+        self.assertEqual(self.si.search('testing'), ['nose'])
+        self.si.add('nose', 'nose', 'Test discovery')
+        self.assertEqual(self.si.search('testing'), [])
+        self.si.remove('nose')
+        self.assertEqual(self.si.search('nose'), [])
+        self.assertEqual(len(self.si), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from os.path import join
+
+from egginst import timing
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+
+    def test_timed(self):
+        @timing.timed('foo')
+        def foo(x):
+            time.sleep(0.01)
+            return x + 1
+
+        self.assertEqual(foo(1), 2)
+        self.assertEqual(foo.__name__, 'foo')
+        with timing.timed('foo.bar'):
+            foo(2)
+        timing.count('foo.n', 3)
+        timing.count('foo.n')
+
+        rep = timing.report()
+        self.assertEqual(rep['phases']['foo']['calls'], 2)
+        self.assertEqual(rep['phases']['foo.bar']['calls'], 1)
+        self.assert_(rep['phases']['foo']['seconds'] >= 0.02)
+        self.assert_(rep['total'] >= rep['phases']['foo']['seconds'])
+        self.assertEqual(rep['counters'], {'foo.n': 4})
+
+        fo = StringIO()
+        timing.print_report(fo)
+        self.assert_('\n  bar ' in fo.getvalue())
+
+    def test_exception(self):
+        try:
+            with timing.timed('err'):
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(timing.report()['phases']['err']['calls'], 1)
+
+    def test_json(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with timing.timed('x'):
+                pass
+            path = join(tmp_dir, 'profile.json')
+            timing.write_json(path)
+            self.assertEqual(json.load(open(path))['phases']['x']['calls'], 1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,25 @@
+"""
+State of the enpkg server, which lives as long as the server process:
+
+  * StatusCache holds the Chain (built from the IndexedRepos in the config
+    file) and the installed packages, and computes the status of all
+    packages from these.  The Chain is rebuilt in a background thread
+    (periodically, or when requested), and the installed packages are
+    only rescanned when the EGG-INFO directory changed (or after a job).
+    Requests are always answered from the last computed status.
+
+  * JobQueue runs enpkg commands, one at a time, in a worker thread, such
+    that requests never wait for an install to finish.  The output of
+    each job is collected, and can be polled by the clients.
+"""
+import os
 import sys
+import time
+import threading
+import subprocess
+from Queue import Queue
 from collections import defaultdict
+from os.path import join
 
 import egginst
 
@@ -8,24 +28,49 @@ from enstaller.utils import get_installed_info, comparable_version
 import enstaller.config as config
 
 
-def get_status():
+def vb_egg(fn):
+    try:
+        n, v, b = dist_naming.split_eggname(fn)
+        return comparable_version(v), b
+    except:
+        return None
+
+
+def get_installed(prefix):
+    """
+    return a dict mapping the cnames of the installed packages to their
+    info dictionaries
+    """
+    res = {}
+    for cname in egginst.get_installed_cnames(prefix):
+        info = get_installed_info(prefix, cname)
+        if info is not None:
+            res[cname] = info
+    return res
+
+
+def get_available(c):
+    """
+    return a dict mapping the cnames of all packages in the chain to the
+    filename of the latest distribution
+    """
+    res = {}
+    for cname in c.groups.iterkeys():
+        dist = c.get_dist(Req(cname))
+        if dist is not None:
+            res[cname] = dist_naming.filename_dist(dist)
+    return res
+
+
+def get_status(installed, available):
     # the result is a dict mapping cname to ...
     res = {}
-    for cname in egginst.get_installed_cnames(sys.prefix):
+    for cname, info in installed.iteritems():
         d = defaultdict(str)
-        info = get_installed_info(sys.prefix, cname)
-        if info is None:
-            continue
         d.update(info)
         res[cname] = d
 
-    c = Chain(config.get('IndexedRepos'))
-
-    for cname in c.groups.iterkeys():
-        dist = c.get_dist(Req(cname))
-        if dist is None:
-            continue
-        repo, fn = dist_naming.split_dist(dist)
+    for cname, fn in available.iteritems():
         n, v, b = dist_naming.split_eggname(fn)
         if cname not in res:
             d = defaultdict(str)
@@ -34,13 +79,6 @@ def get_status():
         res[cname]['a-egg'] = fn
         res[cname]['a-ver'] = '%s-%d' % (v, b)
 
-    def vb_egg(fn):
-        try:
-            n, v, b = dist_naming.split_eggname(fn)
-            return comparable_version(v), b
-        except:
-            return None
-
     for d in res.itervalues():
         if d['egg_name']:                    # installed
             if d['a-egg']:
@@ -56,6 +94,148 @@ def get_status():
     return res
 
 
+class StatusCache(object):
+
+    def __init__(self, prefix=sys.prefix, repos=None, interval=600):
+        self.prefix = prefix
+        self.repos = repos
+        # seconds between rebuilding the chain in the background
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.installed = {}
+        self.available = {}
+        self.status = {}
+        # time at which the chain was last (re)built, None if never
+        self.refreshed = None
+        self.error = None
+        self._egg_info_mtime = None
+        self._wakeup = threading.Event()
+
+    def _egg_info_changed(self):
+        try:
+            mtime = os.stat(join(self.prefix, 'EGG-INFO')).st_mtime
+        except OSError:
+            mtime = None
+        changed = mtime != self._egg_info_mtime
+        self._egg_info_mtime = mtime
+        return changed
+
+    def update_installed(self, force=False):
+        """
+        rescan the installed packages, if the EGG-INFO directory changed
+        (an install changes the __egginst__.txt of an already installed
+        package, so callers which know about a change use force)
+        """
+        with self.lock:
+            if not (self._egg_info_changed() or force):
+                return
+            self.installed = get_installed(self.prefix)
+            self.status = get_status(self.installed, self.available)
+
+    def update_available(self):
+        """
+        rebuild the chain, which downloads and parses all indexes
+        (the last status is used while this is in progress)
+        """
+        repos = self.repos
+        if repos is None:
+            repos = config.get('IndexedRepos')
+        try:
+            available = get_available(Chain(repos))
+        except Exception as e:
+            self.error = '%s: %s' % (e.__class__.__name__, e)
+            return
+        with self.lock:
+            self.available = available
+            self.status = get_status(self.installed, self.available)
+            self.refreshed = time.time()
+            self.error = None
+
+    def get_status(self):
+        self.update_installed()
+        return self.status
+
+    def refresh(self):
+        """
+        request the background thread to rebuild the chain now
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self.update_installed(force=True)
+            self.update_available()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+
+class JobQueue(object):
+
+    def __init__(self, status_cache, cmd=['enpkg']):
+        self.status_cache = status_cache
+        self.cmd = cmd
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        # maps job ids to job dictionaries
+        self.jobs = {}
+
+    def submit(self, args):
+        """
+        add a job, running the enpkg command with the given arguments, and
+        return its job dictionary
+        """
+        with self.lock:
+            job = dict(id=len(self.jobs) + 1, args=list(args),
+                       state='queued', returncode=None, output=[],
+                       submitted=time.time(), finished=None)
+            self.jobs[job['id']] = job
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [self.jobs[i] for i in sorted(self.jobs)]
+
+    def _execute(self, job):
+        job['state'] = 'running'
+        try:
+            p = subprocess.Popen(self.cmd + job['args'],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            for line in iter(p.stdout.readline, ''):
+                job['output'].append(line.rstrip('\n'))
+            job['returncode'] = p.wait()
+            state = 'done' if job['returncode'] == 0 else 'failed'
+        except OSError as e:
+            job['output'].append(str(e))
+            state = 'failed'
+        # the status is updated before the job is reported as finished, such
+        # that clients polling the job never see the status from before it
+        self.status_cache.update_installed(force=True)
+        job['state'] = state
+        job['finished'] = time.time()
+
+    def _run(self):
+        while True:
+            self._execute(self.queue.get())
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+
 if __name__ == '__main__':
-    for v in get_status().itervalues():
+    sc = StatusCache()
+    sc.update_available()
+    for v in sc.get_status().itervalues():
         print '%(name)-20s %(version)16s %(a-ver)16s %(status)12s' % v
@@ -3,21 +3,27 @@ web-interface for enpkg command
 """
 import sys
 import time
-import subprocess
 import socket
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
 from os.path import dirname, isfile, join
 
 this_dir = dirname(__file__)
 sys.path.insert(0, this_dir)
 
-from bottle import get, post, request, run, view, debug, route, static_file
+from bottle import (get, post, request, run, view, debug, route, static_file,
+                    redirect, abort)
 
-from api import get_status
+from api import StatusCache, JobQueue
 import egginst
 
 
 debug(True)
 
+# created in main(), and shared by all requests
+status_cache = None
+jobs = None
+
 css_class_map = {
     'up-to-date': 'ok',
     'installed': 'ok',
@@ -28,9 +34,8 @@ css_class_map = {
 @get('/')
 @view(join(this_dir, 'update'))
 def update():
-    print "Called update"
     lst = []
-    status = get_status()
+    status = status_cache.get_status()
     for cname in sorted(status.iterkeys()):
         d = status[cname]
         lst.append((
@@ -38,15 +43,54 @@ def update():
                 d['name'], d['version'], d['a-ver'], d['status'],
                 d['status'].endswith('able'),
         ))
-    return {'items': lst}
+    return {'items': lst, 'jobs': jobs.list()}
 
 
 @post('/action')
 def action():
-    print 'request.forms', request.forms.dict
-    for name in request.forms.dict.iterkeys():
-        subprocess.call(['enpkg', name])
-    return update()
+    names = list(request.forms.dict.iterkeys())
+    if names:
+        jobs.submit(names)
+    redirect('/')
+
+
+@get('/api/status')
+def api_status():
+    return {'refreshed': status_cache.refreshed,
+            'error': status_cache.error,
+            'packages': status_cache.get_status()}
+
+
+@post('/api/refresh')
+def api_refresh():
+    status_cache.refresh()
+    return {'refreshed': status_cache.refreshed}
+
+
+@get('/api/jobs')
+def api_jobs():
+    return {'jobs': [dict(job, output=len(job['output']))
+                     for job in jobs.list()]}
+
+
+@post('/api/jobs')
+def api_submit():
+    names = request.forms.getall('name')
+    if not names:
+        abort(400, "no package names given")
+    return jobs.submit(names)
+
+
+@get('/api/jobs/:job_id#[0-9]+#')
+def api_job(job_id):
+    """
+    return the job, the output (lines) starting at ?since=N
+    """
+    job = jobs.get(int(job_id))
+    if job is None:
+        abort(404, "no such job: %s" % job_id)
+    since = int(request.GET.get('since', 0))
+    return dict(job, output=job['output'][since:])
 
 
 @route('/static/:path#.+#')
@@ -54,6 +98,10 @@ def server_static(path):
     return static_file(path, root=this_dir)
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
 def create_static_html():
     import tempfile
 
@@ -81,6 +129,13 @@ def main():
                  default=8080,
                  help="defaults to %default")
 
+    p.add_option("--interval",
+                 action="store",
+                 type="int",
+                 default=600,
+                 help="seconds between refreshing the indexes in the "
+                      "background, defaults to %default")
+
     opts, args = p.parse_args()
 
     port = int(opts.port)
@@ -91,11 +146,13 @@ def main():
         print 'opening in web-browser:', url
         webbrowser.open_new_tab(url)
 
-#    try:
-    run(host='localhost', port=port)
-#    except socket.error:
-#        print "Could not start web server, creating static html file"
-#        url = 'file://%s' % create_static_html()
+    global status_cache, jobs
+    status_cache = StatusCache(interval=opts.interval)
+    status_cache.start()
+    jobs = JobQueue(status_cache)
+    jobs.start()
+
+    run(host='localhost', port=port, server_class=ThreadingWSGIServer)
 
 
 if __name__ == '__main__':
@@ -5,6 +5,18 @@
 </head>
 <body>
   <h1>EPD Installed Packages</h1>
+%if jobs:
+  <h2>Jobs</h2>
+  <table>
+%for job in jobs:
+    <tr>
+      <td>enpkg {{' '.join(job['args'])}}</td>
+      <td>{{job['state']}}</td>
+      <td>{{job['output'][-1] if job['output'] else ''}}</td>
+    </tr>
+%end
+  </table>
+%end
   <form method="post" action="/action">
     <p><input type="submit" value="install" /></p>
     <table style="width: 100%;">